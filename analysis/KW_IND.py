@@ -2,10 +2,14 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+from bisect import bisect_left
 import numpy as np
 import pandas as pd
 from scipy.stats import kruskal, chi2, norm
 
+from parsed_table import ParsedTable, as_parsed
+from fenwick import FenwickTree
+
 TARGET_DEFAULT = "AGE"
 DEFAULT_BINS = [0, 18, 45, 65, 75, 200]
 METRICS_DEFAULT = [
@@ -49,7 +53,10 @@ def chi2_logp_safe(H: float, dfree: int) -> tuple[float, str]:
         mlog10p = -logp / np.log(10.0)
         p_str = f"1e-{mlog10p:.1f}" if mlog10p > 300 else f"{np.exp(logp):.3e}"
         return float(mlog10p), p_str
+    return _chi2_logp_tail(H, dfree)
 
+def _chi2_logp_tail(H: float, dfree: int) -> tuple[float, str]:
+    # chi2.logsf がアンダーフローした場合: Wilson–Hilferty 近似の正規分布の裾で求める
     v = float(dfree)
     w = (H / v) ** (1.0 / 3.0)
     mu = 1.0 - 2.0 / (9.0 * v)
@@ -66,6 +73,21 @@ def chi2_logp_safe(H: float, dfree: int) -> tuple[float, str]:
     p_str = f"1e-{mlog10p:.1f}"
     return float(mlog10p), p_str
 
+def chi2_mlog10p_many(H: np.ndarray, dfree: np.ndarray) -> np.ndarray:
+    """
+    chi2_logp_safe の -log10(p) を配列でまとめて求める（chi2.logsf は1回だけ呼ぶ）。
+    logsf が有限でない要素だけ chi2_logp_safe で1つずつ求める。
+    """
+    H = np.asarray(H, dtype=float)
+    dfree = np.asarray(dfree)
+    if len(H) == 0:
+        return np.zeros(0)
+    logp = chi2.logsf(H, dfree)
+    out = -logp / np.log(10.0)
+    for i in np.flatnonzero(~np.isfinite(logp)):
+        out[i], _ = _chi2_logp_tail(float(H[i]), int(dfree[i]))
+    return out
+
 def eta2_kw(H: float, n_eff: int, k_used: int) -> float:
     if n_eff <= 1:
         return 0.0
@@ -94,21 +116,153 @@ def vargha_delaney_A(x: np.ndarray, y: np.ndarray) -> float:
     return float(np.clip(A, 0.0, 1.0))
 
 def multi_group_A_metrics(groups: list[np.ndarray]) -> tuple[float, float]:
-    A_sum = 0.0
-    Asym_sum = 0.0
-    w_sum = 0.0
-    for i in range(len(groups)):
-        for j in range(i + 1, len(groups)):
-            xi, xj = groups[i], groups[j]
-            if len(xi) == 0 or len(xj) == 0:
-                continue
-            A = vargha_delaney_A(xi, xj)
-            w = len(xi) * len(xj)
-            A_sum += w * A
-            Asym_sum += w * (2.0 * abs(A - 0.5))
-            w_sum += w
-    if w_sum == 0:
+    """
+    全 i<j の群の組の Vargha–Delaney A（vargha_delaney_A）を、組の件数の積で重み付けした平均
+    (A_pair_avg) と 2|A - 0.5| の重み付き平均 (A_pair_sym)。
+    群の組ごとに並べ替えず、全群をまとめた1回の並べ替え（値×群の件数表）から全ての組の U を求める。
+    groups は NaN を含まない配列のリスト。
+    """
+    sizes = [len(x) for x in groups]
+    if sum(sizes) == 0:
         return 0.5, 0.0
+    y = np.concatenate([np.asarray(x, dtype=float) for x in groups])
+    g_codes = np.repeat(np.arange(len(groups)), sizes)
+    return pairwise_A_metrics(value_group_histogram(y, g_codes, len(groups)))
+
+# ==== 値×群の件数表（ヒストグラム）からの計算 ====
+
+KW_ENGINES = ["hist", "scipy"]
+
+# 整数値の件数表を値の範囲の長さで直接作る上限（これを超える範囲は一意値でまとめる）
+_HIST_DIRECT_RANGE = 1 << 20
+
+def value_codes(y: np.ndarray) -> tuple[np.ndarray, int]:
+    """
+    値の昇順のコード（同じ値は同じコード）とコードの数。
+    値がすべて整数（件数・回数の列）で範囲が狭い場合は並べ替えずに 値 - 最小値 をコードにする
+    （この場合、どの行にも無いコードを含む）。
+    """
+    y = np.asarray(y, dtype=float)
+    if len(y) == 0:
+        return np.zeros(0, dtype=np.int64), 0
+    lo, hi = y.min(), y.max()
+    if np.isfinite(lo) and np.isfinite(hi) and hi - lo < _HIST_DIRECT_RANGE and np.all(y == np.floor(y)):
+        return (y - lo).astype(np.int64), int(hi - lo) + 1
+    _, codes = np.unique(y, return_inverse=True)
+    codes = codes.reshape(-1).astype(np.int64, copy=False)
+    return codes, int(codes.max()) + 1
+
+def value_group_histogram(y: np.ndarray, g_codes: np.ndarray, k: int) -> np.ndarray:
+    """
+    値×群の件数表 C（V×k）。行は値の昇順で、どの群にも無い値の行は除く。
+    値がすべて整数（件数・回数の列）で範囲が狭い場合は np.bincount だけで O(n + 範囲×k) で作る。
+    """
+    codes, n_vals = value_codes(y)
+    g_codes = np.asarray(g_codes, dtype=np.int64)
+    C = np.bincount(codes * k + g_codes, minlength=n_vals * k).reshape(n_vals, k)
+    return C[C.sum(axis=1) > 0]
+
+def kw_from_histogram(C: np.ndarray) -> tuple[float, float, float, float] | None:
+    """
+    値×群の件数表 C（kruskal に渡す群の列だけ）から、
+    kruskal の H・rank_eta2・multi_group_A_metrics の (A_pair_avg, A_pair_sym) を求める。
+    平均順位は 値ごとの件数の累積 + (件数 + 1) / 2 で、各群の順位和・群の組ごとの U はその件数の積和で求める。
+    順位（と順位和・U）は 0.5 刻みで誤差なく表せるので、scipy / pandas と同じ順序で足し合わせれば
+    値はビット単位で一致する。
+    すべての値が同じ（kruskal が例外を出す）場合は None を返す。
+    """
+    C = np.asarray(C, dtype=float)
+    n = C.sum(axis=0)
+    t = C.sum(axis=1)
+    N = float(t.sum())
+
+    # 値ごとの平均順位と群ごとの順位和
+    below = np.cumsum(t) - t
+    r = below + (t + 1.0) / 2.0
+    R = C.T @ r
+
+    cnt = t[t > 0]
+    tie_sum = (cnt ** 3 - cnt).sum()
+    ybar = (N * (N + 1) / 2.0) / N if N > 0 else np.nan
+    sst = float((t * (r - ybar) ** 2).sum()) if N > 0 else 0.0
+    U, _ = pairwise_A_matrix(C)
+    return kw_from_rank_sums(n, R, tie_sum, sst, U)
+
+def kw_from_rank_sums(n: np.ndarray, R: np.ndarray, tie_sum: float, sst: float,
+                      U: np.ndarray) -> tuple[float, float, float, float] | None:
+    """
+    群ごとの件数 n・順位和 R、同順位の補正 Σ(t^3 - t)（t は値ごとの件数）、順位の偏差平方和 sst、
+    群の組ごとの Mann–Whitney U（G×G、i<j の要素だけ使う）から kw_from_histogram と同じ値を求める。
+    （KWMetricState はこれらを差分更新で保持している）
+    """
+    n = np.asarray(n, dtype=float)
+    R = np.asarray(R, dtype=float)
+    N = float(n.sum())
+    G = len(n)
+
+    # Kruskal–Wallis（scipy.stats.kruskal と同じ計算順。空の群があれば同順位の判定より先に NaN）
+    if (n == 0).any():
+        H = np.nan
+    else:
+        ties = 1.0 if N < 2 else 1.0 - tie_sum / (N ** 3 - N)
+        if ties == 0:
+            return None
+        ssbn = 0
+        for i in range(G):
+            ssbn += float(R[i]) * R[i] / n[i]
+        H = 12.0 / (N * (N + 1)) * ssbn - 3 * (N + 1)
+        H /= ties
+
+    # rank_eta2
+    ybar = (N * (N + 1) / 2.0) / N if N > 0 else np.nan
+    ssb = 0.0
+    for i in range(G):
+        if n[i] > 0:
+            ssb += n[i] * (R[i] / n[i] - ybar) ** 2
+    r_eta = float(ssb / sst) if sst > 0 else 0.0
+
+    A_avg, A_sym = pairwise_A_from_U(U, n)
+    return float(H), r_eta, A_avg, A_sym
+
+def pairwise_A_matrix(C: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    値×群の件数表 C から、全ての群の組 (i, j) の Mann–Whitney U と Vargha–Delaney A（G×G）を求める。
+    U_ij = Σ_v C[v,i] * (群 j の v 未満の件数 + 群 j の v の件数 / 2)、A_ij = U_ij / (n_i n_j)。
+    どちらかの群が空の組の A は NaN。
+    """
+    C = np.asarray(C, dtype=float)
+    n = C.sum(axis=0)
+    U = C.T @ (np.cumsum(C, axis=0) - 0.5 * C)
+    return U, _A_from_U(U, n)
+
+def _A_from_U(U: np.ndarray, n: np.ndarray) -> np.ndarray:
+    w = np.outer(n, n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(w > 0, np.clip(U / w, 0.0, 1.0), np.nan)
+
+def pairwise_A_metrics(C: np.ndarray) -> tuple[float, float]:
+    """
+    値×群の件数表 C から multi_group_A_metrics と同じ (A_pair_avg, A_pair_sym) を求める。
+    """
+    U, _ = pairwise_A_matrix(C)
+    return pairwise_A_from_U(U, np.asarray(C, dtype=float).sum(axis=0))
+
+def pairwise_A_from_U(U: np.ndarray, n: np.ndarray) -> tuple[float, float]:
+    """
+    群の組ごとの U（G×G）と群の件数 n から (A_pair_avg, A_pair_sym) を求める。
+    重み付きの和は群の組の順（i<j の辞書順）に前から足す（ループで足した場合とビット単位で一致する）。
+    """
+    n = np.asarray(n, dtype=float)
+    A = _A_from_U(np.asarray(U, dtype=float), n)
+    iu, ju = np.triu_indices(len(n), k=1)
+    ok = (n[iu] > 0) & (n[ju] > 0)
+    if not ok.any():
+        return 0.5, 0.0
+    w = n[iu[ok]] * n[ju[ok]]
+    A = A[iu[ok], ju[ok]]
+    w_sum = np.cumsum(w)[-1]
+    A_sum = np.cumsum(w * A)[-1]
+    Asym_sum = np.cumsum(w * (2.0 * np.abs(A - 0.5)))[-1]
     return float(A_sum / w_sum), float(Asym_sum / w_sum)
 
 def h_max_no_ties(counts: list[int] | np.ndarray) -> float:
@@ -136,13 +290,235 @@ def normalize_mlog10p(x, method=DEFAULT_P_NORM, scale=DEFAULT_P_SCALE, cap=DEFAU
 
 # ==== 1つのCSVに対して KW 指標を算出 ====
 
-def compute_kw_table(df:pd.DataFrame, # csv_path: str,
+def kw_effects(H: float, r_eta: float, A_avg: float, A_sym: float, used_sizes: list[int],
+               p_norm: str, p_scale: float, p_cap: float, mlog10p: float | None = None) -> list[float]:
+    """
+    H・rank_eta2・A 指標と使った群のサイズから、NUM_COLS の並びの 0〜1 指標を作る。
+    mlog10p（chi2_logp_safe の値）を渡すとそれを使う。
+    """
+    n_eff = sum(used_sizes)
+    k_used = len(used_sizes)
+    dfree = k_used - 1
+    if mlog10p is None:
+        mlog10p, _ = chi2_logp_safe(float(H), dfree)
+
+    # 効果量
+    eps = (H - dfree) / (n_eff - dfree) if (n_eff - dfree) > 0 else 0.0
+    eps = float(np.clip(eps, 0.0, 1.0))
+    eta = eta2_kw(float(H), int(n_eff), int(k_used))
+
+    # H の 0-1 正規化（H/Hmax）
+    Hmax = h_max_no_ties(used_sizes)
+    H_scaled_max = float(H / Hmax) if Hmax > 0 else 0.0
+    H_scaled_max = float(np.clip(H_scaled_max, 0.0, 1.0))
+
+    # minus_log10_p の 0-1 正規化（飽和しにくい）
+    pnorm = float(normalize_mlog10p(mlog10p, method=p_norm, scale=p_scale, cap=p_cap))
+
+    return [H_scaled_max, pnorm, eps, eta, float(r_eta), A_avg, A_sym]
+
+def kw_values_from_histogram(C: np.ndarray, min_per_group: int,
+                             p_norm: str, p_scale: float, p_cap: float) -> list[float]:
+    """
+    値×年齢群の件数表（全群の列）から compute_kw_table の1行分（NUM_COLS の並び）を求める。
+    件数が min_per_group 未満の群は除き、使える群が2未満・値がすべて同じなら 0。
+    """
+    sizes = np.asarray(C).sum(axis=0)
+    used = [i for i in range(len(sizes)) if sizes[i] >= min_per_group]
+    if len(used) < 2:
+        return [0.0] * len(NUM_COLS)
+    res = kw_from_histogram(np.asarray(C)[:, used])
+    if res is None:
+        return [0.0] * len(NUM_COLS)
+    H, r_eta, A_avg, A_sym = res
+    return kw_effects(H, r_eta, A_avg, A_sym, [int(sizes[i]) for i in used], p_norm, p_scale, p_cap)
+
+def _kw_values_scipy(y: np.ndarray, g_codes: np.ndarray, k: int, min_per_group: int,
+                     p_norm: str, p_scale: float, p_cap: float) -> list[float]:
+    """kw_values_from_histogram と同じ値を scipy.stats.kruskal と群ごとの順位付けで求める（確認用）"""
+    # 各群
+    grp_vals = [y[g_codes == i] for i in range(k)]
+    used_vals = [arr for arr in grp_vals if len(arr) >= min_per_group]
+    k_used = len(used_vals)
+
+    if k_used < 2:
+        return [0.0] * len(NUM_COLS)
+
+    # Kruskal–Wallis
+    try:
+        H, _ = kruskal(*used_vals)
+    except Exception:
+        return [0.0] * len(NUM_COLS)
+
+    g_codes = np.concatenate([np.full(len(arr), i, dtype=int) for i, arr in enumerate(used_vals)])
+    r_eta = rank_eta2(y=np.concatenate(used_vals), g_codes=g_codes, G=k_used)
+    A_avg, A_sym = multi_group_A_metrics(used_vals)
+    return kw_effects(H, r_eta, A_avg, A_sym, [len(arr) for arr in used_vals], p_norm, p_scale, p_cap)
+
+# ==== 全 metric の一括計算（n×M の値の行列） ====
+
+def stacked_value_group_histogram(Y: np.ndarray, g_codes: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    n×M の値の行列 Y（列が metric、NaN は使わない）と年齢群のコード g_codes（-1 は群なし）から、
+    metric ごとの 値×群 の件数表（value_group_histogram と同じ）を metric の順に縦に積んだ表 C と、
+    C の各行の metric の番号 seg を返す。件数表は1回の np.bincount で作る。
+    """
+    Y = np.asarray(Y, dtype=float)
+    n, M = Y.shape
+    g_codes = np.asarray(g_codes, dtype=np.int64)
+    valid = ~np.isnan(Y) & (g_codes >= 0)[:, None]
+
+    # 整数値（件数・回数の列）で範囲が狭い列は 値 - 最小値 をコードにする（value_codes と同じ）
+    lo = np.where(valid, Y, np.inf).min(axis=0, initial=np.inf)
+    hi = np.where(valid, Y, -np.inf).max(axis=0, initial=-np.inf)
+    is_int = np.where(valid, Y == np.floor(Y), True).all(axis=0)
+    direct = is_int & np.isfinite(lo) & np.isfinite(hi) & (hi - lo < _HIST_DIRECT_RANGE)
+    codes = np.zeros((n, M), dtype=np.int64)
+    n_vals = np.zeros(M, dtype=np.int64)
+    if direct.any():
+        codes[:, direct] = np.where(valid[:, direct], Y[:, direct] - lo[direct], 0).astype(np.int64)
+        n_vals[direct] = (hi[direct] - lo[direct]).astype(np.int64) + 1
+    for m in np.flatnonzero(~direct):
+        codes[valid[:, m], m], n_vals[m] = value_codes(Y[valid[:, m], m])
+
+    offsets = np.concatenate(([0], np.cumsum(n_vals * k)[:-1]))
+    cols = np.broadcast_to(np.arange(M), (n, M))[valid]
+    flat = offsets[cols] + codes[valid] * k + np.broadcast_to(g_codes[:, None], (n, M))[valid]
+    C = np.bincount(flat, minlength=int((n_vals * k).sum())).reshape(-1, k)
+    seg = np.repeat(np.arange(M), n_vals)
+    keep = C.sum(axis=1) > 0
+    return C[keep], seg[keep]
+
+def _segment_sum(X: np.ndarray, seg: np.ndarray, M: int) -> np.ndarray:
+    """行ごとの metric 番号 seg（昇順）で区切った、metric ごとの行方向の和（行の無い metric は 0）"""
+    out = np.zeros((M,) + X.shape[1:], dtype=X.dtype)
+    if len(seg):
+        starts = np.flatnonzero(np.concatenate(([True], seg[1:] != seg[:-1])))
+        out[seg[starts]] = np.add.reduceat(X, starts, axis=0)
+    return out
+
+def _segment_cumsum(X: np.ndarray, seg: np.ndarray, M: int) -> np.ndarray:
+    """行ごとの metric 番号 seg（昇順）で区切った、metric ごとの行方向の累積和"""
+    cs = np.cumsum(X, axis=0)
+    first = np.searchsorted(seg, np.arange(M))
+    before = np.concatenate((np.zeros((1,) + X.shape[1:], dtype=cs.dtype), cs))[first]
+    return cs - before[seg]
+
+def kw_values_matrix(Y: np.ndarray, g_codes: np.ndarray, k: int, min_per_group: int,
+                     p_norm: str, p_scale: float, p_cap: float) -> np.ndarray:
+    """
+    n×M の値の行列 Y と年齢群のコード g_codes（-1 は群なし）から、全 metric の KW 指標
+    （M×NUM_COLS、kw_values_from_histogram を metric ごとに呼んだ値と同じ）をまとめて求める。
+
+    metric ごとの件数表を縦に積んだ表（stacked_value_group_histogram）に対して、
+    平均順位・群ごとの順位和・同順位の補正・順位の偏差平方和・群の組ごとの U を metric ごとの累積和・和
+    （np.add.reduceat）でまとめて求め、H・効果量は metric 方向にベクトル化して計算する。
+    順位和などは 0.5 刻みの値の和で誤差なく求まり、群・群の組についての和は kw_from_rank_sums と
+    同じ順に足すので、値はビット単位で一致する。
+    """
+    Y = np.asarray(Y, dtype=float)
+    M = Y.shape[1]
+    out = np.zeros((M, len(NUM_COLS)))
+    if M == 0:
+        return out
+    C, seg = stacked_value_group_histogram(Y, g_codes, k)
+
+    # 群のサイズと使う群（件数が min_per_group 以上）
+    n = _segment_sum(C, seg, M)
+    used = n >= min_per_group
+    k_used = used.sum(axis=1)
+    n_used = np.where(used, n, 0)
+    N_int = n_used.sum(axis=1)
+    N = N_int.astype(float)
+
+    # 値ごとの平均順位（使う群だけで数える）と群ごとの順位和
+    t = (C * used[seg]).sum(axis=1)
+    below = _segment_cumsum(t, seg, M) - t
+    r = below + (t + 1.0) / 2.0
+    R = _segment_sum(C * r[:, None], seg, M)
+
+    tf = t.astype(float)
+    tie_sum = _segment_sum(tf ** 3 - tf, seg, M)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ybar = np.where(N > 0, (N * (N + 1) / 2.0) / N, np.nan)
+        sst = np.where(N > 0, _segment_sum(tf * (r - ybar[seg]) ** 2, seg, M), 0.0)
+
+    # 群の組ごとの U（全ての群について求め、使う群の組だけ使う）
+    D = _segment_cumsum(C, seg, M) - 0.5 * C
+    U = _segment_sum(C[:, :, None] * D[:, None, :], seg, M)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Kruskal–Wallis（kw_from_rank_sums と同じ計算順）
+        ties = np.where(N < 2, 1.0, 1.0 - tie_sum / (N ** 3 - N))
+        has_empty = (used & (n == 0)).any(axis=1)
+        ok = (k_used >= 2) & ((ties != 0) | has_empty)
+        ssbn = np.zeros(M)
+        for i in range(k):
+            ssbn = np.where(used[:, i], ssbn + R[:, i] * R[:, i] / n_used[:, i], ssbn)
+        H = 12.0 / (N * (N + 1)) * ssbn - 3 * (N + 1)
+        H /= ties
+        H = np.where(has_empty, np.nan, H)
+
+        # rank_eta2
+        ssb = np.zeros(M)
+        for i in range(k):
+            ssb = np.where(used[:, i] & (n[:, i] > 0), ssb + n_used[:, i] * (R[:, i] / n_used[:, i] - ybar) ** 2, ssb)
+        r_eta = np.where(sst > 0, ssb / sst, 0.0)
+
+        # A_pair_avg / A_pair_sym（群の組の i<j の辞書順に前から足す）
+        w_sum = np.zeros(M)
+        A_sum = np.zeros(M)
+        Asym_sum = np.zeros(M)
+        for i, j in zip(*np.triu_indices(k, k=1)):
+            pair = used[:, i] & used[:, j] & (n[:, i] > 0) & (n[:, j] > 0)
+            w = n_used[:, i].astype(float) * n_used[:, j]
+            A = np.clip(U[:, i, j] / w, 0.0, 1.0)
+            w_sum = np.where(pair, w_sum + w, w_sum)
+            A_sum = np.where(pair, A_sum + w * A, A_sum)
+            Asym_sum = np.where(pair, Asym_sum + w * (2.0 * np.abs(A - 0.5)), Asym_sum)
+        A_avg = np.where(w_sum > 0, A_sum / w_sum, 0.5)
+        A_sym = np.where(w_sum > 0, Asym_sum / w_sum, 0.0)
+
+        # 効果量（kw_effects と同じ式）
+        dfree = k_used - 1
+        eps = np.clip(np.where(N_int - dfree > 0, (H - dfree) / (N_int - dfree), 0.0), 0.0, 1.0)
+        eta = np.where(N_int <= 1, 0.0, np.clip((H - (k_used - 1.0)) / (N_int - 1.0), 0.0, 1.0))
+
+        # H の最大値（h_max_no_ties と同じ。使わない群は件数 0 として累積に影響しない）
+        c = n_used.astype(float)
+        prefix = np.cumsum(c, axis=1) - c
+        Rbar = prefix + (c + 1.0) / 2.0
+        overall = (N + 1.0) / 2.0
+        Hmax = (12.0 / (N * (N + 1.0))) * (c * (Rbar - overall[:, None]) ** 2).sum(axis=1)
+        Hmax = np.where((N > 1) & ~(used & (n <= 0)).any(axis=1), np.maximum(Hmax, 0.0), 0.0)
+        H_scaled_max = np.clip(np.where(Hmax > 0, H / Hmax, 0.0), 0.0, 1.0)
+
+    mlog10p = np.zeros(M)
+    mlog10p[ok] = chi2_mlog10p_many(H[ok], dfree[ok])
+    pnorm = normalize_mlog10p(mlog10p, method=p_norm, scale=p_scale, cap=p_cap)
+
+    values = np.column_stack([H_scaled_max, pnorm, eps, eta, r_eta, A_avg, A_sym])
+    out[ok] = values[ok]
+    return out
+
+def compute_kw_table(df:pd.DataFrame | ParsedTable, # csv_path: str,
                      age_col_name: str,
                      metrics_csv: str,
                      custom_bins_str: str,
                      min_per_group: int,
-                     p_norm: str, p_scale: float, p_cap: float) -> pd.DataFrame:
-    
+                     p_norm: str, p_scale: float, p_cap: float,
+                     engine: str = "hist") -> pd.DataFrame:
+    """
+    1つの表の metric ごとの KW 指標（[metric] + NUM_COLS、metric の辞書順）を返す。
+    engine="hist" は metric の列を n×M の行列にまとめ、値×年齢群の件数表から全 metric の
+    H・順位・効果量を一度に求め（kw_values_matrix）、
+    engine="scipy" は metric ごとに scipy.stats.kruskal と群ごとの順位付けで求める（結果は一致する。確認用）。
+    """
+    if engine not in KW_ENGINES:
+        raise ValueError(f"engine は {KW_ENGINES} のいずれか: {engine}")
+
+    # 解析済み（ParsedTable）なら数値化を再実行しない
+    df = as_parsed(df)
     age_col = find_col_case_insensitive(df, age_col_name)
     if age_col is None:
         # raise SystemExit(f"[{csv_path}] 年齢列 {age_col_name} が見つかりません。")
@@ -158,77 +534,311 @@ def compute_kw_table(df:pd.DataFrame, # csv_path: str,
         # どれも無ければ空表（あとで0埋め差分可）
         return pd.DataFrame(columns=["metric"] + NUM_COLS)
 
-    custom_bins = DEFAULT_BINS if not custom_bins_str.strip() else [float(x) for x in custom_bins_str.split(",") if x.strip()]
-    groups_ser = make_age_groups_by_custom_bins(df[age_col], custom_bins)
-
-    rows = []
-    for m in metrics:
-        if m not in df.columns:
-            # 無い metric は0埋め（差分用）
-            rows.append({"metric": m, **{k: 0.0 for k in NUM_COLS}})
-            continue
-
-        y_all = pd.to_numeric(df[m], errors="coerce")
-        mask = y_all.notna() & groups_ser.notna()
-        y = y_all[mask].to_numpy(dtype=float)
-        g = pd.Categorical(groups_ser[mask])
-        labels = list(g.categories.astype(str))
-        k = len(labels)
-
-        # 各群
-        grp_vals = [y[g.codes == i] for i in range(k)]
-        used_vals = [arr for arr in grp_vals if len(arr) >= min_per_group]
-        n_eff = sum(len(arr) for arr in used_vals)
-        k_used = len(used_vals)
-
-        if k_used < 2:
-            rows.append({"metric": m, **{k: 0.0 for k in NUM_COLS}})
-            continue
-
-        # Kruskal–Wallis
-        try:
-            H, _ = kruskal(*used_vals)
-        except Exception:
-            rows.append({"metric": m, **{k: 0.0 for k in NUM_COLS}})
-            continue
-
-        dfree = k_used - 1
-        mlog10p, _ = chi2_logp_safe(float(H), dfree)
-
-        # 効果量
-        eps = (H - dfree) / (n_eff - dfree) if (n_eff - dfree) > 0 else 0.0
-        eps = float(np.clip(eps, 0.0, 1.0))
-        eta = eta2_kw(float(H), int(n_eff), int(k_used))
-        g_codes = np.concatenate([np.full(len(arr), i, dtype=int) for i, arr in enumerate(used_vals)])
-        r_eta = rank_eta2(y=np.concatenate(used_vals), g_codes=g_codes, G=k_used)
-        A_avg, A_sym = multi_group_A_metrics(used_vals)
-
-        # H の 0-1 正規化（H/Hmax）
-        Hmax = h_max_no_ties([len(arr) for arr in used_vals])
-        H_scaled_max = float(H / Hmax) if Hmax > 0 else 0.0
-        H_scaled_max = float(np.clip(H_scaled_max, 0.0, 1.0))
-
-        # minus_log10_p の 0-1 正規化（飽和しにくい）
-        pnorm = float(normalize_mlog10p(mlog10p, method=p_norm, scale=p_scale, cap=p_cap))
-
-        rows.append({
-            "metric": m,
-            "H_norm": H_scaled_max,
-            "minus_log10_p_norm": pnorm,
-            "epsilon2": eps,
-            "eta2_kw": eta,
-            "rank_eta2": float(r_eta),
-            "A_pair_avg": A_avg,
-            "A_pair_sym": A_sym
-        })
-
-    out = pd.DataFrame(rows, columns=["metric"] + NUM_COLS)
-    # 欠損は0埋め
-    for c in NUM_COLS:
-        out[c] = pd.to_numeric(out[c], errors="coerce").fillna(0.0)
-    out = out.sort_values("metric", kind="mergesort").reset_index(drop=True)
+    custom_bins = parse_custom_bins(custom_bins_str)
+    groups_ser = make_age_groups_by_custom_bins(df.numeric_series(age_col), custom_bins)
+
+    # 年齢群のコード（群なしは -1）は全 metric で共通
+    g_codes = np.asarray(groups_ser.cat.codes, dtype=np.int64)
+    k = len(groups_ser.cat.categories)
+
+    if engine == "hist":
+        # metric の列を n×M の行列にまとめ、全 metric を一度に計算する
+        Y = np.column_stack([df.numeric[m] for m in metrics])
+        values = kw_values_matrix(Y, g_codes, k, min_per_group, p_norm, p_scale, p_cap)
+    else:
+        values = []
+        for m in metrics:
+            y_all = df.numeric[m]
+            mask = ~np.isnan(y_all) & (g_codes >= 0)
+            values.append(_kw_values_scipy(y_all[mask], g_codes[mask], k, min_per_group, p_norm, p_scale, p_cap))
+    # 欠損は0埋めし、metric の辞書順（同名は指定順）に並べる
+    values = np.asarray(values, dtype=float).reshape(len(metrics), len(NUM_COLS))
+    values = np.where(np.isnan(values), 0.0, values)
+    order = sorted(range(len(metrics)), key=lambda i: metrics[i])
+    out = pd.DataFrame(values[order], columns=NUM_COLS)
+    out.insert(0, "metric", [metrics[i] for i in order])
     return out
 
+def parse_custom_bins(custom_bins) -> list[float]:
+    """--custom-bins の文字列（カンマ区切り）または数値の並び。空なら DEFAULT_BINS"""
+    if isinstance(custom_bins, str):
+        if not custom_bins.strip():
+            return DEFAULT_BINS
+        return [float(x) for x in custom_bins.split(",") if x.strip()]
+    return [float(x) for x in custom_bins]
+
+# ==== 年齢の区切りを変えた KW 指標の一括計算 ====
+
+# 値×年齢（一意値）の累積件数表の要素数の上限（これを超える metric は区切りごとに行から件数表を作る）
+_SWEEP_MAX_CELLS = 1 << 22
+
+class KWBinSweep:
+    """
+    年齢の区切り（--custom-bins）を何通りも変えて compute_kw_table の値を求めるための前計算。
+
+    metric ごとに 値×年齢（一意値の昇順）の件数表を累積した表を1回だけ作る。
+    区切りごとの 値×年齢群 の件数表は、年齢群に入る年齢の範囲の両端の累積件数の差（隣り合う年齢の
+    件数をまとめたもの）で求まり、あとは kw_values_from_histogram で計算する。
+    年齢群の割り当ては年齢の一意値に make_age_groups_by_custom_bins を適用して決めるので、
+    compute_kw_table と同じ群になり、値もビット単位で一致する。
+
+    sweep = KWBinSweep(df)
+    arr = sweep.evaluate(["0,18,65,200", DEFAULT_BINS])   # 区切り × metric × NUM_COLS
+    """
+
+    def __init__(self, df: pd.DataFrame | ParsedTable, age_col_name: str = TARGET_DEFAULT,
+                 metrics_csv: str = ",".join(METRICS_DEFAULT)):
+        df = as_parsed(df)
+        age_col = find_col_case_insensitive(df, age_col_name)
+        if age_col is None:
+            raise SystemExit(f"年齢列 {age_col_name} が見つかりません。")
+
+        metric_names = [m.strip() for m in metrics_csv.split(",") if m.strip()]
+        metrics = [find_col_case_insensitive(df, m) for m in metric_names]
+        # compute_kw_table の出力と同じ並び（metric の辞書順、同名は指定順）
+        self.metrics = sorted(m for m in metrics if m is not None)
+
+        age = df.numeric[age_col]
+        age_ok = ~np.isnan(age)
+        self.ages, age_codes = np.unique(age[age_ok], return_inverse=True)
+        age_codes = age_codes.reshape(-1)
+        A = len(self.ages)
+
+        # metric ごとに 累積件数表 cum（V×(A+1)、cum[:, j] は小さい方から j 個の年齢の件数）か、
+        # 大きすぎる場合は行ごとの (値コード, 年齢コード)
+        self._cum: list[np.ndarray | None] = []
+        self._rows: list[tuple[np.ndarray, np.ndarray, int] | None] = []
+        for m in self.metrics:
+            y = df.numeric[m][age_ok]
+            ok = ~np.isnan(y)
+            codes, n_vals = value_codes(y[ok])
+            a = age_codes[ok]
+            if n_vals * (A + 1) <= _SWEEP_MAX_CELLS:
+                H = np.bincount(codes * A + a, minlength=n_vals * A).reshape(n_vals, A)
+                H = H[H.sum(axis=1) > 0]
+                cum = np.zeros((len(H), A + 1), dtype=np.int64)
+                np.cumsum(H, axis=1, out=cum[:, 1:])
+                self._cum.append(cum)
+                self._rows.append(None)
+            else:
+                self._cum.append(None)
+                self._rows.append((codes, a, n_vals))
+
+    def age_groups(self, custom_bins) -> np.ndarray:
+        """年齢の一意値ごとの年齢群の番号（どの群にも入らない年齢は -1）"""
+        bins = parse_custom_bins(custom_bins)
+        ages = self.ages if len(self.ages) else np.array([np.nan])
+        groups = make_age_groups_by_custom_bins(pd.Series(ages), bins)
+        return np.asarray(groups.cat.codes, dtype=np.int64)[:len(self.ages)]
+
+    def histograms(self, custom_bins) -> list[np.ndarray]:
+        """metric ごとの 値×年齢群 の件数表（compute_kw_table(engine="hist") の件数表と同じ）"""
+        bins = parse_custom_bins(custom_bins)
+        k = len(bins) - 1
+        group = self.age_groups(bins)
+        valid = group >= 0
+        # 年齢は昇順なので、各群に入る年齢は連続した範囲 [start, stop)
+        sizes = np.bincount(group[valid], minlength=k)
+        first = int(np.argmax(valid)) if valid.any() else 0
+        stop = first + np.cumsum(sizes)
+        start = stop - sizes
+
+        out = []
+        for cum, rows in zip(self._cum, self._rows):
+            if cum is not None:
+                C = cum[:, stop] - cum[:, start]
+            else:
+                codes, a, n_vals = rows
+                g = group[a]
+                ok = g >= 0
+                C = np.bincount(codes[ok] * k + g[ok], minlength=n_vals * k).reshape(n_vals, k)
+            out.append(C[C.sum(axis=1) > 0])
+        return out
+
+    def evaluate(self, layouts: list, min_per_group: int = 2, p_norm: str = DEFAULT_P_NORM,
+                 p_scale: float = DEFAULT_P_SCALE, p_cap: float = DEFAULT_P_CAP) -> np.ndarray:
+        """
+        区切りのリスト layouts（各要素は "0,18,65,200" のような文字列か数値の並び。"" は DEFAULT_BINS）に
+        ついて KW 指標を求める。
+
+        Returns:
+        np.ndarray: 区切り × metric（self.metrics の並び）× NUM_COLS の配列（欠損は 0）
+        """
+        out = np.zeros((len(layouts), len(self.metrics), len(NUM_COLS)))
+        # 先に全ての区切り・metric の H を求め、p 値は chi2_mlog10p_many でまとめて計算する
+        cells = []
+        for li, bins in enumerate(layouts):
+            for mi, C in enumerate(self.histograms(bins)):
+                sizes = C.sum(axis=0)
+                used = [i for i in range(len(sizes)) if sizes[i] >= min_per_group]
+                if len(used) < 2:
+                    continue
+                res = kw_from_histogram(C[:, used])
+                if res is not None:
+                    cells.append((li, mi, res, [int(sizes[i]) for i in used]))
+        mlog10p = chi2_mlog10p_many(np.array([res[0] for _, _, res, _ in cells]),
+                                    np.array([len(used_sizes) - 1 for *_, used_sizes in cells], dtype=int))
+        for (li, mi, res, used_sizes), mp in zip(cells, mlog10p):
+            out[li, mi] = kw_effects(*res, used_sizes, p_norm, p_scale, p_cap, mlog10p=float(mp))
+        return np.where(np.isnan(out), 0.0, out)
+
+    def table(self, custom_bins, min_per_group: int = 2, p_norm: str = DEFAULT_P_NORM,
+              p_scale: float = DEFAULT_P_SCALE, p_cap: float = DEFAULT_P_CAP) -> pd.DataFrame:
+        """1つの区切りについて compute_kw_table と同じ形の表"""
+        values = self.evaluate([custom_bins], min_per_group, p_norm, p_scale, p_cap)[0]
+        out = pd.DataFrame(values, columns=NUM_COLS)
+        out.insert(0, "metric", self.metrics)
+        return out
+
+# ==== 1行単位の差分更新 ====
+
+class KWMetricState:
+    """
+    1つの metric の KW 指標（kw_values_from_histogram の値）を、1件（値, 年齢群）の追加・削除で
+    差分更新する状態（局所探索型の匿名化で1行ずつ AGE や metric を書き換える用途）。
+
+    値の昇順の位置ごとに群ごとの件数を Fenwick 木（fenwick.FenwickTree）で持ち、
+      使う群（件数が min_per_group 以上の群）: 値ごとの件数の和の Fenwick 木、群ごとの順位和 R、
+                                               同順位の補正 Σ(t^3 - t)
+      全ての群の組                           : Mann–Whitney U
+    を保持する。値 x を群 a に加えると x より大きい値の順位は 1、x と同じ値の順位は 0.5 ずつ上がるので、
+    R の変化は群ごとの x より上・x と同じ件数から、U の変化は群 a の行と列だけで求まり、
+    1件の追加・削除は O(k log V)（k は群の数、V は値の種類数）で行数によらない。
+    順位和・U は 2 倍した整数で持つので更新を繰り返しても誤差は蓄積せず、
+    値は件数表から kw_values_from_histogram で計算し直した場合とビット単位で一致する。
+    使う群が変わる場合と、値の候補に無い値が加わる場合だけ件数表から作り直す。
+    """
+
+    def __init__(self, y: np.ndarray, g_codes: np.ndarray, k: int, min_per_group: int = 2, keys=None):
+        y = np.asarray(y, dtype=float)
+        g_codes = np.asarray(g_codes, dtype=np.int64)
+        keys = np.unique(y) if keys is None else np.union1d(np.asarray(keys, dtype=float), np.unique(y))
+        C = np.zeros((len(keys), k), dtype=np.int64)
+        np.add.at(C, (np.searchsorted(keys, y), g_codes), 1)
+        self.k = k
+        self.min_per_group = min_per_group
+        self._build(keys, C)
+
+    def _build(self, keys: np.ndarray, C: np.ndarray):
+        self.keys = keys.tolist()
+        self._pos = {v: i for i, v in enumerate(self.keys)}
+        self.C = C
+        self.n = [int(x) for x in C.sum(axis=0)]
+        self.trees = [FenwickTree(len(self.keys), C[:, g].tolist()) for g in range(self.k)]
+        # 2U_ij = Σ_v C[v,i] * (2 * 群 j の v 未満の件数 + 群 j の v の件数)
+        self.U2 = (C.T @ (2 * np.cumsum(C, axis=0) - C)).tolist()
+        self._build_used()
+
+    def _build_used(self):
+        self._is_used = [self.n[g] >= self.min_per_group for g in range(self.k)]
+        self.used = [g for g in range(self.k) if self._is_used[g]]
+        t = self.C[:, self.used].sum(axis=1)
+        self.t = t.tolist()
+        self.total = FenwickTree(len(self.keys), self.t)
+        # 2 × 平均順位 = 2 × (小さい値の件数) + 件数 + 1
+        R2 = self.C.T @ (2 * (np.cumsum(t) - t) + t + 1)
+        self.R2 = [int(R2[g]) if self._is_used[g] else 0 for g in range(self.k)]
+        self.tie_sum = sum(x ** 3 - x for x in self.t)
+
+    def _position(self, value: float) -> int:
+        p = self._pos.get(value)
+        if p is None:
+            # 候補に無い値: 件数 0 の行を加えて作り直す
+            p = bisect_left(self.keys, value)
+            keys = np.asarray(self.keys[:p] + [value] + self.keys[p:], dtype=float)
+            self._build(keys, np.insert(self.C, p, 0, axis=0))
+        return p
+
+    def _update(self, p: int, a: int, sign: int):
+        # (位置 p, 群 a) の1件を含まない状態で、その1件を加えた場合の変化を sign 倍して足す
+        C, n, trees = self.C, self.n, self.trees
+        if self._is_used[a]:
+            t_p = self.t[p]
+            below = self.total.prefix_sum(p)
+            for g in self.used:
+                above = n[g] - trees[g].prefix_sum(p + 1)
+                self.R2[g] += sign * (2 * above + int(C[p, g]))
+            self.R2[a] += sign * (2 * below + t_p + 2)
+            self.tie_sum += sign * (3 * t_p * t_p + 3 * t_p)
+        for j in range(self.k):
+            if j == a:
+                continue
+            eq = int(C[p, j])
+            less = trees[j].prefix_sum(p)
+            self.U2[a][j] += sign * (2 * less + eq)
+            self.U2[j][a] += sign * (2 * (n[j] - less - eq) + eq)
+
+    def _count(self, p: int, a: int, delta: int):
+        self.C[p, a] += delta
+        self.trees[a].add(p, delta)
+        self.n[a] += delta
+        if self._is_used[a]:
+            self.t[p] += delta
+            self.total.add(p, delta)
+
+    def add(self, value: float, group: int):
+        """値 value（NaN 以外）を群 group に1件加える"""
+        p = self._position(value)
+        self._update(p, group, 1)
+        self._count(p, group, 1)
+        if (self.n[group] >= self.min_per_group) != self._is_used[group]:
+            self._build_used()
+
+    def remove(self, value: float, group: int):
+        """値 value を群 group から1件除く"""
+        p = self._pos.get(value)
+        if p is None or self.C[p, group] <= 0:
+            raise KeyError(value)
+        self._count(p, group, -1)
+        self._update(p, group, -1)
+        if (self.n[group] >= self.min_per_group) != self._is_used[group]:
+            self._build_used()
+
+    def histogram(self) -> np.ndarray:
+        """現在の 値×群 の件数表（value_group_histogram と同じ形）"""
+        return self.C[self.C.sum(axis=1) > 0]
+
+    def kw_stats(self) -> tuple[tuple[float, float, float, float], list[int]] | None:
+        """
+        kw_from_histogram の (H, rank_eta2, A_pair_avg, A_pair_sym) と使う群のサイズ。
+        使う群が2未満・値がすべて同じなら None
+        """
+        used = self.used
+        if len(used) < 2:
+            return None
+        sizes = [self.n[g] for g in used]
+        N = sum(sizes)
+        # 順位の偏差平方和 = (N^3 - N - Σ(t^3 - t)) / 12（整数の割り算なので丸めは1回だけ）
+        sst = (N ** 3 - N - self.tie_sum) / 12 if N > 0 else 0.0
+        R = np.array([self.R2[g] for g in used], dtype=float) / 2.0
+        U = np.array([[self.U2[i][j] for j in used] for i in used], dtype=float) / 2.0
+        res = kw_from_rank_sums(np.array(sizes, dtype=float), R, float(self.tie_sum), sst, U)
+        return None if res is None else (res, sizes)
+
+    def values(self, p_norm: str = DEFAULT_P_NORM, p_scale: float = DEFAULT_P_SCALE,
+               p_cap: float = DEFAULT_P_CAP) -> list[float]:
+        """kw_values_from_histogram(self.histogram(), min_per_group, ...) と同じ値（NUM_COLS の並び）"""
+        st = self.kw_stats()
+        if st is None:
+            return [0.0] * len(NUM_COLS)
+        res, sizes = st
+        return kw_effects(*res, sizes, p_norm, p_scale, p_cap)
+
+def check_engine_parity(df: pd.DataFrame | ParsedTable, age_col_name: str = TARGET_DEFAULT,
+                        metrics_csv: str = ",".join(METRICS_DEFAULT), custom_bins_str: str = "",
+                        min_per_group: int = 2, p_norm: str = DEFAULT_P_NORM,
+                        p_scale: float = DEFAULT_P_SCALE, p_cap: float = DEFAULT_P_CAP) -> float:
+    """
+    compute_kw_table の engine="hist" と engine="scipy" の表の最大絶対差を返す（確認用。通常は 0）
+    """
+    args = (age_col_name, metrics_csv, custom_bins_str, min_per_group, p_norm, p_scale, p_cap)
+    df = as_parsed(df)
+    t_hist = compute_kw_table(df, *args, engine="hist")
+    t_scipy = compute_kw_table(df, *args, engine="scipy")
+    if t_hist.empty:
+        return 0.0
+    return float(np.max(np.abs(t_hist[NUM_COLS].to_numpy() - t_scipy[NUM_COLS].to_numpy())))
+
 def main():
     ap = argparse.ArgumentParser(
         description="Kruskal–Wallis（安定p・0～1効果量・Hの正規化）"
@@ -246,10 +856,18 @@ def main():
                     help="arctan/exp のスケール（大きいほどゆっくり1に近づく）既定: 10")
     ap.add_argument("--p-cap", type=float, default=DEFAULT_P_CAP,
                     help="log1p 正規化の上限（既定: 300）")
+    ap.add_argument("--check-engine", action="store_true",
+                    help="件数表による計算（採点で使う engine=hist）と scipy.stats.kruskal による計算の差を表示して終了")
     args = ap.parse_args()
 
     df = pd.read_csv(args.csv, dtype=str, keep_default_na=False)
 
+    if args.check_engine:
+        diff = check_engine_parity(df, args.age_col, args.metrics, args.custom_bins, args.min_per_group,
+                                   args.p_norm, args.p_scale, args.p_cap)
+        print(f"max abs diff (hist vs scipy): {diff:.3g}")
+        return
+
     age_col = find_col_case_insensitive(df, args.age_col)
     if age_col is None:
         raise SystemExit(f"年齢列 {args.age_col} が見つかりません。")
@@ -12,16 +12,21 @@ Logistic Regression for asthma_flag (fixed-schema output, approach B)
 - OR_norm, CI_*_norm = odds / (1 + odds)
 - VIF_norm = 1 - 1 / max(VIF, 1)    # VIF=1→0（無相関）, VIF→∞→1（強い多重共線性）
 - ensure-terms に含まれるが学習行列に存在しない term は NaN で占位。
+- ロジスティック回帰の解法は solver で選ぶ:
+    statsmodels : statsmodels の GLM(Binomial).fit()（既定。公式の数値はこちら）
+    irls        : NumPy だけの IRLS（fit_logit_irls）。statsmodels を読み込まずに済む
 """
 
 import argparse
+import warnings
 
 import numpy as np
 import pandas as pd
-import statsmodels.api as sm
+from scipy.stats import norm
 from sklearn.metrics import roc_auc_score
 from sklearn.model_selection import train_test_split
-from statsmodels.stats.outliers_influence import variance_inflation_factor
+
+from parsed_table import ParsedTable, as_parsed
 
 def is_binary_01(s: pd.Series) -> bool:
     if s.empty:
@@ -40,68 +45,404 @@ def odds_to_unit(x):
     arr = np.asarray(x, dtype=float)
     return arr / (1.0 + arr)
 
+def vif_all(X: np.ndarray) -> np.ndarray:
+    """
+    定数項を加えた計画行列での各列（定数項以外）の VIF をまとめて求める。
+    statsmodels の variance_inflation_factor（他の列 + 定数項への OLS の 1/(1-R^2)）を
+    列ごとに呼ぶのと同じ値を、相関行列の逆行列の対角成分として1回で計算する。
+
+    - 分散 0 の列は NaN（他の列の計算には影響しない）
+    - 相関行列が特異な場合は擬似逆行列を使い、他の列の線形結合で表せる列は inf とする
+
+    Paramters:
+    X (np.ndarray): 説明変数行列（n×p、定数項は含めない）
+
+    Returns:
+    VIF の配列 (np.ndarray, 長さ p)
+    """
+    X = np.asarray(X, dtype="float64")
+    p = X.shape[1]
+    vif = np.full(p, np.nan)
+    Z = X - X.mean(axis=0)
+    ss = (Z * Z).sum(axis=0)
+    ok = ss > 0
+    if not ok.any():
+        return vif
+    Z = Z[:, ok] / np.sqrt(ss[ok])
+    R = Z.T @ Z
+    # 階数の判定は Cholesky の成否に頼らない（丸め誤差で特異な R でも分解できてしまい、巨大な有限値になる）。
+    # R の固有値・固有ベクトルは、R を作る時の丸め誤差を含まないよう Z の特異値分解から求める（R = V diag(s^2) V^T）
+    _, s, Vt = np.linalg.svd(Z, full_matrices=False)
+    w, U = s * s, Vt.T
+    tol = max(w.max(), 0.0) * len(R) * np.finfo(float).eps
+    null = w <= tol
+    if not null.any():
+        try:
+            L = np.linalg.cholesky(R)
+            L_inv = np.linalg.solve(L, np.eye(len(R)))
+            vif[ok] = (L_inv * L_inv).sum(axis=0)
+            return vif
+        except np.linalg.LinAlgError:
+            pass
+    # 特異: 零空間に成分を持つ列は他の列で表せる（R^2 = 1）
+    inv_w = np.where(null, 0.0, 1.0 / np.where(null, 1.0, w))
+    v = (U * U) @ inv_w
+    collinear = (np.abs(U[:, null]) > np.sqrt(tol)).any(axis=1)
+    vif[ok] = np.where(collinear, np.inf, v)
+    return vif
+
+# check_vif_parity の許容差（VIF_norm の絶対差）
+VIF_PARITY_TOL = 1e-9
+
+def check_vif_parity(df: pd.DataFrame | ParsedTable, target: str = "asthma_flag",
+                     tol: float | None = VIF_PARITY_TOL) -> float:
+    """
+    vif_all と statsmodels の variance_inflation_factor を列ごとに呼んだ値の
+    VIF_norm の最大絶対差を返す（確認用）。
+    計画行列そのものに加えて、厳密に共線な列を加えた行列（2列の線形結合 a*1e3 + b、
+    0/1 列とその補数のように定数項と合わせて one-hot が揃う列）でも比べる。
+    tol を渡すと、差が tol を超えたとき ValueError を送出する
+    """
+    from statsmodels.stats.outliers_influence import variance_inflation_factor
+
+    X, _ = build_design(df, target)
+    X = X.to_numpy(dtype="float64")
+    cases = [X]
+    if X.shape[1] >= 2:
+        cases.append(np.column_stack([X, X[:, 0] * 1e3 + X[:, 1]]))
+    binary = [j for j in range(X.shape[1]) if np.isin(X[:, j], (0.0, 1.0)).all() and X[:, j].std() > 0]
+    if binary:
+        cases.append(np.column_stack([X, 1.0 - X[:, binary[0]]]))
+
+    worst = 0.0
+    for Xc in cases:
+        X_const = add_const(Xc)
+        # 共線な列では statsmodels が 1 / (1 - R^2) を 0 で割る（結果は inf で、vif_all と同じ）
+        with warnings.catch_warnings(), np.errstate(divide="ignore", invalid="ignore"):
+            warnings.simplefilter("ignore", RuntimeWarning)
+            ref = vif_to_unit([variance_inflation_factor(X_const, i) for i in range(1, X_const.shape[1])])
+        new = vif_to_unit(vif_all(Xc))
+        if len(ref):
+            worst = max(worst, float(np.max(np.abs(ref - new))))
+    if tol is not None and not worst <= tol:
+        raise ValueError(f"vif_all と statsmodels の VIF_norm の差が許容差を超えた: {worst:.3g} > {tol:.0e}")
+    return worst
+
+# check_solver_parity の許容差。statsmodels の GLM は既定で逸脱度の相対変化 1e-8 で止まるので、
+# 収束し切った解から coef で 1e-9、p 値・CI で 1e-5 程度ずれる（IRLS のずれは 1e-10 以下）
+SOLVER_PARITY_TOL = {
+    "coef": 1e-7, "p_value": 1e-4, "OR_norm": 1e-7,
+    "CI_low_norm": 1e-4, "CI_high_norm": 1e-4, "VIF_norm": 1e-9, "AUC": 1e-9,
+}
+
+def check_solver_parity(df: pd.DataFrame | ParsedTable, target: str = "asthma_flag",
+                        test_size: float = 0.2, random_state: int = 42,
+                        ensure_terms: str = "ETHNICITY_hispanic",
+                        tol: dict | None = SOLVER_PARITY_TOL) -> dict:
+    """
+    run_lr_table を solver="irls" と "statsmodels" で実行し、列ごとの最大絶対差と AUC の差を返す（確認用）。
+    NaN の位置が食い違う列と、term の並びが食い違う場合の全列は inf とする。
+    戻り値の "converged" は IRLS が収束したか。完全分離などで最尤推定値が存在しないと収束せず、
+    coef・p_value は両者とも止めた位置で決まるので比べない（OR_norm・CI・VIF・AUC は比べる）。
+    tol を渡すと、比べる項目のどれかが許容差を超えたとき ValueError を送出する
+    """
+    pt = as_parsed(df)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        t_sm, auc_sm, _ = run_lr_table(pt, target, test_size, random_state, ensure_terms, solver="statsmodels")
+        t_ir, auc_ir, _, fit_ir = run_lr_table(pt, target, test_size, random_state, ensure_terms,
+                                               solver="irls", return_fit=True)
+    same_terms = t_ir["term"].tolist() == t_sm["term"].tolist()
+    pairs = [(c, t_ir[c], t_sm[c]) if same_terms else (c, [np.nan], [0.0]) for c in COLS_ORDER[1:]]
+    pairs.append(("AUC", [auc_ir], [auc_sm]))
+    diff = {}
+    for c, a, b in pairs:
+        a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+        if not np.array_equal(np.isnan(a), np.isnan(b)):
+            diff[c] = np.inf
+            continue
+        # inf 同士（共線な列の VIF など）は一致とみなす
+        with np.errstate(invalid="ignore"):
+            d = np.where(a == b, 0.0, np.abs(a - b))
+        diff[c] = float(np.nanmax(d, initial=0.0))
+    diff["converged"] = bool(fit_ir["converged"])
+    if tol is not None:
+        bad = solver_parity_failures(diff, tol)
+        if bad:
+            raise ValueError("irls と statsmodels の差が許容差を超えた: " + ", ".join(bad))
+    return diff
+
+def solver_parity_failures(diff: dict, tol: dict = SOLVER_PARITY_TOL) -> list[str]:
+    """check_solver_parity の戻り値のうち許容差を超えた項目を "列名 差 > 許容差" の形で返す"""
+    skip = () if diff["converged"] else ("coef", "p_value")
+    return [f"{k} {v:.3g} > {tol[k]:.0e}" for k, v in diff.items()
+            if k in tol and k not in skip and not v <= tol[k]]
+
+def solver_parity_cases(df: pd.DataFrame, target: str = "asthma_flag", n_random: int = 0,
+                        random_state: int = 42) -> list[tuple[str, pd.DataFrame]]:
+    """
+    check_solver_parity に流す (名前, データ) の組を作る。
+    Paramters:
+        df: 文字列で読んだ入力（dtype=str, keep_default_na=False）
+        n_random: ランダムな Ci の組数。1組ごとに次の3つを加える
+            shuffled: 目的変数以外の各列を独立に並べ替えたもの
+            perturbed: 数値列に 10% のノイズをかけ、カテゴリ列の 5% を同じ列の別の値に置き換えたもの
+            const: 目的変数以外の1列を最頻値だけにしたもの（計画行列から落ちる列）
+    Returns:
+        先頭は ("input", df)
+    """
+    rng = np.random.default_rng(random_state)
+    features = [c for c in df.columns if c != target]
+    cases = [("input", df)]
+    for k in range(n_random):
+        shuffled = df.copy()
+        for c in features:
+            shuffled[c] = rng.permutation(df[c].to_numpy())
+        cases.append((f"shuffled{k}", shuffled))
+
+        perturbed = df.copy()
+        for c in features:
+            s = df[c]
+            num = pd.to_numeric(s, errors="coerce")
+            if num.notna().sum() > 0 and num.notna().sum() >= (s != "").sum():
+                noisy = num * (1.0 + 0.1 * rng.standard_normal(len(s)))
+                if (num.dropna() == num.dropna().round()).all():
+                    noisy = noisy.round()
+                perturbed[c] = noisy.map(lambda v: "" if np.isnan(v) else f"{v:.6g}")
+            else:
+                levels = s.unique()
+                pick = rng.random(len(s)) < 0.05
+                perturbed.loc[pick, c] = rng.choice(levels, size=int(pick.sum()))
+        cases.append((f"perturbed{k}", perturbed))
+
+        const = df.copy()
+        c = features[rng.integers(len(features))]
+        const[c] = df[c].mode().iloc[0]
+        cases.append((f"const{k}:{c}", const))
+    return cases
+
 def vif_to_unit(v):
     v = np.asarray(v, dtype=float)
     v = np.where(~np.isfinite(v) | (v < 1.0), 1.0, v)
     return 1.0 - 1.0 / v
 
+# ==== ロジスティック回帰の解法 ====
+
+SOLVERS = ["statsmodels", "irls"]
+
+_Z_975 = norm.ppf(0.975)
+_EPS = np.finfo(float).eps
+
+def add_const(X: np.ndarray) -> np.ndarray:
+    """先頭に定数項の列を加える（sm.add_constant(has_constant="add") 相当）"""
+    return np.column_stack([np.ones(len(X)), X])
+
+def _logit_mu(eta: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-eta))
+
+def _chol_inverse(A: np.ndarray) -> tuple[np.ndarray | None, np.ndarray]:
+    """
+    対称行列 A の Cholesky 分解と逆行列。分解できない（特異）場合は擬似逆行列を返す。
+    """
+    try:
+        L = np.linalg.cholesky(A)
+    except np.linalg.LinAlgError:
+        return None, np.linalg.pinv(A, hermitian=True)
+    L_inv = np.linalg.solve(L, np.eye(len(A)))
+    return L, L_inv.T @ L_inv
+
+def fit_logit_irls(X: np.ndarray, y: np.ndarray, start_params: np.ndarray | None = None,
+                   maxiter: int = 100, tol: float = 1e-8) -> dict:
+    """
+    NumPy だけでロジスティック回帰を IRLS で解く。
+    初期値は statsmodels の GLM(Binomial).fit() と同じ。係数の変化 max|Δβ| <= tol * (1 + max|β|) で
+    収束とし、共分散行列（標準誤差・Wald 信頼区間）は最終的な係数での X^T W X から求める。
+    statsmodels の既定（deviance の変化 <= 1e-8、共分散は1つ前の反復の重み）と違い、
+    結果が初期値によらない（係数は statsmodels と 1e-10 程度、p 値は 1e-6 程度まで一致する）。
+    X^T W X が特異な反復（完全分離や多重共線性）では擬似逆行列で続行する。
+    完全分離・未収束の場合は statsmodels と同様に警告を出して最後の反復の値を返す。
+
+    Paramters:
+    X (np.ndarray): 計画行列（n×k、定数項を含める）
+    y (np.ndarray): 0/1 の目的変数
+    start_params (np.ndarray): 初期値（省略時は statsmodels と同じ y から作る初期値）
+
+    Returns:
+    dict: params, bse, cov, pvalues, conf_low, conf_high, n_iter, converged
+    """
+    X = np.asarray(X, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    if start_params is None:
+        mu = (y + 0.5) / 2
+        eta = np.log(mu / (1 - mu))
+    else:
+        eta = X @ np.asarray(start_params, dtype="float64")
+        mu = _logit_mu(eta)
+
+    params = np.zeros(X.shape[1]) if start_params is None else np.asarray(start_params, dtype="float64")
+    converged = False
+    n_iter = 0
+    for n_iter in range(1, maxiter + 1):
+        p = np.clip(mu, _EPS, 1 - _EPS)
+        w = p * (1 - p)
+        z = eta + (y - mu) / w
+        Xw = X * w[:, None]
+        L, cov = _chol_inverse(X.T @ Xw)
+        rhs = Xw.T @ z
+        if L is not None:
+            new = np.linalg.solve(L.T, np.linalg.solve(L, rhs))
+        else:
+            new = cov @ rhs
+        step = np.max(np.abs(new - params), initial=0.0)
+        params = new
+        eta = X @ params
+        mu = _logit_mu(eta)
+        if np.allclose(mu - y, 0):
+            warnings.warn("Perfect separation or prediction detected, parameter may not be identified",
+                          RuntimeWarning)
+        converged = step <= tol * (1.0 + np.max(np.abs(params), initial=0.0))
+        if converged:
+            break
+    if not converged:
+        warnings.warn(f"IRLS did not converge in {maxiter} iterations", RuntimeWarning)
+
+    p = np.clip(mu, _EPS, 1 - _EPS)
+    _, cov = _chol_inverse(X.T @ (X * (p * (1 - p))[:, None]))
+    bse = np.sqrt(np.maximum(np.diag(cov), 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pvalues = 2 * norm.sf(np.abs(params / bse))
+    return {
+        "params": params,
+        "bse": bse,
+        "cov": cov,
+        "pvalues": pvalues,
+        "conf_low": params - _Z_975 * bse,
+        "conf_high": params + _Z_975 * bse,
+        "n_iter": n_iter,
+        "converged": converged,
+    }
+
+def fit_logit(X_tr: np.ndarray, y_tr: np.ndarray, X_te: np.ndarray,
+              solver: str = "statsmodels", start_params: np.ndarray | None = None) -> dict:
+    """
+    定数項付きの学習用行列でロジスティック回帰を学習し、検証用行列の予測確率とともに返す。
+    start_params を渡すとそこから反復を始める（収束しなかった場合は既定の初期値で解き直す）。
+    statsmodels の収束判定では結果が初期値に依存するので、start_params は solver="irls" でだけ使える。
+
+    Returns:
+    dict: params, pvalues, conf_low, conf_high（いずれも定数項を含む並び）, proba,
+          n_iter（解き直した場合は合計）, converged, warm_start（start_params から収束したか）
+    """
+    if start_params is not None and solver != "irls":
+        raise ValueError(f"start_params は solver='irls' でだけ使える: {solver}")
+    if start_params is not None:
+        # 初期値が悪く発散した場合の警告は、解き直すので出さない
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fit = _fit_logit_once(X_tr, y_tr, X_te, solver, start_params)
+        if fit["converged"]:
+            fit["warm_start"] = True
+            return fit
+        wasted = fit["n_iter"]
+        fit = _fit_logit_once(X_tr, y_tr, X_te, solver, None)
+        fit["n_iter"] += wasted
+    else:
+        fit = _fit_logit_once(X_tr, y_tr, X_te, solver, None)
+    fit["warm_start"] = False
+    return fit
+
+def _fit_logit_once(X_tr: np.ndarray, y_tr: np.ndarray, X_te: np.ndarray,
+                    solver: str, start_params: np.ndarray | None) -> dict:
+    if solver == "statsmodels":
+        import statsmodels.api as sm
+
+        res = sm.GLM(y_tr, X_tr, family=sm.families.Binomial()).fit()
+        conf = np.asarray(res.conf_int())
+        return {
+            "params": np.asarray(res.params),
+            "pvalues": np.asarray(res.pvalues),
+            "conf_low": conf[:, 0],
+            "conf_high": conf[:, 1],
+            "proba": np.asarray(res.predict(X_te)),
+            "n_iter": int(res.fit_history["iteration"]),
+            "converged": bool(res.converged),
+        }
+    if solver == "irls":
+        fit = fit_logit_irls(X_tr, y_tr, start_params=start_params)
+        fit["proba"] = _logit_mu(X_te @ fit["params"])
+        return fit
+    raise ValueError(f"solver は {SOLVERS} のいずれか: {solver}")
+
 # ==== 1 CSV から LR_asthma 互換の表を作る ====
 
 COLS_ORDER = ["term", "coef", "p_value", "OR_norm", "CI_low_norm", "CI_high_norm", "VIF_norm"]
 
-def run_lr_table(df: pd.DataFrame,
-                 target: str = "asthma_flag",
-                 test_size: float = 0.2,
-                 random_state: int = 42,
-                 ensure_terms: str = "ETHNICITY_hispanic") -> tuple[pd.DataFrame, float, list[str]]:
+def build_design(df: pd.DataFrame | ParsedTable, target: str = "asthma_flag") -> tuple[pd.DataFrame, pd.Series]:
     """
-    csv_path を読み、LR_asthma.py と同様に
-    - 前処理（数値 + カテゴリone-hot drop_first）
-    - ロジスティック回帰（const あり、出力は const 除外）
-    - OR/CI を 0-1 化、VIF を 0-1 化
-    - 固定順序の term を作る（方式B: 学習に使った列 ∪ ensure_terms を辞書順）
-    を行い、[COLS_ORDER] の表を返す。AUC と最終の term リストも返す。
+    前処理（数値 + カテゴリone-hot drop_first、中央値補完、ゼロ分散列の除去）を行い、
+    説明変数行列 X（float64、列は未ソート）と目的変数 y を返す。
+    解析済みの ParsedTable を渡した場合は文字列の再解析を行わない。
     """
-    # df = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    pt = as_parsed(df)
 
-    if target not in df.columns:
+    if target not in pt:
         # raise SystemExit(f"[{csv_path}] target column '{target}' not found.")
         raise SystemExit(f"target column '{target}' not found.")
-    if not is_binary_01(df[target]):
+    # 一意値だけで 0/1 判定しても結果は同じ
+    if not is_binary_01(pd.Series(pt.raw_levels[target], dtype=object)):
         # raise SystemExit(f"[{csv_path}] target column '{target}' must be strictly binary 0/1.")
         raise SystemExit(f"target column '{target}' must be strictly binary 0/1.")
 
-    y = pd.to_numeric(df[target], errors="coerce").astype("float64")
+    y = pt.numeric_series(target).astype("float64")
 
-    X_raw = df.drop(columns=[target]).copy()
-    X_num_try = X_raw.apply(pd.to_numeric, errors="coerce")
-    num_cols = [c for c in X_num_try.columns if X_num_try[c].notna().sum() > 0]
-    X_num = X_num_try[num_cols] if num_cols else pd.DataFrame(index=df.index)
-
-    cat_cols = [c for c in X_raw.columns if c not in num_cols]
-    if cat_cols:
-        X_cat = pd.get_dummies(
-            X_raw[cat_cols].replace({"": np.nan}).fillna("(NA)").astype("category"),
-            drop_first=True
-        )
-    else:
-        X_cat = pd.DataFrame(index=df.index)
-
-    X = pd.concat([X_num, X_cat], axis=1)
-    X = X.apply(pd.to_numeric, errors="coerce").replace([np.inf, -np.inf], np.nan)
-    X = X.dropna(axis=1, how="all")
-    if X.shape[1] == 0:
+    kept: dict[str, np.ndarray] = {}
+    for c in pt.columns:
+        if c != target:
+            kept.update(column_features(pt, c))
+    if not kept:
         # raise SystemExit(f"[{csv_path}] No usable features after preprocessing.")
         raise SystemExit(f"No usable features after preprocessing.")
 
-    med = X.median(numeric_only=True)
-    X = X.fillna(med).astype("float64")
-    zero_var = X.nunique(dropna=False) <= 1
-    if zero_var.all():
+    # ゼロ分散除去
+    zero_var = {c: v.min() == v.max() for c, v in kept.items()}
+    if all(zero_var.values()):
         # raise SystemExit(f"[{csv_path}] All feature columns have zero variance.")
         raise SystemExit(f"All feature columns have zero variance.")
-    if zero_var.any():
-        X = X.loc[:, ~zero_var]
+
+    X = pd.DataFrame({c: v for c, v in kept.items() if not zero_var[c]}, index=pt.index)
+    return X, y
+
+def column_features(pt: ParsedTable, c: str) -> dict[str, np.ndarray]:
+    """
+    build_design の1列分の説明変数 {列名: float64 配列}（全欠損列の除去・中央値補完まで。ゼロ分散列は残す）。
+    1つでも数値化できる列は数値のまま（inf は欠損）、それ以外は one-hot（drop_first）。
+    """
+    num = pt.numeric[c]
+    if (~np.isnan(num)).sum() > 0:
+        features = {c: np.where(np.isinf(num), np.nan, num)}
+    else:
+        features = {name: dummy.astype("float64") for name, dummy in pt.one_hot(c, drop_first=True).items()}
+
+    out = {}
+    for name, v in features.items():
+        nan = np.isnan(v)
+        if nan.all():
+            continue
+        if nan.any():
+            v = np.where(nan, np.nanmedian(v), v)
+        out[name] = v
+    return out
+
+def split_design(df: pd.DataFrame | ParsedTable, target: str = "asthma_flag",
+                 test_size: float = 0.2, random_state: int = 42):
+    """
+    build_design の結果の列を辞書順に並べ、目的変数が 0/1 の行だけを学習用・検証用に層化分割する。
+
+    Returns:
+    (base_terms, X_tr, X_te, y_tr, y_te)
+    """
+    # df = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    X, y = build_design(df, target)
 
     base_terms = sorted(X.columns.tolist())
     X = X.reindex(columns=base_terms)
@@ -116,44 +457,35 @@ def run_lr_table(df: pd.DataFrame,
     X_tr, X_te, y_tr, y_te = train_test_split(
         X, y, test_size=test_size, random_state=random_state, stratify=y.astype(int)
     )
-    X_tr_const = sm.add_constant(X_tr, has_constant="add").astype("float64")
-    X_te_const = sm.add_constant(X_te, has_constant="add").astype("float64")
-
-    model = sm.GLM(y_tr.astype("float64"), X_tr_const, family=sm.families.Binomial())
-    res = model.fit()
+    return base_terms, X_tr, X_te, y_tr, y_te
 
-    proba = res.predict(X_te_const)
-    auc = roc_auc_score(y_te, proba)
+def _align_start(start_params, param_names: list[str]) -> np.ndarray | None:
+    if start_params is None:
+        return None
+    # one-hot 列の増減に合わせて term をそろえる
+    return pd.Series(start_params, dtype="float64").reindex(param_names).fillna(0.0).to_numpy()
 
-    params = res.params.drop(labels=["const"])
-    pvals  = res.pvalues.drop(labels=["const"])
-    conf   = res.conf_int().drop(index="const")  # columns [0,1]
+def _lr_table(base_terms: list[str], X_tr: pd.DataFrame, fit: dict,
+              ensure_terms: str) -> tuple[pd.DataFrame, list[str]]:
+    """学習結果（定数項を含む並び）と学習用行列から [COLS_ORDER] の表と最終の term リストを作る"""
+    # 定数項（先頭）を除外
+    params = fit["params"][1:]
 
-    OR      = np.exp(params.values)
-    CI_low  = np.exp(conf[0].reindex(params.index).values)
-    CI_high = np.exp(conf[1].reindex(params.index).values)
+    OR      = np.exp(params)
+    CI_low  = np.exp(fit["conf_low"][1:])
+    CI_high = np.exp(fit["conf_high"][1:])
 
     coef_df = pd.DataFrame({
-        "term": params.index,
-        "coef": params.values,
-        "p_value": pvals.values,
+        "term": base_terms,
+        "coef": params,
+        "p_value": fit["pvalues"][1:],
         "OR_norm": odds_to_unit(OR),
         "CI_low_norm": odds_to_unit(CI_low),
         "CI_high_norm": odds_to_unit(CI_high),
     })
 
     # VIF（const除外）
-    vif_rows = []
-    cols = list(X_tr_const.columns)  # ['const', ...base_terms...]
-    for i, col in enumerate(cols):
-        if col == "const":
-            continue
-        try:
-            v = float(variance_inflation_factor(X_tr_const.values, i))
-        except Exception:
-            v = np.nan
-        vif_rows.append((col, v))
-    vif_df = pd.DataFrame(vif_rows, columns=["term", "VIF"])
+    vif_df = pd.DataFrame({"term": X_tr.columns, "VIF": vif_all(X_tr.to_numpy(dtype="float64"))})
     vif_df["VIF_norm"] = vif_to_unit(vif_df["VIF"].values)
     vif_df = vif_df.drop(columns=["VIF"])
 
@@ -172,8 +504,225 @@ def run_lr_table(df: pd.DataFrame,
 
     # 列順
     out = out[COLS_ORDER]
+    return out, final_terms
+
+def _fit_info(fit: dict, param_names: list[str]) -> dict:
+    return {"params": pd.Series(fit["params"], index=param_names), "n_iter": fit["n_iter"],
+            "converged": fit["converged"], "warm_start": fit["warm_start"]}
+
+def run_lr_table(df: pd.DataFrame | ParsedTable,
+                 target: str = "asthma_flag",
+                 test_size: float = 0.2,
+                 random_state: int = 42,
+                 ensure_terms: str = "ETHNICITY_hispanic",
+                 solver: str = "statsmodels",
+                 start_params: pd.Series | None = None,
+                 return_fit: bool = False) -> tuple[pd.DataFrame, float, list[str]]:
+    """
+    csv_path を読み、LR_asthma.py と同様に
+    - 前処理（数値 + カテゴリone-hot drop_first）
+    - ロジスティック回帰（const あり、出力は const 除外）
+    - OR/CI を 0-1 化、VIF を 0-1 化
+    - 固定順序の term を作る（方式B: 学習に使った列 ∪ ensure_terms を辞書順）
+    を行い、[COLS_ORDER] の表を返す。AUC と最終の term リストも返す。
+    solver はロジスティック回帰の解法（"statsmodels" / "irls"）。
+
+    start_params（term 名 → 係数、定数項は "const"。return_fit=True で得た fit["params"] 等）を渡すと
+    そこから反復を始める。学習行列に無い term は捨て、start_params に無い term は 0 から始める。
+    return_fit=True なら4つ目の戻り値として学習結果
+    {"params": 定数項を含む係数（pd.Series）, "n_iter": 反復回数, "converged", "warm_start"} を返す。
+    """
+    base_terms, X_tr, X_te, y_tr, y_te = split_design(df, target, test_size, random_state)
+
+    param_names = ["const"] + base_terms
+    fit = fit_logit(add_const(X_tr.to_numpy(dtype="float64")), y_tr.to_numpy(dtype="float64"),
+                    add_const(X_te.to_numpy(dtype="float64")), solver=solver,
+                    start_params=_align_start(start_params, param_names))
+    auc = roc_auc_score(y_te, fit["proba"])
+
+    out, final_terms = _lr_table(base_terms, X_tr, fit, ensure_terms)
+    if return_fit:
+        return out, float(auc), final_terms, _fit_info(fit, param_names)
     return out, float(auc), final_terms
 
+# ==== 複数データセットの一括学習 ====
+
+def fit_logit_irls_batch(X: np.ndarray, y: np.ndarray, row_mask: np.ndarray, col_mask: np.ndarray,
+                         start_params: np.ndarray | None = None,
+                         maxiter: int = 100, tol: float = 1e-8) -> list[dict]:
+    """
+    K 個のロジスティック回帰を、3次元配列のまま IRLS でまとめて解く（fit_logit_irls の一括版）。
+    行数・列の異なるデータセットは、共通の形にそろえた上でマスクで無効な行・列を示す。
+    無効な行は重み 0、無効な列は係数 0 に固定する。データセットごとに fit_logit_irls と同じ判定で
+    収束した時点で反復を止め、共分散行列は最終的な係数で求めるので、結果は fit_logit_irls を
+    1つずつ呼んだ場合と（丸め誤差を除き）同じになる。
+
+    Paramters:
+    X (np.ndarray): 計画行列（K×n×k、定数項を含める。無効な行・列の値は 0）
+    y (np.ndarray): 0/1 の目的変数（K×n）
+    row_mask (np.ndarray): 有効な行（K×n の bool）
+    col_mask (np.ndarray): 有効な列（K×k の bool）
+    start_params (np.ndarray): 初期値（K×k、省略時は fit_logit_irls と同じ）
+
+    Returns:
+    データセットごとの fit_logit_irls と同じ dict のリスト（無効な列の値は NaN）
+    """
+    X = np.asarray(X, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    row_w = np.asarray(row_mask, dtype="float64")
+    col_mask = np.asarray(col_mask, dtype=bool)
+    K, _, k = X.shape
+    eye = np.eye(k)
+    # 行列積が BLAS で計算されるよう、転置も連続配列で持っておく
+    XT = np.ascontiguousarray(X.transpose(0, 2, 1))
+    # 無効な列は X^T W X の対角を 1 にして係数 0 に固定する
+    pad_diag = eye[None, :, :] * (~col_mask)[:, None, :]
+
+    def hessian(idx, Xa, XTa, rwa):
+        p = np.clip(mu[idx], _EPS, 1 - _EPS)
+        XTw = XTa * (p * (1 - p) * rwa)[:, None, :]
+        return XTw, np.matmul(XTw, Xa) + pad_diag[idx]
+
+    def chol_inverse(H):
+        try:
+            L = np.linalg.cholesky(H)
+        except np.linalg.LinAlgError:
+            # 特異なデータセットがある: 1つずつ（擬似逆行列も使って）求める
+            return np.stack([_chol_inverse(Hj)[1] for Hj in H])
+        L_inv = np.linalg.solve(L, np.broadcast_to(eye, H.shape))
+        return np.matmul(L_inv.transpose(0, 2, 1), L_inv)
+
+    if start_params is None:
+        mu = (y + 0.5) / 2
+        eta = np.log(mu / (1 - mu))
+        params = np.zeros((K, k))
+    else:
+        params = np.where(col_mask, np.asarray(start_params, dtype="float64"), 0.0)
+        eta = np.matmul(X, params[:, :, None])[:, :, 0]
+        mu = _logit_mu(eta)
+
+    n_iter = np.zeros(K, dtype=int)
+    converged = np.zeros(K, dtype=bool)
+    active = np.arange(K)
+    for it in range(1, maxiter + 1):
+        if len(active) == 0:
+            break
+        # 全データセットが反復中ならコピーしない
+        sel = slice(None) if len(active) == K else active
+        Xa, XTa, ya, rwa = X[sel], XT[sel], y[sel], row_w[sel]
+        p = np.clip(mu[active], _EPS, 1 - _EPS)
+        z = eta[active] + (ya - mu[active]) / (p * (1 - p))
+        XTw, H = hessian(active, Xa, XTa, rwa)
+        rhs = np.matmul(XTw, z[:, :, None])[:, :, 0]
+        new = np.matmul(chol_inverse(H), rhs[:, :, None])[:, :, 0]
+        step = np.abs(new - params[active]).max(axis=1, initial=0.0)
+        params[active] = new
+        eta[active] = np.matmul(Xa, new[:, :, None])[:, :, 0]
+        mu[active] = _logit_mu(eta[active])
+        n_iter[active] = it
+        done = step <= tol * (1.0 + np.abs(new).max(axis=1, initial=0.0))
+        gap = np.where(rwa > 0, np.abs(mu[active] - ya), 0.0).max(axis=1)
+        for j in active[gap <= 1e-8]:
+            warnings.warn(f"Perfect separation or prediction detected in dataset {j}, "
+                          "parameter may not be identified", RuntimeWarning)
+        converged[active[done]] = True
+        active = active[~done]
+    for j in active:
+        warnings.warn(f"IRLS did not converge in {maxiter} iterations (dataset {j})", RuntimeWarning)
+    cov = chol_inverse(hessian(slice(None), X, XT, row_w)[1]) if K else np.empty((0, k, k))
+
+    fits = []
+    for j in range(K):
+        c = col_mask[j]
+        bse = np.sqrt(np.maximum(np.diag(cov[j]), 0.0))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            pvalues = 2 * norm.sf(np.abs(params[j] / bse))
+        nan = lambda v: np.where(c, v, np.nan)
+        fits.append({
+            "params": nan(params[j]),
+            "bse": nan(bse),
+            "cov": cov[j],
+            "pvalues": nan(pvalues),
+            "conf_low": nan(params[j] - _Z_975 * bse),
+            "conf_high": nan(params[j] + _Z_975 * bse),
+            "n_iter": int(n_iter[j]),
+            "converged": bool(converged[j]),
+        })
+    return fits
+
+def run_lr_tables(dfs: list,
+                  target: str = "asthma_flag",
+                  test_size: float = 0.2,
+                  random_state: int = 42,
+                  ensure_terms: str = "ETHNICITY_hispanic",
+                  start_params: pd.Series | None = None,
+                  return_fit: bool = False) -> list[tuple]:
+    """
+    複数のデータセット（例: 同じ Bi から作った Ci の候補）について run_lr_table(solver="irls") と
+    同じ表を作る。前処理・分割はデータセットごとに行い、ロジスティック回帰だけを
+    fit_logit_irls_batch でまとめて解く。
+    term の集合が異なるデータセットは term の和集合の並びにそろえ、無い term は係数 0 に固定する。
+    start_params（term 名 → 係数）は全データセット共通の初期値（例: Bi の学習結果）。
+
+    Returns:
+    データセットごとの run_lr_table の戻り値 (表, AUC, term リスト[, 学習結果]) のリスト
+    """
+    splits = [split_design(df, target, test_size, random_state) for df in dfs]
+    names = ["const"] + sorted(set().union(*(sp[0] for sp in splits)))
+    pos = {t: i for i, t in enumerate(names)}
+    K, k = len(splits), len(names)
+    n = max(len(sp[1]) for sp in splits) if splits else 0
+
+    X = np.zeros((K, n, k))
+    y = np.zeros((K, n))
+    row_mask = np.zeros((K, n), dtype=bool)
+    col_mask = np.zeros((K, k), dtype=bool)
+    for j, (base_terms, X_tr, _, y_tr, _) in enumerate(splits):
+        cols = [0] + [pos[t] for t in base_terms]
+        m = len(X_tr)
+        X[j, :m, 0] = 1.0
+        X[j, :m, cols[1:]] = X_tr.to_numpy(dtype="float64").T
+        y[j, :m] = y_tr.to_numpy(dtype="float64")
+        row_mask[j, :m] = True
+        col_mask[j, cols] = True
+
+    start = None
+    if start_params is not None:
+        start = np.broadcast_to(_align_start(start_params, names), (K, k))
+    if start is None:
+        fits = fit_logit_irls_batch(X, y, row_mask, col_mask) if K else []
+    else:
+        # 初期値が悪く発散した場合の警告は、解き直すので出さない
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fits = fit_logit_irls_batch(X, y, row_mask, col_mask, start_params=start) if K else []
+        for fit in fits:
+            fit["warm_start"] = fit["converged"]
+        redo = [j for j, fit in enumerate(fits) if not fit["converged"]]
+        if redo:
+            # 収束しなかったものは既定の初期値で解き直す
+            refits = fit_logit_irls_batch(X[redo], y[redo], row_mask[redo], col_mask[redo])
+            for j, fit in zip(redo, refits):
+                fit["n_iter"] += fits[j]["n_iter"]
+                fit["warm_start"] = False
+                fits[j] = fit
+
+    results = []
+    for (base_terms, X_tr, X_te, y_tr, y_te), fit in zip(splits, fits):
+        cols = [0] + [pos[t] for t in base_terms]
+        # データセット自身の term の並びに戻す
+        fit = {key: (v[cols] if key in ("params", "bse", "pvalues", "conf_low", "conf_high") else v)
+               for key, v in fit.items()}
+        fit["cov"] = fit["cov"][np.ix_(cols, cols)]
+        fit.setdefault("warm_start", False)
+        auc = roc_auc_score(y_te, _logit_mu(add_const(X_te.to_numpy(dtype="float64")) @ fit["params"]))
+        out, final_terms = _lr_table(base_terms, X_tr, fit, ensure_terms)
+        if return_fit:
+            results.append((out, float(auc), final_terms, _fit_info(fit, ["const"] + base_terms)))
+        else:
+            results.append((out, float(auc), final_terms))
+    return results
+
 def main():
     ap = argparse.ArgumentParser(
         description="Logistic regression (asthma_flag) with fixed-schema output and normalized VIF"
@@ -187,10 +736,37 @@ def main():
         default="ETHNICITY_hispanic",
         help="カンマ区切りで常に表に載せたい term 名（例: 'ETHNICITY_hispanic,GENDER_M'）"
     )
+    ap.add_argument("--solver", choices=SOLVERS, default="statsmodels",
+                    help="ロジスティック回帰の解法（default: statsmodels）")
+    ap.add_argument("--check-solver", type=int, nargs="?", const=0, default=None, metavar="N_RANDOM",
+                    help="irls と statsmodels の表・AUC の最大絶対差を表示し、SOLVER_PARITY_TOL を"
+                         "超えたら非ゼロで終了。N_RANDOM を付けるとシャッフル・ノイズ付加・定数列の"
+                         "ランダムな Ci を N_RANDOM 組ずつ加えて比較")
+    ap.add_argument("--check-vif", action="store_true",
+                    help="VIF_norm を statsmodels の variance_inflation_factor と比較して最大絶対差を表示し、"
+                         "VIF_PARITY_TOL を超えたら非ゼロで終了")
     args = ap.parse_args()
 
     # 1) 読み込み＆ターゲット確認
     df = pd.read_csv(args.csv, dtype=str, keep_default_na=False)
+    if args.check_vif:
+        worst = check_vif_parity(df, args.target, tol=None)
+        print(f"VIF_norm max abs diff (vs statsmodels): {worst:.3g} (tol {VIF_PARITY_TOL:.0e})")
+        if not worst <= VIF_PARITY_TOL:
+            raise SystemExit("vif_all と statsmodels の VIF_norm の差が許容差を超えた")
+        return
+    if args.check_solver is not None:
+        failed = []
+        for name, d in solver_parity_cases(df, args.target, args.check_solver, args.random_state):
+            diff = check_solver_parity(d, args.target, args.test_size, args.random_state, args.ensure_terms, tol=None)
+            bad = solver_parity_failures(diff)
+            status = "NG" if bad else "OK" if diff["converged"] else "OK(IRLS 非収束: coef・p_value は比較外)"
+            print(f"{status} {name}: " + ", ".join(f"{k} {v:.3g}" for k, v in diff.items() if k in SOLVER_PARITY_TOL))
+            if bad:
+                failed.append(name)
+        if failed:
+            raise SystemExit(f"irls と statsmodels の差が許容差を超えた: {', '.join(failed)}")
+        return
     if args.target not in df.columns:
         raise SystemExit(f"Target column '{args.target}' not found.")
     if not is_binary_01(df[args.target]):
@@ -242,22 +818,17 @@ def main():
     X_tr, X_te, y_tr, y_te = train_test_split(
         X, y, test_size=args.test_size, random_state=args.random_state, stratify=y.astype(int)
     )
-    X_tr_const = sm.add_constant(X_tr, has_constant="add").astype("float64")
-    X_te_const = sm.add_constant(X_te, has_constant="add").astype("float64")
-    model = sm.GLM(y_tr.astype("float64"), X_tr_const, family=sm.families.Binomial())
-    res = model.fit()
-
-    proba = res.predict(X_te_const)
-    auc = roc_auc_score(y_te, proba)
+    fit = fit_logit(add_const(X_tr.to_numpy(dtype="float64")), y_tr.to_numpy(dtype="float64"),
+                    add_const(X_te.to_numpy(dtype="float64")), solver=args.solver)
+    auc = roc_auc_score(y_te, fit["proba"])
 
     # 6) 係数・p・CI → OR系を0-1化（const除外）
-    params = res.params.drop(labels=["const"])
-    pvals  = res.pvalues.drop(labels=["const"])
-    conf   = res.conf_int().drop(index="const")  # columns: [0,1] (low, high)
+    params = pd.Series(fit["params"][1:], index=base_terms)
+    pvals  = pd.Series(fit["pvalues"][1:], index=base_terms)
 
     OR      = np.exp(params.values)
-    CI_low  = np.exp(conf[0].reindex(params.index).values)
-    CI_high = np.exp(conf[1].reindex(params.index).values)
+    CI_low  = np.exp(fit["conf_low"][1:])
+    CI_high = np.exp(fit["conf_high"][1:])
 
     coef_df = pd.DataFrame({
         "term": params.index,
@@ -269,17 +840,7 @@ def main():
     })
 
     # 7) VIF（const除外）→ 正規化のみ出力
-    vif_rows = []
-    cols = list(X_tr_const.columns)  # ['const', ...base_terms...]
-    for i, col in enumerate(cols):
-        if col == "const":
-            continue
-        try:
-            v = float(variance_inflation_factor(X_tr_const.values, i))
-        except Exception:
-            v = np.nan
-        vif_rows.append((col, v))
-    vif_df = pd.DataFrame(vif_rows, columns=["term", "VIF"])
+    vif_df = pd.DataFrame({"term": X_tr.columns, "VIF": vif_all(X_tr.to_numpy(dtype="float64"))})
     vif_df["VIF_norm"] = vif_to_unit(vif_df["VIF"].values)
     vif_df = vif_df.drop(columns=["VIF"])
 
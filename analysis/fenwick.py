@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+fenwick.py
+- 1行単位の差分更新で使う Fenwick 木（Binary Indexed Tree）と、それを使った順序統計の木。
+- FenwickTree    : 位置ごとの件数（重み）の加算と接頭辞和、k 番目の位置の探索を O(log U) で行う。
+- OrderStatTree  : 値の多重集合を保持し、値の追加・削除と k 番目に小さい値・分位点（linear）を
+                   O(log U) で返す。U は取りうる値の種類数。
+                   値の候補（例: columns_range.json の min〜max を小数桁で刻んだ格子）を
+                   最初に与えておくと、候補内の値の追加では木を作り直さない。
+"""
+
+import math
+from bisect import bisect_left
+
+import numpy as np
+
+
+class FenwickTree:
+    """位置 0..size-1 の重みを持つ Fenwick 木"""
+
+    def __init__(self, size: int, init=None):
+        self.size = size
+        self.tree = [0] * (size + 1)
+        if init is not None:
+            # O(size) で初期化
+            tree = self.tree
+            for i, v in enumerate(init, start=1):
+                tree[i] += v
+                j = i + (i & -i)
+                if j <= size:
+                    tree[j] += tree[i]
+        self.total = sum(init) if init is not None else 0
+        self._top = 1 << max(size.bit_length() - 1, 0) if size > 0 else 0
+
+    def add(self, pos: int, delta):
+        self.total += delta
+        i = pos + 1
+        tree = self.tree
+        n = self.size
+        while i <= n:
+            tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, pos: int):
+        """位置 0..pos-1 の重みの和"""
+        s = 0
+        i = pos
+        tree = self.tree
+        while i > 0:
+            s += tree[i]
+            i -= i & -i
+        return s
+
+    def find_kth(self, k: int) -> int:
+        """接頭辞和が k を超える最小の位置（0始まりの k 番目の要素の位置）"""
+        pos = 0
+        step = self._top
+        tree = self.tree
+        n = self.size
+        while step:
+            nxt = pos + step
+            if nxt <= n and tree[nxt] <= k:
+                pos = nxt
+                k -= tree[nxt]
+            step >>= 1
+        return pos
+
+
+class OrderStatTree:
+    """
+    値の多重集合（NaN は入れない）に対する順序統計。
+    keys は昇順の値の候補。候補に無い値が追加された時だけ木を作り直す。
+    """
+
+    def __init__(self, values=(), keys=None):
+        values = np.asarray(values, dtype="float64")
+        if keys is None:
+            keys = np.unique(values)
+        else:
+            keys = np.union1d(np.asarray(keys, dtype="float64"), np.unique(values))
+        self._build(keys, values)
+
+    def _build(self, keys: np.ndarray, values: np.ndarray):
+        self.keys = keys.tolist()
+        self._pos = {v: i for i, v in enumerate(self.keys)}
+        counts = np.zeros(len(self.keys), dtype=np.int64)
+        if len(values):
+            np.add.at(counts, np.searchsorted(keys, values), 1)
+        self.fw = FenwickTree(len(self.keys), counts.tolist())
+
+    def __len__(self) -> int:
+        return self.fw.total
+
+    def _values(self) -> np.ndarray:
+        counts = [self.fw.prefix_sum(i + 1) - self.fw.prefix_sum(i) for i in range(len(self.keys))]
+        return np.repeat(np.asarray(self.keys, dtype="float64"), counts)
+
+    def add(self, v: float):
+        i = self._pos.get(v)
+        if i is None:
+            # 候補に無い値: 候補に加えて作り直す
+            keys = np.asarray(self.keys + [v], dtype="float64")
+            self._build(np.unique(keys), np.append(self._values(), v))
+            return
+        self.fw.add(i, 1)
+
+    def remove(self, v: float):
+        i = self._pos.get(v)
+        if i is None:
+            i = bisect_left(self.keys, v)
+            if i >= len(self.keys) or self.keys[i] != v:
+                raise KeyError(v)
+        self.fw.add(i, -1)
+
+    def kth(self, k: int) -> float:
+        """0 始まりで k 番目に小さい値"""
+        return self.keys[self.fw.find_kth(k)]
+
+    def quantile(self, q: float) -> float:
+        """
+        np.quantile(method="linear") と同じ式で分位点を返す（空なら NaN）
+        """
+        n = len(self)
+        if n == 0:
+            return float("nan")
+        # numpy の _compute_virtual_index(n, q, 1, 1) と同じ計算順序
+        virtual = n * q + (1.0 + q * (1.0 - 1.0 - 1.0)) - 1.0
+        prev = math.floor(virtual)
+        gamma = virtual - prev
+        prev = min(max(prev, 0), n - 1)
+        nxt = min(prev + 1, n - 1)
+        a = self.kth(prev)
+        b = self.kth(nxt) if nxt != prev else a
+        # numpy の _lerp と同じ補間
+        diff_b_a = b - a
+        if gamma >= 0.5:
+            return b - diff_b_a * (1.0 - gamma)
+        return a + diff_b_a * gamma
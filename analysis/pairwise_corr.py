@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+pairwise_corr.py
+- 欠損（NaN / inf）を含む数値行列の Pearson 相関を、列ペアごとに両方が有限の行だけで計算する
+  （DataFrame.corr(method="pearson", min_periods=1) と同じ pairwise-complete）。
+- 列ペアごとの 有効行数・和・二乗和・積和 を欠損マスク付きの行列積でまとめて求め、
+  平均・偏差平方和・偏差積和（と値の最小・最大）の形で保持する。
+- 行のかたまり（チャンク）ごとに計算した途中結果は merge で結合できる（Chan らの並列分散の式）。
+  そのため大きな CSV をチャンクで読んだり、プロセスごとに計算した結果をまとめたりしても
+  メモリは 列数^2 のままで済む。
+- 値が一定（ペア内の最小値と最大値が等しい）の列を含むペアは、pandas と同じく NaN とする。
+- 共通の行の平均が列平均から大きく離れたペアは、1パスの式 sxx - sx^2/n が桁落ちするので、
+  そのペアだけ共通の行の平均でずらした 2パスの計算に切り替える（pandas の値との差を丸め誤差の範囲に保つ）。
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _shifted(A: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, bool]:
+    """
+    有限値マスク・列平均でずらした値（欠損は 0）・列平均・欠損が無いかどうか を返す。
+    桁落ちを避けるため、積和は列平均でずらした値でとる。
+    """
+    W = np.isfinite(A)
+    full = bool(W.all())
+    filled = A if full else np.where(W, A, 0.0)
+    cnt = W.sum(axis=0)
+    shift = np.where(cnt > 0, filled.sum(axis=0) / np.maximum(cnt, 1), 0.0)
+    Z = filled - shift
+    if not full:
+        Z[~W] = 0.0
+    return W, Z, shift, full
+
+
+def _masked_minmax(A: np.ndarray, WA: np.ndarray, WB: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    out[i, k] = A の列 i の、A[:, i] と B[:, k] が両方有限の行での最小値・最大値。
+    列 i の最小（最大）値をとる行で B[:, k] が有限なら列全体の値と同じなので、
+    そうでないペアだけ計算し直す。
+    """
+    p, q = A.shape[1], WB.shape[1]
+    mn = np.full((p, q), np.inf)
+    mx = np.full((p, q), -np.inf)
+    if len(A) == 0 or p == 0 or q == 0:
+        return mn, mx
+    full = bool(WA.all())
+    lo_fill = A if full else np.where(WA, A, np.inf)
+    hi_fill = A if full else np.where(WA, A, -np.inf)
+    arg_lo = lo_fill.argmin(axis=0)
+    arg_hi = hi_fill.argmax(axis=0)
+    cols = np.arange(p)
+    mn[:] = lo_fill[arg_lo, cols][:, None]
+    mx[:] = hi_fill[arg_hi, cols][:, None]
+    if WB.all():
+        return mn, mx
+    bad_lo = ~WB[arg_lo, :]
+    bad_hi = ~WB[arg_hi, :]
+    for k in np.flatnonzero(bad_lo.any(axis=0) | bad_hi.any(axis=0)):
+        rows = np.flatnonzero(WB[:, k])
+        if len(rows) == 0:
+            continue
+        ii = np.flatnonzero(bad_lo[:, k])
+        if len(ii):
+            mn[ii, k] = lo_fill[np.ix_(rows, ii)].min(axis=0)
+        ii = np.flatnonzero(bad_hi[:, k])
+        if len(ii):
+            mx[ii, k] = hi_fill[np.ix_(rows, ii)].max(axis=0)
+    return mn, mx
+
+
+# sxx（列平均でずらした二乗和）が偏差平方和 m2 のこの倍を超えるペアは、sxx - sx^2/n の桁落ちで
+# 有効桁が約 log10(_CANCEL_RATIO) 桁以上失われるので、ペアの平均でずらして計算し直す
+_CANCEL_RATIO = 1e3
+
+
+def _two_pass_pairs(X: np.ndarray, Y: np.ndarray, WX: np.ndarray, WY: np.ndarray,
+                    ii: np.ndarray, kk: np.ndarray) -> tuple[np.ndarray, ...]:
+    """
+    ペア (ii[t], kk[t]) ごとに、両方が有限の行だけを取り出し、そのペアでの平均を引いてから
+    平均・偏差平方和・偏差積和を求める（2パス）
+    """
+    out = np.zeros((5, len(ii)))
+    for t, (i, k) in enumerate(zip(ii, kk)):
+        w = WX[:, i] & WY[:, k]
+        x = X[w, i]
+        y = Y[w, k]
+        if len(x) == 0:
+            continue
+        mx, my = x.mean(), y.mean()
+        dx, dy = x - mx, y - my
+        out[:, t] = mx, my, dx @ dx, dy @ dy, dx @ dy
+    return tuple(out)
+
+
+class PairwiseCorrAccumulator:
+    """
+    列ペアごとの相関計算用の途中結果。
+    X（n×p）同士の相関行列（p×p）の場合は Y を省略する。
+    X（n×p）と Y（n×q）の列の組み合わせ（p×q）だけ必要な場合は Y を渡す。
+
+    acc = PairwiseCorrAccumulator()
+    for X in chunks:
+        acc.update(X)
+    r = acc.corr()
+    """
+
+    def __init__(self):
+        self.n = None  # 有効行数（p×q）
+
+    def _init_state(self, p: int, q: int):
+        z = lambda: np.zeros((p, q))
+        self.n = z()
+        self.mean_x, self.mean_y = z(), z()
+        self.m2_x, self.m2_y, self.c_xy = z(), z(), z()
+        self.min_x, self.min_y = np.full((p, q), np.inf), np.full((p, q), np.inf)
+        self.max_x, self.max_y = np.full((p, q), -np.inf), np.full((p, q), -np.inf)
+
+    @classmethod
+    def from_chunk(cls, X: np.ndarray, Y: np.ndarray | None = None) -> "PairwiseCorrAccumulator":
+        """1チャンク分の途中結果を欠損マスク付きの行列積で計算する"""
+        X = np.asarray(X, dtype="float64")
+        sym = Y is None
+        Y = X if sym else np.asarray(Y, dtype="float64")
+
+        WX, ZX, shift_x, full_x = _shifted(X)
+        WY, ZY, shift_y, full_y = (WX, ZX, shift_x, full_x) if sym else _shifted(Y)
+        rows = X.shape[0]
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if full_x and full_y:
+                # 欠損が無ければ有効行数・和は列ごとの値をそのまま並べるだけ
+                n = np.full((X.shape[1], Y.shape[1]), float(rows))
+                sx = np.repeat(ZX.sum(axis=0)[:, None], Y.shape[1], axis=1)
+                sy = sx.T if sym else np.repeat(ZY.sum(axis=0)[None, :], X.shape[1], axis=0)
+                sxx = np.repeat((ZX * ZX).sum(axis=0)[:, None], Y.shape[1], axis=1)
+                syy = sxx.T if sym else np.repeat((ZY * ZY).sum(axis=0)[None, :], X.shape[1], axis=0)
+            else:
+                FX = WX.astype("float64")
+                FY = FX if sym else WY.astype("float64")
+                n = FX.T @ FY                   # ペアごとの有効行数
+                sx = ZX.T @ FY                  # sx[i, k] = Σ zx_i （i, k が両方有効な行）
+                sy = sx.T if sym else FX.T @ ZY # sy[i, k] = Σ zy_k
+                sxx = (ZX * ZX).T @ FY          # Σ zx_i^2
+                syy = sxx.T if sym else FX.T @ (ZY * ZY)
+            sxy = ZX.T @ ZY                     # Σ zx_i zy_k
+
+            safe_n = np.where(n > 0, n, 1.0)
+            acc = cls()
+            acc.n = n
+            acc.mean_x = np.where(n > 0, shift_x[:, None] + sx / safe_n, 0.0)
+            acc.mean_y = np.where(n > 0, shift_y[None, :] + sy / safe_n, 0.0)
+            acc.m2_x = np.maximum(sxx - sx * sx / safe_n, 0.0)
+            acc.m2_y = np.maximum(syy - sy * sy / safe_n, 0.0)
+            acc.c_xy = sxy - sx * sy / safe_n
+
+            # 共通の行の平均が列平均から大きく離れたペア（片方の欠損が値の偏った行に集中する場合など）は
+            # 1パスの式では桁落ちするので、そのペアだけ共通の行の平均でずらして計算し直す
+            lossy = (n > 0) & ((sxx > _CANCEL_RATIO * acc.m2_x) | (syy > _CANCEL_RATIO * acc.m2_y))
+        if lossy.any():
+            ii, kk = np.nonzero(lossy)
+            mx, my, m2x, m2y, cxy = _two_pass_pairs(X, Y, WX, WY, ii, kk)
+            acc.mean_x[ii, kk], acc.mean_y[ii, kk] = mx, my
+            acc.m2_x[ii, kk], acc.m2_y[ii, kk], acc.c_xy[ii, kk] = m2x, m2y, cxy
+
+        acc.min_x, acc.max_x = _masked_minmax(X, WX, WY)
+        if sym:
+            acc.min_y, acc.max_y = acc.min_x.T, acc.max_x.T
+        else:
+            mn, mx = _masked_minmax(Y, WY, WX)
+            acc.min_y, acc.max_y = mn.T, mx.T
+        return acc
+
+    def update(self, X: np.ndarray, Y: np.ndarray | None = None) -> "PairwiseCorrAccumulator":
+        """行のチャンクを追加する"""
+        return self.merge(PairwiseCorrAccumulator.from_chunk(X, Y))
+
+    def merge(self, other: "PairwiseCorrAccumulator") -> "PairwiseCorrAccumulator":
+        """別の行集合で計算した途中結果を結合する（self を更新して返す）"""
+        if other.n is None:
+            return self
+        if self.n is None:
+            self._init_state(*other.n.shape)
+        if self.n.shape != other.n.shape:
+            raise ValueError(f"列数が一致しません: {self.n.shape} != {other.n.shape}")
+
+        na, nb = self.n, other.n
+        n = na + nb
+        with np.errstate(invalid="ignore", divide="ignore"):
+            safe_n = np.where(n > 0, n, 1.0)
+            f = nb / safe_n
+            w = na * nb / safe_n
+            dx = other.mean_x - self.mean_x
+            dy = other.mean_y - self.mean_y
+            self.mean_x = self.mean_x + dx * f
+            self.mean_y = self.mean_y + dy * f
+            self.m2_x = self.m2_x + other.m2_x + dx * dx * w
+            self.m2_y = self.m2_y + other.m2_y + dy * dy * w
+            self.c_xy = self.c_xy + other.c_xy + dx * dy * w
+        self.n = n
+        self.min_x = np.minimum(self.min_x, other.min_x)
+        self.max_x = np.maximum(self.max_x, other.max_x)
+        self.min_y = np.minimum(self.min_y, other.min_y)
+        self.max_y = np.maximum(self.max_y, other.max_y)
+        return self
+
+    def corr(self, min_periods: int = 1) -> np.ndarray:
+        """Pearson 相関（p×q）。有効行数が min_periods 未満・値が一定のペアは NaN"""
+        var_x = np.where(self.min_x == self.max_x, 0.0, self.m2_x)
+        var_y = np.where(self.min_y == self.max_y, 0.0, self.m2_y)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            divisor = np.sqrt(var_x * var_y)
+            r = np.where((self.n >= max(min_periods, 1)) & (divisor > 0), self.c_xy / divisor, np.nan)
+        # 丸め誤差で [-1, 1] をわずかに外れた値を戻す
+        return np.clip(r, -1.0, 1.0)
+
+
+def nan_corr(X: np.ndarray, chunk_rows: int | None = None, min_periods: int = 1) -> np.ndarray:
+    """n×p 行列の pairwise-complete Pearson 相関行列（chunk_rows 行ずつ計算して結合）"""
+    X = np.asarray(X, dtype="float64")
+    if not chunk_rows or len(X) <= chunk_rows:
+        return PairwiseCorrAccumulator.from_chunk(X).corr(min_periods)
+    acc = PairwiseCorrAccumulator()
+    for start in range(0, len(X), chunk_rows):
+        acc.update(X[start:start + chunk_rows])
+    return acc.corr(min_periods)
+
+
+def corr_frame(df: pd.DataFrame, min_periods: int = 1) -> pd.DataFrame:
+    """DataFrame.corr(min_periods=min_periods) と同じ形の相関行列（列は float に変換して使う）"""
+    cols = list(df.columns)
+    r = nan_corr(df.to_numpy(dtype="float64"), min_periods=min_periods)
+    return pd.DataFrame(r, index=cols, columns=cols)
+
+
+def corr_csv(path: str, columns: list[str], chunksize: int = 100_000,
+             min_periods: int = 1) -> pd.DataFrame:
+    """
+    CSV を chunksize 行ずつ読みながら、指定した列の相関行列を計算する（メモリは列数^2 程度）。
+    数値化できない値・空文字は欠損として扱う。
+    """
+    acc = PairwiseCorrAccumulator()
+    for chunk in pd.read_csv(path, dtype=str, keep_default_na=False, usecols=columns, chunksize=chunksize):
+        X = np.column_stack([pd.to_numeric(chunk[c], errors="coerce").to_numpy(dtype="float64")
+                             for c in columns]) if columns else np.empty((len(chunk), 0))
+        acc.update(X)
+    if acc.n is None:
+        r = np.full((len(columns), len(columns)), np.nan)
+    else:
+        r = acc.corr(min_periods)
+    return pd.DataFrame(r, index=columns, columns=columns)
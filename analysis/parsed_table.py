@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+parsed_table.py
+- 文字列で読み込んだ DataFrame（dtype=str, keep_default_na=False）を1度だけ解析し、
+  stats_diff / LR_asthma / KW_IND が共通で使う型付き配列をまとめて保持する。
+- 列ごとに以下を保持:
+    numeric    : pd.to_numeric(errors="coerce") 相当の float64 配列
+    blank      : 前後空白除去後に空文字となる行のマスク
+    codes/levels        : 前後空白除去後の値のカテゴリコードと水準（出現順）
+    raw_codes/raw_levels: 元の値（空白除去なし）のカテゴリコードと水準（出現順）
+- 各列は pd.factorize で一意値に分解し、数値化・空白除去は一意値に対してのみ行う。
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class ParsedTable:
+    """
+    文字列 DataFrame の解析結果。
+    同じ DataFrame を複数の採点モジュールに渡す場合に、解析を1回で済ませるために使う。
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.columns = list(df.columns)
+        self.index = df.index
+        self.n_rows = len(df)
+
+        self.numeric: dict[str, np.ndarray] = {}
+        self.blank: dict[str, np.ndarray] = {}
+        self.codes: dict[str, np.ndarray] = {}
+        self.levels: dict[str, list[str]] = {}
+        self.raw_codes: dict[str, np.ndarray] = {}
+        self.raw_levels: dict[str, np.ndarray] = {}
+
+        for c in self.columns:
+            self._parse_column(c, df[c])
+
+    def _parse_column(self, c: str, s: pd.Series):
+        raw_codes, raw_levels = pd.factorize(s.to_numpy(dtype=object), use_na_sentinel=False)
+        self._set_levels(c, raw_codes.astype(np.intp, copy=False), raw_levels)
+
+    def _set_levels(self, c: str, raw_codes: np.ndarray, raw_levels: np.ndarray,
+                    num_levels: np.ndarray | None = None, stripped: np.ndarray | None = None):
+        # 数値化・空白除去は一意値に対してのみ行い、コードで全行へ展開
+        if num_levels is None:
+            num_levels, stripped = _parse_levels(raw_levels)
+
+        # 前後空白除去後の値で再度まとめ直す
+        strip_codes, levels = pd.factorize(stripped, use_na_sentinel=False)
+
+        self.raw_codes[c] = raw_codes
+        self.raw_levels[c] = raw_levels
+        self.numeric[c] = num_levels[raw_codes] if len(raw_levels) else np.empty(0, dtype="float64")
+        self.codes[c] = strip_codes.astype(np.intp, copy=False)[raw_codes]
+        self.levels[c] = [str(v) for v in levels]
+        self.blank[c] = (stripped == "")[raw_codes]
+
+    def replace_column(self, col: str, values):
+        """
+        1列だけ新しい値（文字列の並び）で置き換えて解析し直す。
+        行数は変えられない。他の列の解析結果はそのまま使う。
+        """
+        s = pd.Series(values, dtype=object) if not isinstance(values, pd.Series) else values
+        if len(s) != self.n_rows:
+            raise ValueError(f"列 {col} の行数が一致しません: {len(s)} != {self.n_rows}")
+        if col not in self.numeric:
+            self.columns.append(col)
+        self._parse_column(col, s)
+
+    def set_values(self, col: str, rows, values):
+        """
+        列 col の行 rows（行番号の並び）を values（文字列の並び）で書き換える。
+        数値化・空白除去は列の一意値に対してのみやり直し、全行の文字列の解析は行わない。
+        水準は書き換え後の出現順に並べ直し、使われなくなった値は除く（ParsedTable(df) と同じ並び）。
+        配列は作り直すので、copy() の元の ParsedTable には影響しない。
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        raw_codes = self.raw_codes[col]
+        raw_levels = list(self.raw_levels[col])
+        n_old = len(raw_levels)
+
+        # 既存の値の解析結果は全行の配列から水準ごとに戻す
+        num_levels = np.empty(n_old, dtype="float64")
+        num_levels[raw_codes] = self.numeric[col]
+        stripped = np.empty(n_old, dtype=object)
+        stripped[raw_codes] = np.asarray(self.levels[col], dtype=object)[self.codes[col]]
+
+        pos = {v: k for k, v in enumerate(raw_levels)}
+        new_codes = np.empty(len(rows), dtype=np.intp)
+        for j, v in enumerate(values):
+            k = pos.get(v)
+            if k is None:
+                k = pos[v] = len(raw_levels)
+                raw_levels.append(v)
+            new_codes[j] = k
+        if len(raw_levels) > n_old:
+            # 新しく現れた値だけ解析する
+            num_new, strip_new = _parse_levels(np.asarray(raw_levels[n_old:], dtype=object))
+            num_levels = np.concatenate([num_levels, num_new])
+            stripped = np.concatenate([stripped, strip_new])
+
+        raw_codes = raw_codes.copy()
+        raw_codes[rows] = new_codes
+        raw_codes, used = pd.factorize(raw_codes)
+        self._set_levels(col, raw_codes.astype(np.intp, copy=False),
+                         np.asarray(raw_levels, dtype=object)[used], num_levels[used], stripped[used])
+
+    def copy(self) -> "ParsedTable":
+        """浅いコピー（配列は共有し、列の置き換えは互いに影響しない）"""
+        new = object.__new__(ParsedTable)
+        new.columns = list(self.columns)
+        new.index = self.index
+        new.n_rows = self.n_rows
+        for name in ["numeric", "blank", "codes", "levels", "raw_codes", "raw_levels"]:
+            setattr(new, name, dict(getattr(self, name)))
+        return new
+
+    def take(self, rows) -> "ParsedTable":
+        """
+        行番号の並び rows（重複可）で行を取り出した ParsedTable。文字列の解析はやり直さない。
+        水準は取り出した行に現れるものだけを、取り出した行での出現順に並べ直す。
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        new = object.__new__(ParsedTable)
+        new.columns = list(self.columns)
+        new.index = self.index[rows]
+        new.n_rows = len(rows)
+        for name in ["numeric", "blank", "codes", "levels", "raw_codes", "raw_levels"]:
+            setattr(new, name, {})
+        for c in self.columns:
+            new.numeric[c] = self.numeric[c][rows]
+            new.blank[c] = self.blank[c][rows]
+            codes, used = pd.factorize(self.codes[c][rows])
+            new.codes[c] = codes.astype(np.intp, copy=False)
+            new.levels[c] = [self.levels[c][k] for k in used]
+            raw_codes, raw_used = pd.factorize(self.raw_codes[c][rows])
+            new.raw_codes[c] = raw_codes.astype(np.intp, copy=False)
+            new.raw_levels[c] = self.raw_levels[c][raw_used]
+        return new
+
+    def __len__(self) -> int:
+        return self.n_rows
+
+    def __contains__(self, col) -> bool:
+        return col in self.numeric
+
+    def numeric_series(self, col: str) -> pd.Series:
+        """数値化済みの列を元の index 付き Series として返す"""
+        return pd.Series(self.numeric[col], index=self.index, name=col)
+
+    def value_counts(self, col: str) -> tuple[list[str], np.ndarray]:
+        """前後空白除去後の値ごとの件数（水準は出現順）"""
+        counts = np.bincount(self.codes[col], minlength=len(self.levels[col]))
+        return self.levels[col], counts
+
+    def one_hot_levels(self, col: str) -> list[str]:
+        """
+        pd.get_dummies(... .replace({"": NaN}).fillna("(NA)").astype("category"))
+        と同じ水準の並び（辞書順）を返す
+        """
+        return sorted(set(self._na_filled_levels(col)))
+
+    def one_hot(self, col: str, drop_first: bool = True) -> dict[str, np.ndarray]:
+        """
+        get_dummies(drop_first=True) 相当の {列名: bool配列}。
+        列名は '<col>_<水準>'。
+        """
+        filled = self._na_filled_levels(col)
+        cats = sorted(set(filled))
+        pos = {v: i for i, v in enumerate(cats)}
+        level_to_cat = np.array([pos[v] for v in filled], dtype=np.intp)
+        cat_codes = level_to_cat[self.raw_codes[col]] if len(filled) else np.empty(0, dtype=np.intp)
+        start = 1 if drop_first else 0
+        return {f"{col}_{cats[k]}": (cat_codes == k) for k in range(start, len(cats))}
+
+    def _na_filled_levels(self, col: str) -> list:
+        out = []
+        for v in self.raw_levels[col]:
+            if (isinstance(v, str) and v == "") or (not isinstance(v, str) and pd.isna(v)):
+                out.append("(NA)")
+            else:
+                out.append(v)
+        return out
+
+
+def _parse_levels(raw_levels: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    一意値ごとの pd.to_numeric(errors="coerce") の値と、前後空白除去後の文字列
+    （astype(str).str.strip() 相当）
+    """
+    num_levels = pd.to_numeric(pd.Series(raw_levels, dtype=object), errors="coerce").to_numpy(dtype="float64")
+    stripped = pd.Series(raw_levels, dtype=object).astype(str).str.strip().to_numpy(dtype=object)
+    return num_levels, stripped
+
+
+def as_parsed(df) -> ParsedTable:
+    """DataFrame なら解析し、解析済みならそのまま返す"""
+    if isinstance(df, ParsedTable):
+        return df
+    return ParsedTable(df)
@@ -4,8 +4,12 @@
 import pandas as pd
 import numpy as np
 import sys, os
+import argparse
+import json
 from itertools import combinations
 
+from pairwise_corr import corr_frame
+
 # ===== 固定スキーマ（順序も固定） =====
 EXPECTED_NUMERIC = [
     "AGE",
@@ -55,14 +59,40 @@ def build_age_group(age_series: pd.Series) -> pd.Series:
     out = pd.cut(age, bins=edges, right=False, labels=lab, include_lowest=True)
     return out.astype(object)
 
-def norm_gender(x: pd.Series) -> pd.Series:
+def normalize_by_unique(x: pd.Series, rule) -> pd.Series:
+    """
+    rule(x.astype(str)) と同じ結果を、x の異なる値ごとに1回だけ rule を適用して求める。
+    カテゴリ列は異なる値が少ないので、文字列処理は異なる値の数だけで済み、行ごとの処理は整数の番号の散布だけになる
+
+    Paramters:
+    x : 正規化する列
+    rule : 文字列の Series を受け取り、同じ長さの正規化後の Series を返す関数
+
+    Returns:
+    正規化後の列（object 型、index は x と同じ）
+    """
+    values = np.asarray(x, dtype=object)
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)  # 欠損は -1
+    if pd.api.types.infer_dtype(uniques, skipna=False) not in ("string", "empty"):
+        # 文字列以外（1 と 1.0 など str にすると異なる値）を含む場合は str にしてからまとめる
+        codes, uniques = pd.factorize(x.astype(str).to_numpy(dtype=object))
+    labels = rule(pd.Series(uniques, dtype=object)).to_numpy(dtype=object)
+    out = np.empty(len(values), dtype=object)
+    valid = codes >= 0
+    out[valid] = labels[codes[valid]]
+    if not valid.all():
+        # 欠損は種類（NaN / None など）で str にした値が異なるので、欠損の行だけ str にしてからまとめる
+        out[~valid] = normalize_by_unique(x[~valid].astype(str), rule).to_numpy()
+    return pd.Series(out, index=x.index, dtype=object)
+
+def _gender_rule(x: pd.Series) -> pd.Series:
     s = x.astype(str).str.strip().str.lower()
     out = np.where(s.str.startswith("m"), "M",
           np.where(s.str.startswith("f"), "F",
           np.where(s.eq("o") | s.str.startswith("oth"), "O", "U")))
     return pd.Series(out, index=x.index, dtype=object)
 
-def norm_race(x: pd.Series) -> pd.Series:
+def _race_rule(x: pd.Series) -> pd.Series:
     s = x.astype(str).str.strip().str.lower()
     keys = ["asian","black","white","native hawaiian","hawaiian","native","other","unknown","null","none"]
     def map_one(t):
@@ -78,12 +108,22 @@ def norm_race(x: pd.Series) -> pd.Series:
         return "unknown"
     return s.map(map_one).astype(object)
 
-def norm_ethnicity(x: pd.Series) -> pd.Series:
+def _ethnicity_rule(x: pd.Series) -> pd.Series:
     s = x.astype(str).str.strip().str.lower()
     out = np.where(s.str.contains("non") | s.str.contains("not"), "nonhispanic",
           np.where(s.str.contains("hisp"), "hispanic", "unknown"))
     return pd.Series(out, index=x.index, dtype=object)
 
+# 異なる値ごとに正規化して行に戻す（結果は行ごとに規則を適用した場合と同じ）
+def norm_gender(x: pd.Series) -> pd.Series:
+    return normalize_by_unique(x, _gender_rule)
+
+def norm_race(x: pd.Series) -> pd.Series:
+    return normalize_by_unique(x, _race_rule)
+
+def norm_ethnicity(x: pd.Series) -> pd.Series:
+    return normalize_by_unique(x, _ethnicity_rule)
+
 # ====== 1) 数値列の統計（min-max 正規化, 固定行列） ======
 def minmax_normalize(v: pd.Series) -> pd.Series:
     x = to_float(v)
@@ -121,6 +161,169 @@ def group_table_fixed(df: pd.DataFrame, df_norm: pd.DataFrame, cat_col: str) ->
     out = out.reindex(index=levels)
     return out
 
+# ====== 4') カテゴリ×数値の一括計算（群のコード × 数値列の行列） ======
+def level_codes(s: pd.Series, levels: list) -> np.ndarray:
+    """
+    s の各値の levels 内の位置（levels に無い値・欠損は -1）
+    """
+    return pd.Index(levels).get_indexer(s).astype(np.int64)
+
+def category_codes(df: pd.DataFrame) -> dict:
+    """
+    CAT_COL_ORDER の各カテゴリ列の水準の番号（level_codes）
+    """
+    return {cat: level_codes(df[cat], EXPECTED_CATEGORICAL_LEVELS[cat]) for cat in CAT_COL_ORDER}
+
+def column_sort_index(X: np.ndarray) -> np.ndarray:
+    """
+    X の列ごとに値の昇順に並べた行番号（p×n、欠損は末尾）。グルーピングが変わっても使い回せる
+    """
+    return np.argsort(np.ascontiguousarray(np.asarray(X, dtype=float).T), axis=1, kind="stable")
+
+def grouped_stats_tensor(X: np.ndarray, codes: np.ndarray, n_levels: int,
+                         sort_idx: np.ndarray | None = None) -> np.ndarray:
+    """
+    n×p の数値行列 X を群のコード codes（0..n_levels-1, 対象外・欠損は -1）でまとめ、
+    群 × 数値列 × STATS_ORDER の配列を返す（各列の欠損は除外、値が無い群は NaN）。
+
+    行を群の順に安定に並べ替え（群の中は元の行順）、群ごとの連続区間で平均・標準偏差を全列まとめて求める。
+    分位点は列ごとの値の順（sort_idx）を群で安定に並べ直し、群ごとの値の昇順から線形補間で求める。
+    和の順序・補間の式は Series.describe（nanmean / nanvar / np.percentile）と同じなので、
+    group_table_fixed（groupby(...).describe）の値とビット単位で一致する。
+
+    Paramters:
+    X : n×p の数値行列
+    codes : 行ごとの群のコード
+    n_levels : 群の数
+    sort_idx : column_sort_index(X)（省略時はここで計算）
+
+    Returns:
+    n_levels × p × len(STATS_ORDER) の配列
+    """
+    X = np.asarray(X, dtype=float)
+    # 群の数は少ないので int16 にしておくと安定な並べ替えが基数ソートになる
+    codes = np.asarray(codes, dtype=np.int16)
+    n, p = X.shape
+    out = np.full((n_levels, p, len(STATS_ORDER)), np.nan)
+    if n == 0 or p == 0:
+        return out
+    if sort_idx is None:
+        sort_idx = column_sort_index(X)
+
+    # 群 g の行は並べ替え後の [bounds[g], bounds[g+1])（先頭の区間は対象外の行）
+    bounds = np.cumsum(np.bincount(codes.astype(np.intp) + 1, minlength=n_levels + 1))
+
+    # 平均・標準偏差用：群の順（群の中は元の行順）。列方向の和が Series の和と同じ順序になるよう F 順序にする
+    Xg = np.asfortranarray(X[np.argsort(codes, kind="stable")])
+    # 分位点用（p×n）：列ごとの値の昇順を群で安定に並べ直す（群の中は値の昇順、欠損は群の末尾）
+    by_group = np.argsort(codes[sort_idx], axis=1, kind="stable")
+    Vg = np.take_along_axis(np.ascontiguousarray(X.T), np.take_along_axis(sort_idx, by_group, axis=1), axis=1)
+
+    cols = np.arange(p)
+    for g in range(n_levels):
+        lo, hi = bounds[g], bounds[g + 1]
+        if hi == lo:
+            continue
+        B = Xg[lo:hi]
+        mask = np.isnan(B)
+        cnt = (hi - lo) - mask.sum(axis=0)
+
+        # nanmean / nanvar と同じ計算（欠損は 0 で埋めて和を取る）
+        Z = B.copy(order="F")
+        Z[mask] = 0.0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = Z.sum(axis=0) / cnt
+            D = np.asfortranarray((mean - Z) ** 2)
+            D[mask] = 0.0
+            var = D.sum(axis=0) / (cnt - 1)
+        var[cnt <= 1] = np.nan
+        out[g, :, 0] = mean
+        out[g, :, 1] = np.sqrt(var)
+
+        # np.percentile(method="linear") と同じ添字・補間（値が無い列は NaN）
+        last = np.maximum(cnt - 1, 0)
+        for j, q in enumerate([0.25, 0.5, 0.75]):
+            virtual = (cnt - 1) * q
+            prev = np.floor(virtual)
+            gamma = virtual - prev
+            i0 = np.clip(prev.astype(np.intp), 0, last)
+            i1 = np.minimum(i0 + 1, last)
+            a = Vg[cols, lo + i0]
+            b = Vg[cols, lo + i1]
+            diff_b_a = b - a
+            with np.errstate(invalid="ignore"):
+                val = np.where(gamma >= 0.5, b - diff_b_a * (1 - gamma), a + diff_b_a * gamma)
+            out[g, :, 2 + j] = np.where(cnt > 0, val, np.nan)
+    return out
+
+def group_table_from_tensor(T: np.ndarray, cat_col: str) -> pd.DataFrame:
+    """
+    grouped_stats_tensor の 1 グルーピング分を group_table_fixed と同じ形の表にする
+    """
+    levels = EXPECTED_CATEGORICAL_LEVELS[cat_col]
+    columns = pd.MultiIndex.from_product([EXPECTED_NUMERIC, STATS_ORDER])
+    index = pd.Index(levels, name=cat_col)
+    return pd.DataFrame(T.reshape(len(levels), -1), index=index, columns=columns)
+
+def grouped_stats_all(df: pd.DataFrame, df_norm: pd.DataFrame, codes: dict | None = None) -> dict:
+    """
+    CAT_COL_ORDER の全カテゴリ列について grouped_stats_tensor を求める（列ごとの並べ替えは全グルーピングで共有）
+
+    Paramters:
+    codes : category_codes(df)（省略時はここで計算）
+
+    Returns:
+    {カテゴリ列名: 水準 × EXPECTED_NUMERIC × STATS_ORDER の配列}
+    """
+    if codes is None:
+        codes = category_codes(df)
+    X = np.column_stack([df_norm[c].to_numpy(dtype=float) for c in EXPECTED_NUMERIC])
+    sort_idx = column_sort_index(X)
+    out = {}
+    for cat in CAT_COL_ORDER:
+        n_levels = len(EXPECTED_CATEGORICAL_LEVELS[cat])
+        out[cat] = grouped_stats_tensor(X, codes[cat], n_levels, sort_idx)
+    return out
+
+def group_tables_fixed(df: pd.DataFrame, df_norm: pd.DataFrame, codes: dict | None = None) -> dict:
+    """
+    CAT_COL_ORDER の全カテゴリ列の group_table_fixed をまとめて求める（grouped_stats_all による計算）
+    """
+    return {cat: group_table_from_tensor(T, cat) for cat, T in grouped_stats_all(df, df_norm, codes).items()}
+
+def check_group_engine(df: pd.DataFrame, df_norm: pd.DataFrame, tol: float | None = 0.0) -> float:
+    """
+    group_tables_fixed と group_table_fixed（groupby(...).describe）の差を表示する
+
+    Paramters:
+    tol : 差がこれを超えたら（欠損の位置が食い違う場合を含む）ValueError。None なら表示だけ。
+          既定の 0 はビット単位の一致
+
+    Returns:
+    全表の差の絶対値の最大（欠損の位置が食い違う場合は inf）
+    """
+    worst = 0.0
+    for cat, tbl in group_tables_fixed(df, df_norm).items():
+        try:
+            ref = group_table_fixed(df, df_norm, cat)
+        except ValueError as e:
+            # 有効な群が1つも無いと groupby(...).describe は失敗する（一括計算では全て NaN）
+            print(f"{cat:16s} skipped (describe failed: {e})")
+            continue
+        a = tbl.to_numpy()
+        b = ref.reindex(index=tbl.index, columns=tbl.columns).to_numpy(dtype=float)
+        if not np.array_equal(np.isnan(a), np.isnan(b)):
+            diff = float("inf")
+        else:
+            both = ~np.isnan(a)
+            diff = float(np.max(np.abs(a[both] - b[both]), initial=0.0))
+        worst = max(worst, diff)
+        print(f"{cat:16s} max|engine - describe| = {diff:.3g}")
+    print(f"WORST {worst:.3g}")
+    if tol is not None and not worst <= tol:
+        raise ValueError(f"group_tables_fixed が groupby(...).describe と一致しない: {worst:.3g} > {tol:.3g}")
+    return worst
+
 # ====== 5) カテゴリ×カテゴリのクロス集計（★比率 0〜1 のみ出力・固定レベル） ======
 def crosstab_ratio_fixed(df: pd.DataFrame, a: str, b: str) -> pd.DataFrame:
     levels_a = EXPECTED_CATEGORICAL_LEVELS[a]
@@ -132,20 +335,238 @@ def crosstab_ratio_fixed(df: pd.DataFrame, a: str, b: str) -> pd.DataFrame:
     ratio = (ct / len(df)).astype(float)
     return ratio
 
-def main():
-    # ====== I/O ======
-    if len(sys.argv) < 2:
-        print("Usage: python3 stats.py <input.csv>")
-        sys.exit(1)
-    csv_file = sys.argv[1]
-    
-    if not os.path.isfile(csv_file):
-        print(f"Error: File {csv_file} not found")
-        sys.exit(1)
+# ====== 5') カテゴリ×カテゴリの一括計算（全カテゴリ列の同時件数表） ======
+def joint_category_histogram(codes: dict) -> np.ndarray:
+    """
+    CAT_COL_ORDER の全カテゴリ列の水準の組ごとの件数を 1 回の np.bincount で数える。
+    各軸の 0 番目は水準外・欠損、i+1 番目が i 番目の水準。
+
+    Paramters:
+    codes : category_codes の戻り値
+
+    Returns:
+    形が (水準数+1, ...)（CAT_COL_ORDER 順）の件数の配列
+    """
+    dims = tuple(len(EXPECTED_CATEGORICAL_LEVELS[c]) + 1 for c in CAT_COL_ORDER)
+    flat = np.ravel_multi_index(tuple(codes[c] + 1 for c in CAT_COL_ORDER), dims)
+    return np.bincount(flat, minlength=int(np.prod(dims))).reshape(dims)
+
+def crosstab_counts_all(codes: dict) -> dict:
+    """
+    combinations(CAT_COL_ORDER, 2) の全ての組の件数表（水準外・欠損の行は除く）を同時件数表の周辺和として求める。
+    周辺和は件数が 0 でないセル（行数・セル数の小さい方以下）だけを組ごとに np.bincount で足し上げる
+
+    Returns:
+    {(a, b): 水準数(a) × 水準数(b) の件数の配列}
+    """
+    H = joint_category_histogram(codes)
+    cells = np.flatnonzero(H)
+    w = H.ravel()[cells].astype(float)  # 件数は 2**53 未満なので float の和でも誤差は無い
+    idx = np.unravel_index(cells, H.shape)
+    out = {}
+    for (i, a), (j, b) in combinations(enumerate(CAT_COL_ORDER), 2):
+        La, Lb = H.shape[i], H.shape[j]
+        M = np.bincount(idx[i] * Lb + idx[j], weights=w, minlength=La * Lb).reshape(La, Lb)
+        out[(a, b)] = M[1:, 1:].astype(np.int64)
+    return out
 
-    df_raw = pd.read_csv(csv_file, dtype=str)
+def crosstab_ratios_fixed(df: pd.DataFrame, codes: dict | None = None) -> dict:
+    """
+    全ての組の crosstab_ratio_fixed をまとめて求める（pd.crosstab・reindex を使わない）
+
+    Returns:
+    {(a, b): crosstab_ratio_fixed(df, a, b) と同じ表}
+    """
+    if codes is None:
+        codes = category_codes(df)
+    out = {}
+    for (a, b), ct in crosstab_counts_all(codes).items():
+        index = pd.Index(EXPECTED_CATEGORICAL_LEVELS[a], name=a)
+        columns = pd.Index(EXPECTED_CATEGORICAL_LEVELS[b], name=b)
+        with np.errstate(invalid="ignore"):
+            ratio = ct / len(df)
+        out[(a, b)] = pd.DataFrame(ratio, index=index, columns=columns)
+    return out
 
-    # ====== データ整形 ======
+def check_crosstab_engine(df: pd.DataFrame, tol: float | None = 0.0) -> float:
+    """
+    crosstab_ratios_fixed と crosstab_ratio_fixed（pd.crosstab）の差を表示する
+
+    Paramters:
+    tol : check_group_engine と同じ
+
+    Returns:
+    全表の差の絶対値の最大（欠損の位置が食い違う場合は inf）
+    """
+    worst = 0.0
+    for (a, b), tbl in crosstab_ratios_fixed(df).items():
+        x = tbl.to_numpy()
+        y = crosstab_ratio_fixed(df, a, b).to_numpy(dtype=float)
+        if not np.array_equal(np.isnan(x), np.isnan(y)):
+            diff = float("inf")
+        else:
+            both = ~np.isnan(x)
+            diff = float(np.max(np.abs(x[both] - y[both]), initial=0.0))
+        worst = max(worst, diff)
+    print(f"crosstab WORST {worst:.3g}")
+    if tol is not None and not worst <= tol:
+        raise ValueError(f"crosstab_ratios_fixed が pd.crosstab と一致しない: {worst:.3g} > {tol:.3g}")
+    return worst
+
+# ====== 固定スキーマの値を1本のベクトルにまとめる（書き出し・比較用） ======
+def numeric_describe_fixed(df_norm: pd.DataFrame) -> pd.DataFrame:
+    """
+    数値列の統計（min-max 正規化後、STATS_ORDER × EXPECTED_NUMERIC）
+    """
+    desc = df_norm.describe(percentiles=[0.25, 0.5, 0.75])
+    desc = desc.loc[["mean","std","25%","50%","75%"]]
+    desc = desc.reindex(columns=EXPECTED_NUMERIC)
+    return desc
+
+def corr_fixed(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    数値×数値の相関行列（Pearson, EXPECTED_NUMERIC × EXPECTED_NUMERIC）
+    """
+    # 欠損マスク付きの行列積による pairwise-complete 相関（DataFrame.corr と同じ）
+    corr = corr_frame(df[EXPECTED_NUMERIC].astype(float))
+    corr = corr.reindex(index=EXPECTED_NUMERIC, columns=EXPECTED_NUMERIC)
+    return corr
+
+def stats_layout() -> list[str]:
+    """
+    stats_vector の各要素の term 名（並びは固定スキーマだけで決まり、入力データに依存しない）
+      NUM:統計量:数値列 / CORR:数値列|数値列（上三角） / CAT:カテゴリ列=水準 /
+      GROUP:カテゴリ列=水準:数値列:統計量 / XTAB:カテゴリ列=水準|カテゴリ列=水準
+    """
+    terms = [f"NUM:{st}:{c}" for st in STATS_ORDER for c in EXPECTED_NUMERIC]
+    terms += [f"CORR:{EXPECTED_NUMERIC[i]}|{EXPECTED_NUMERIC[j]}"
+              for i, j in zip(*np.triu_indices(len(EXPECTED_NUMERIC), k=1))]
+    terms += [f"CAT:{cat}={lev}" for cat in CAT_COL_ORDER for lev in EXPECTED_CATEGORICAL_LEVELS[cat]]
+    terms += [f"GROUP:{cat}={lev}:{num}:{st}"
+              for cat in CAT_COL_ORDER for lev in EXPECTED_CATEGORICAL_LEVELS[cat]
+              for num in EXPECTED_NUMERIC for st in STATS_ORDER]
+    terms += [f"XTAB:{a}={la}|{b}={lb}"
+              for a, b in combinations(CAT_COL_ORDER, 2)
+              for la in EXPECTED_CATEGORICAL_LEVELS[a] for lb in EXPECTED_CATEGORICAL_LEVELS[b]]
+    return terms
+
+def stats_vector(df: pd.DataFrame, df_norm: pd.DataFrame, codes: dict | None = None) -> np.ndarray:
+    """
+    表示する全ての表（数値列の統計・相関行列・カテゴリ列の比率・カテゴリ×数値・クロス集計）の値を
+    stats_layout() の順に並べたベクトル（値が無い要素は NaN）
+
+    Paramters:
+    df, df_norm : prepare_frame の戻り値
+    codes : category_codes(df)（省略時はここで計算）
+    """
+    if codes is None:
+        codes = category_codes(df)
+    n = len(df)
+    corr = corr_fixed(df).to_numpy(dtype=float)
+    parts = [
+        numeric_describe_fixed(df_norm).to_numpy(dtype=float).ravel(),
+        corr[np.triu_indices(len(EXPECTED_NUMERIC), k=1)],
+    ]
+    with np.errstate(invalid="ignore"):
+        for cat in CAT_COL_ORDER:
+            c = codes[cat]
+            parts.append(np.bincount(c[c >= 0], minlength=len(EXPECTED_CATEGORICAL_LEVELS[cat])) / n)
+        parts += [T.ravel() for T in grouped_stats_all(df, df_norm, codes).values()]
+        parts += [ct.ravel() / n for ct in crosstab_counts_all(codes).values()]
+    return np.concatenate(parts).astype(float)
+
+def layout_path(path: str) -> str:
+    """
+    書き出したベクトル・行列に対応するレイアウト（JSON）のパス
+    """
+    root, ext = os.path.splitext(path)
+    return (root if ext == ".npy" else path) + ".layout.json"
+
+def _check_layout(terms: list, path: str):
+    if list(terms) != stats_layout():
+        raise ValueError(f"{path}: layout does not match the current stats.py schema")
+
+def save_vector(path: str, vec: np.ndarray, label: str | None = None):
+    """
+    ベクトルを .npy で、レイアウトを layout_path(path) に JSON で保存する
+    """
+    np.save(path, np.asarray(vec, dtype="<f8"))
+    with open(layout_path(path), "w", encoding="utf-8") as f:
+        json.dump({"kind": "vector", "size": len(vec), "rows": [label], "terms": stats_layout()},
+                  f, ensure_ascii=False, indent=1)
+
+def append_to_stack(path: str, vecs: list, labels: list):
+    """
+    ベクトルを行として行列ファイル path（float64 のリトルエンディアンを並べただけのファイル、
+    np.memmap で開ける）の末尾に追加する。行のラベルとレイアウトは layout_path(path) に保存する
+    """
+    size = len(stats_layout())
+    meta_path = layout_path(path)
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        _check_layout(meta["terms"], meta_path)
+    else:
+        meta = {"kind": "stack", "size": size, "rows": [], "terms": stats_layout()}
+    if os.path.exists(path) and os.path.getsize(path) != 8 * size * len(meta["rows"]):
+        raise ValueError(f"{path}: file size does not match {meta_path}")
+    with open(path, "ab") as f:
+        for v in vecs:
+            f.write(np.asarray(v, dtype="<f8").tobytes())
+    meta["rows"] += list(labels)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=1)
+
+def load_vectors(path: str) -> tuple[np.ndarray, list]:
+    """
+    比較対象を読み込む。CSV はここで計算し、.npy は save_vector のベクトル、それ以外は append_to_stack の行列
+    （np.memmap で開くので、行数が多くても全体をメモリに読み込まない）
+
+    Returns:
+    (k × len(stats_layout()) の行列, 行のラベル)
+    """
+    if path.lower().endswith(".csv"):
+        df, df_norm = prepare_frame(pd.read_csv(path, dtype=str))
+        return stats_vector(df, df_norm)[None, :], [path]
+    meta_path = layout_path(path)
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    _check_layout(meta["terms"], meta_path)
+    size = len(meta["terms"])
+    if path.lower().endswith(".npy"):
+        M = np.load(path).reshape(-1, size)
+    else:
+        M = np.memmap(path, dtype="<f8", mode="r").reshape(-1, size)
+    labels = [lab if lab is not None else path for lab in meta["rows"]]
+    if len(labels) != M.shape[0]:
+        raise ValueError(f"{path}: number of rows does not match {meta_path}")
+    return M, labels
+
+def diff_against(ref: np.ndarray, M: np.ndarray, chunk_rows: int = 4096) -> tuple[np.ndarray, np.ndarray]:
+    """
+    行列 M の各行と基準ベクトル ref の差の最大絶対値・平均絶対値（片側だけ NaN の要素は差 0 とみなす。stats_diff と同じ）
+
+    Returns:
+    (max_abs, mean_abs)：どちらも長さ M.shape[0] の配列
+    """
+    k = M.shape[0]
+    max_abs = np.zeros(k)
+    mean_abs = np.zeros(k)
+    for s in range(0, k, chunk_rows):
+        D = np.abs(np.nan_to_num(np.asarray(M[s:s + chunk_rows]) - ref, nan=0.0))
+        if D.shape[1]:
+            max_abs[s:s + chunk_rows] = D.max(axis=1)
+            mean_abs[s:s + chunk_rows] = D.mean(axis=1)
+    return max_abs, mean_abs
+
+# ====== 入力の整形 ======
+def prepare_frame(df_raw: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    文字列として読み込んだ CSV を整形する（数値列・フラグ列の変換、カテゴリ列の正規化、AGE_GROUP の生成）
+
+    Returns:
+    (整形後の表, 数値列を min-max 正規化した表)
+    """
     df = df_raw.copy()
 
     # 数値列（固定順）
@@ -176,21 +597,41 @@ def main():
     # AGE_GROUP の生成（AGE が無い/欠損でもOK）
     df["AGE_GROUP"] = build_age_group(df["AGE"]) if "AGE" in df.columns else pd.Series(np.nan, index=df.index)
 
-    # ====== 1) 数値列の統計（min-max 正規化, 固定行列） ======
     df_norm = df[EXPECTED_NUMERIC].apply(minmax_normalize, axis=0)
-    
-    desc = df_norm.describe(percentiles=[0.25, 0.5, 0.75])
-    desc = desc.loc[["mean","std","25%","50%","75%"]]
-    desc = desc.reindex(columns=EXPECTED_NUMERIC)
-    
+    return df, df_norm
+
+def load_input(csv_file: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    if not os.path.isfile(csv_file):
+        print(f"Error: File {csv_file} not found")
+        sys.exit(1)
+
+    df_raw = pd.read_csv(csv_file, dtype=str)
+
+    # ====== データ整形 ======
+    return prepare_frame(df_raw)
+
+def show(args):
+    df, df_norm = load_input(args.csv_file)
+
+    if args.check_group_engine:
+        worst = max(check_group_engine(df, df_norm, tol=None), check_crosstab_engine(df, tol=None))
+        if worst != 0.0:
+            sys.exit(1)
+        return
+
+    # カテゴリ列の水準の番号（カテゴリ×数値・カテゴリ×カテゴリで共有）
+    codes = category_codes(df)
+
+    # ====== 1) 数値列の統計（min-max 正規化, 固定行列） ======
+    desc = numeric_describe_fixed(df_norm)
+
     print("\n=== 数値列の統計量（min-max正規化後, 0〜1・min/max除外・固定スキーマ） ===")
     with pd.option_context("display.max_columns", None, "display.width", None, "display.float_format", lambda x: f"{x:.6g}"):
         print(desc)
 
     # ====== 2) 数値×数値 相関（固定スキーマ） ======
-    corr = df[EXPECTED_NUMERIC].astype(float).corr()
-    corr = corr.reindex(index=EXPECTED_NUMERIC, columns=EXPECTED_NUMERIC)
-    
+    corr = corr_fixed(df)
+
     print("\n--- 相関行列（Pearson, 固定スキーマ） ---")
     with pd.option_context("display.max_columns", None, "display.width", None, "display.float_format", lambda x: f"{x:.6g}"):
         print(corr)
@@ -205,19 +646,106 @@ def main():
 
     # ====== 4) カテゴリ×数値（min-max 正規化、固定レベル×固定統計：count系は出さない） ======
     print("\n=== カテゴリ×数値の要約統計（min-max正規化後, 固定レベル×固定統計） ===")
+    # 全カテゴリ列・全数値列をまとめて計算（groupby(...).describe と同じ値）
+    group_tables = group_tables_fixed(df, df_norm, codes)
     for cat in CAT_COL_ORDER:
         print(f"\n--- Group by: {cat} ---")
-        tbl = group_table_fixed(df, df_norm, cat)
+        tbl = group_tables[cat]
         with pd.option_context("display.max_columns", None, "display.width", None, "display.float_format", lambda x: f"{x:.6g}"):
             print(tbl)
 
     # ====== 5) カテゴリ×カテゴリのクロス集計（★比率 0〜1 のみ出力・固定レベル） ======
     print("\n=== カテゴリ×カテゴリのクロス集計（全体比 0〜1・固定レベル） ===")
+    # 全カテゴリ列の同時件数表から全ての組をまとめて計算（pd.crosstab と同じ値）
+    crosstabs = crosstab_ratios_fixed(df, codes)
     for a, b in combinations(CAT_COL_ORDER, 2):
         print(f"\n--- Crosstab (ratio): {a} × {b} ---")
-        ratio = crosstab_ratio_fixed(df, a, b)
+        ratio = crosstabs[(a, b)]
         with pd.option_context("display.max_columns", None, "display.width", None, "display.float_format", lambda x: f"{x:.6g}"):
             print(ratio)
 
+def export(args):
+    if args.out is None and args.stack is None:
+        print("Error: specify -o/--out or --stack")
+        sys.exit(1)
+    if args.out is not None and len(args.csv_files) != 1:
+        print("Error: -o/--out takes exactly one input CSV (use --stack for many)")
+        sys.exit(1)
+    vecs = []
+    for csv_file in args.csv_files:
+        df, df_norm = load_input(csv_file)
+        vecs.append(stats_vector(df, df_norm))
+    if args.out is not None:
+        save_vector(args.out, vecs[0], args.csv_files[0])
+        print(f"wrote {args.out} ({len(vecs[0])} values) and {layout_path(args.out)}")
+    if args.stack is not None:
+        append_to_stack(args.stack, vecs, args.csv_files)
+        print(f"appended {len(vecs)} row(s) to {args.stack}")
+
+def diff(args):
+    R, ref_labels = load_vectors(args.ref)
+    if R.shape[0] != 1:
+        print(f"Error: {args.ref} must hold exactly one vector")
+        sys.exit(1)
+    ref = np.asarray(R[0])
+    terms = stats_layout()
+
+    rows = []
+    for path in args.candidates:
+        M, labels = load_vectors(path)
+        max_abs, mean_abs = diff_against(ref, M)
+        rows.append(pd.DataFrame({"candidate": labels, "max_abs": max_abs, "mean_abs": mean_abs}))
+        # 差の大きい term（1行ずつの表示なので少数の比較向け）
+        for r in range(M.shape[0] if args.details else 0):
+            d = np.nan_to_num(np.asarray(M[r]) - ref, nan=0.0)
+            top = np.argsort(-np.abs(d), kind="stable")[:args.details]
+            print(f"\n--- {labels[r]} (largest differences) ---")
+            for k in top:
+                print(f"{terms[k]}\t{d[k]:.6g}")
+
+    out = pd.concat(rows, ignore_index=True).sort_values(args.sort_by, kind="mergesort")
+    if args.top is not None:
+        out = out.head(args.top)
+    print(f"\n=== DIFF against {ref_labels[0]} ===")
+    with pd.option_context("display.max_rows", None, "display.width", None, "display.float_format", lambda x: f"{x:.6g}"):
+        print(out.to_string(index=False))
+
+COMMANDS = ("show", "export", "diff")
+
+def main(argv=None):
+    # ====== I/O ======
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # 従来の `python3 stats.py <input.csv>` は show として扱う
+    if argv and argv[0] not in COMMANDS and argv[0] not in ("-h", "--help"):
+        argv = ["show"] + argv
+
+    ap = argparse.ArgumentParser(description="要約統計量（固定スキーマ）の表示・書き出し・比較")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    sp = sub.add_parser("show", help="表を表示する（既定）")
+    sp.add_argument("csv_file", help="入力 CSV")
+    sp.add_argument("--check-group-engine", action="store_true",
+                    help="カテゴリ×数値・カテゴリ×カテゴリの一括計算と groupby(...).describe / pd.crosstab の差を表示して終了"
+                         "（差が 0 でなければ終了コード 1）")
+    sp.set_defaults(func=show)
+
+    sp = sub.add_parser("export", help="全ての表の値を1本のベクトルとして書き出す")
+    sp.add_argument("csv_files", nargs="+", help="入力 CSV")
+    sp.add_argument("-o", "--out", help="ベクトルの書き出し先（.npy、レイアウトは .layout.json）")
+    sp.add_argument("--stack", help="各 CSV のベクトルを行として追加する行列ファイル（np.memmap で開ける）")
+    sp.set_defaults(func=export)
+
+    sp = sub.add_parser("diff", help="基準との差を比較する（CSV / .npy / --stack の行列）")
+    sp.add_argument("ref", help="基準（CSV または1本のベクトル）")
+    sp.add_argument("candidates", nargs="+", help="比較対象")
+    sp.add_argument("--sort-by", choices=["max_abs", "mean_abs"], default="max_abs", help="並べ替えの基準")
+    sp.add_argument("--top", type=int, default=None, help="差の小さい順に表示する件数")
+    sp.add_argument("--details", type=int, default=0, metavar="N",
+                    help="比較対象ごとに差の大きい term を N 個表示する")
+    sp.set_defaults(func=diff)
+
+    args = ap.parse_args(argv)
+    args.func(args)
+
 if __name__=="__main__":
-    main()
\ No newline at end of file
+    main()
@@ -70,7 +70,7 @@ def eval_diff_max_abs(df1: pd.DataFrame, df2:pd.DataFrame,
                       custom_bins="", min_per_group=2, 
                       p_norm=DEFAULT_P_NORM, p_scale=DEFAULT_P_SCALE, 
                       p_cap=DEFAULT_P_CAP,
-                      out=None, print_details=False) -> float:
+                      out=None, print_details=False, kw_table1=None) -> float:
     """
     データフレームを2つ受け取って、最も大きいKW指標の差を返す
 
@@ -79,6 +79,7 @@ def eval_diff_max_abs(df1: pd.DataFrame, df2:pd.DataFrame,
     df2 (pd.DataFrame): データフレームその2
     out (str): 各指標の差を保存したい場所を指定。各指標の差が書き込まれる
     print_details (bool): 詳細の結果を表示するかどうか
+    kw_table1 (pd.DataFrame): 事前計算済みの df1 のKW指標テーブル（指定時は df1 を使わない）
 
     Returns:
     最も大きいKW指標の差 (float)
@@ -86,7 +87,7 @@ def eval_diff_max_abs(df1: pd.DataFrame, df2:pd.DataFrame,
 
     diff = eval_diff(df1, df2, age_col, metrics,
          custom_bins, min_per_group, p_norm, p_scale, p_cap, 
-         out, print_details)
+         out, print_details, kw_table1=kw_table1)
 
 
     # 全差分の最大絶対値
@@ -100,7 +101,7 @@ def eval_diff(df1: pd.DataFrame, df2:pd.DataFrame,
                       custom_bins="", min_per_group=2, 
                       p_norm=DEFAULT_P_NORM, p_scale=DEFAULT_P_SCALE, 
                       p_cap=DEFAULT_P_CAP,
-                      out=None, print_details=False) -> pd.DataFrame:
+                      out=None, print_details=False, kw_table1=None) -> pd.DataFrame:
     """
     データフレームを2つ受け取って、各指標の差を計算する
 
@@ -109,15 +110,17 @@ def eval_diff(df1: pd.DataFrame, df2:pd.DataFrame,
     df2 (pd.DataFrame): データフレームその2
     out (str): 各指標の差を保存したい場所を指定。各指標の差が書き込まれる
     print_details (bool): 詳細の結果を表示するかどうか
+    kw_table1 (pd.DataFrame): 事前計算済みの df1 のKW指標テーブル（指定時は df1 を使わない）
 
     Returns:
     テーブルその2の指標 - テーブルその1の指標 (pd.DataFrame)
     """
-    # DataFrameからKW指標をまとめたテーブルを算出
-    kw_table1 = KW_IND.compute_kw_table(
-        df1, age_col, metrics, custom_bins,
-        min_per_group, p_norm, p_scale, p_cap
-    )
+    # DataFrameからKW指標をまとめたテーブルを算出（df1 側は事前計算があれば再利用）
+    if kw_table1 is None:
+        kw_table1 = KW_IND.compute_kw_table(
+            df1, age_col, metrics, custom_bins,
+            min_per_group, p_norm, p_scale, p_cap
+        )
     kw_table2 = KW_IND.compute_kw_table(
         df2, age_col, metrics, custom_bins,
         min_per_group, p_norm, p_scale, p_cap
@@ -146,6 +149,43 @@ def eval_diff(df1: pd.DataFrame, df2:pd.DataFrame,
 
     return diff
 
+def eval_diff_max_abs_sweep(df1: pd.DataFrame, df2: pd.DataFrame, layouts: list,
+                            age_col=TARGET_DEFAULT,
+                            metrics=",".join(METRICS_DEFAULT),
+                            min_per_group=2,
+                            p_norm=DEFAULT_P_NORM, p_scale=DEFAULT_P_SCALE,
+                            p_cap=DEFAULT_P_CAP, sweep1=None) -> np.ndarray:
+    """
+    年齢の区切り（custom_bins）を layouts のそれぞれに変えた場合の、最も大きいKW指標の差を返す
+    （採点の区切りを変えても差が小さいままかの確認や、区切りのグリッド探索用）。
+    各データフレームの 値×年齢 の累積件数表は1回だけ作る（KW_IND.KWBinSweep）。
+
+    Paramters:
+    df1 (pd.DataFrame): データフレームその1
+    df2 (pd.DataFrame): データフレームその2
+    layouts (list): 区切りのリスト（"0,18,65,200" のような文字列か数値の並び。"" は既定の区切り）
+    sweep1 (KW_IND.KWBinSweep): 事前計算済みの df1 の KWBinSweep（指定時は df1 を使わない）
+
+    Returns:
+    区切りごとの最も大きいKW指標の差 (np.ndarray)
+    """
+    if sweep1 is None:
+        sweep1 = KW_IND.KWBinSweep(df1, age_col, metrics)
+    sweep2 = KW_IND.KWBinSweep(df2, age_col, metrics)
+    v1 = sweep1.evaluate(layouts, min_per_group, p_norm, p_scale, p_cap)
+    v2 = sweep2.evaluate(layouts, min_per_group, p_norm, p_scale, p_cap)
+
+    # metric の和集合で揃え、欠側は0埋め（eval_diff と同じ）
+    metrics_all = sorted(set(sweep1.metrics).union(sweep2.metrics))
+    if not metrics_all:
+        return np.zeros(len(layouts))
+    a1 = np.zeros((len(layouts), len(metrics_all), len(NUM_COLS)))
+    a2 = np.zeros_like(a1)
+    pos = {m: i for i, m in enumerate(metrics_all)}
+    a1[:, [pos[m] for m in sweep1.metrics]] = v1
+    a2[:, [pos[m] for m in sweep2.metrics]] = v2
+    return np.abs(a2 - a1).max(axis=(1, 2))
+
 if __name__ == "__main__":
     ap = argparse.ArgumentParser(description="KW_IND 差分: 2つのCSVの 0～1 指標を (file2 - file1) で出力し、最後に最大絶対差を表示（group_sizes非表示）。")
     ap.add_argument("csv1", help="1つ目のCSV（baseline）")
@@ -163,8 +203,21 @@ if __name__ == "__main__":
     ap.add_argument("--p-cap", type=float, default=DEFAULT_P_CAP,
                     help="log1p 正規化の上限（既定: 300）")
     ap.add_argument("-o", "--out", default=None, help="差分テーブルをCSV保存するパス（任意）")
+    ap.add_argument("--sweep-bins", default=None,
+                    help="年齢の区切りをセミコロン区切りで複数指定し（例: \"0,18,65,200;0,18,45,65,75,200\"）、"
+                         "区切りごとの MAX_ABS_DIFF だけを表示")
     args = ap.parse_args()
 
+    if args.sweep_bins is not None:
+        layouts = [b.strip() for b in args.sweep_bins.split(";")]
+        df1 = pd.read_csv(args.csv1, dtype=str, keep_default_na=False)
+        df2 = pd.read_csv(args.csv2, dtype=str, keep_default_na=False)
+        max_abs = eval_diff_max_abs_sweep(df1, df2, layouts, args.age_col, args.metrics, args.min_per_group,
+                                          args.p_norm, args.p_scale, args.p_cap)
+        for b, v in zip(layouts, max_abs):
+            print(f"MAX_ABS_DIFF {v:.6g} {b or ','.join(str(x) for x in DEFAULT_BINS)}")
+        sys.exit(0)
+
     # 2つのKWテーブルの差を評価
     max_abs = eval(args.csv1, args.csv2, args.age_col, args.metrics,
                    args.custom_bins, args.min_per_group, 
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+KW_IND_diff_rows.py
+- Bi を固定し、Ci の1行（AGE や metric の列）を書き換えた時の KW_IND_diff の max_abs を
+  行単位の差分更新で求める（局所探索型の匿名化で「行 i をこう変えたら？」を大量に試す用途）。
+- 保持する状態: metric ごとの KW_IND.KWMetricState（値の位置ごとの群ごとの件数の Fenwick 木、
+  群ごとの順位和、同順位の補正、群の組ごとの Mann–Whitney U）と、行ごとの年齢群・metric の値。
+- 1行の書き換えは、変わった metric（AGE が変わった場合は全 metric）の状態から1件除いて1件加えるだけで
+  O(k log V)（k は年齢群の数、V は metric の値の種類数）。H・ε²・η²・rank η²・A 指標は
+  保持している順位和・U から求めるので行数 n には依存しない。
+- 結果は KW_IND_diff.eval_diff_max_abs による再計算とビット単位で一致する。
+"""
+
+import argparse
+import sys
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import KW_IND_diff
+
+# モジュールの相対参照制限を強制的に回避
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..', 'analysis'))
+import KW_IND
+from KW_IND import KWMetricState, NUM_COLS
+from parsed_table import ParsedTable, as_parsed
+
+
+class KWDiffRowScorer:
+    """
+    Bi を固定し、Ci の行単位の書き換えに対する KW_IND_diff の max_abs を差分更新で求める。
+
+    - set_row(i, values)   : 行 i の列を values（{列名: 文字列}）で書き換え、新しい max_abs を返す
+    - score_row(i, values) : 書き換えた場合の max_abs を返す（状態は元に戻す）
+    オプションは KW_IND_diff.eval_diff_max_abs と同じ。
+    """
+
+    def __init__(self, Bi_df: pd.DataFrame | ParsedTable | None, Ci_df: pd.DataFrame | ParsedTable,
+                 kw_table1: pd.DataFrame | None = None,
+                 age_col=KW_IND.TARGET_DEFAULT, metrics=",".join(KW_IND.METRICS_DEFAULT),
+                 custom_bins="", min_per_group=2,
+                 p_norm=KW_IND.DEFAULT_P_NORM, p_scale=KW_IND.DEFAULT_P_SCALE, p_cap=KW_IND.DEFAULT_P_CAP):
+        self.options = dict(age_col=age_col, metrics=metrics, custom_bins=custom_bins,
+                            min_per_group=min_per_group, p_norm=p_norm, p_scale=p_scale, p_cap=p_cap)
+        if kw_table1 is None:
+            kw_table1 = KW_IND.compute_kw_table(Bi_df, age_col, metrics, custom_bins,
+                                                min_per_group, p_norm, p_scale, p_cap)
+        self.kw_table1 = kw_table1
+        self.p_args = (p_norm, p_scale, p_cap)
+        self.min_per_group = min_per_group
+        self.bins = KW_IND.parse_custom_bins(custom_bins)
+        self.k = len(self.bins) - 1
+        self._parse_cache: dict[str, float] = {}
+        self._group_cache: dict[tuple[float, bool], int] = {}
+
+        pt = as_parsed(Ci_df)
+        self.columns = list(pt.columns)
+        self.n_rows = pt.n_rows
+        self.age_col = KW_IND.find_col_case_insensitive(pt, age_col)
+        if self.age_col is None:
+            raise SystemExit(f"年齢列 {age_col} が見つかりません。")
+        metric_names = [m.strip() for m in metrics.split(",") if m.strip()]
+        found = [KW_IND.find_col_case_insensitive(pt, m) for m in metric_names]
+        # compute_kw_table の出力と同じ並び（metric の辞書順）
+        self.metrics = sorted(m for m in found if m is not None)
+
+        self.cells = {c: np.asarray(pt.raw_levels[c], dtype=object)[pt.raw_codes[c]] for c in self.columns}
+        self.age = pt.numeric[self.age_col].copy()
+        self.y = {m: pt.numeric[m].copy() for m in self.metrics}
+
+        # Bi と Ci の metric の和集合で揃え、欠側は0埋め（KW_IND_diff.eval_diff と同じ）
+        self.metrics_all = sorted(set(kw_table1["metric"]).union(self.metrics))
+        t1 = kw_table1.set_index("metric").reindex(self.metrics_all).fillna(0.0)
+        self.v1 = t1[NUM_COLS].to_numpy(dtype=float)
+        self._row_of = {m: self.metrics_all.index(m) for m in self.metrics}
+
+        self._rebuild()
+
+    # ---------- 全体の構築 ----------
+
+    def _rebuild(self):
+        self._n_posinf = int(np.isposinf(self.age).sum())
+        groups = KW_IND.make_age_groups_by_custom_bins(pd.Series(self.age), self.bins)
+        self.group = np.asarray(groups.cat.codes, dtype=np.int64)
+        self.states: dict[str, KWMetricState] = {}
+        self.v2 = np.zeros_like(self.v1)
+        for m in self.metrics:
+            ok = (self.group >= 0) & ~np.isnan(self.y[m])
+            self.states[m] = KWMetricState(self.y[m][ok], self.group[ok], self.k, self.min_per_group)
+        self._refresh(self.metrics)
+        self._assemble()
+
+    def _refresh(self, metrics: list[str]):
+        # p 値は書き換わった metric の分を chi2_mlog10p_many でまとめて求める
+        stats = [(m, self.states[m].kw_stats()) for m in metrics]
+        stats = [(m, st) for m, st in stats if st is not None]
+        for m in metrics:
+            self.v2[self._row_of[m]] = 0.0
+        mlog10p = KW_IND.chi2_mlog10p_many(np.array([res[0] for _, (res, _) in stats]),
+                                           np.array([len(sizes) - 1 for _, (_, sizes) in stats], dtype=int))
+        for (m, (res, sizes)), mp in zip(stats, mlog10p):
+            values = KW_IND.kw_effects(*res, sizes, *self.p_args, mlog10p=float(mp))
+            self.v2[self._row_of[m]] = np.nan_to_num(values, nan=0.0)
+
+    def _assemble(self):
+        self.diff = self.v2 - self.v1
+        self.max_abs = float(np.nanmax(np.abs(self.diff))) if self.diff.size else 0.0
+
+    # ---------- 値の解析 ----------
+
+    def _parse(self, s: str) -> float:
+        """1セルの文字列の数値（ParsedTable と同じ pd.to_numeric(errors="coerce")）"""
+        v = self._parse_cache.get(s)
+        if v is None:
+            v = float(pd.to_numeric(pd.Series([s], dtype=object), errors="coerce").to_numpy(dtype="float64")[0])
+            self._parse_cache[s] = v
+        return v
+
+    def _age_group(self, age: float) -> int:
+        """
+        年齢1つの年齢群（make_age_groups_by_custom_bins と同じ。群に入らなければ -1）。
+        +inf の年齢があると最後の区切りより大きい年齢が群から外れるので、その有無も渡して決める。
+        """
+        if np.isnan(age):
+            return -1
+        key = (age, self._n_posinf > 0)
+        g = self._group_cache.get(key)
+        if g is None:
+            ages = [age, np.inf] if self._n_posinf else [age]
+            groups = KW_IND.make_age_groups_by_custom_bins(pd.Series(ages, dtype=float), self.bins)
+            g = self._group_cache[key] = int(groups.cat.codes[0])
+        return g
+
+    # ---------- 行の書き換え ----------
+
+    def _apply(self, i: int, values: dict) -> dict:
+        """行 i を書き換え、元に戻すための {列名: 元の文字列} を返す"""
+        old_cells = {}
+        for c, s in values.items():
+            if c not in self.cells:
+                raise KeyError(f"列 {c} は Ci にありません")
+            s = s if isinstance(s, str) else str(s)
+            if self.cells[c][i] == s:
+                continue
+            old_cells[c] = self.cells[c][i]
+            self.cells[c][i] = s
+
+        age_old = self.age[i]
+        age_new = self._parse(self.cells[self.age_col][i]) if self.age_col in old_cells else age_old
+        if np.isposinf(age_new) != np.isposinf(age_old):
+            had_posinf = self._n_posinf > 0
+            self._n_posinf += 1 if np.isposinf(age_new) else -1
+            if (self._n_posinf > 0) != had_posinf:
+                # +inf の年齢の有無が変わると他の行の年齢群も変わりうるので全体を作り直す
+                self.age[i] = age_new
+                for m in self.metrics:
+                    self.y[m][i] = self._parse(self.cells[m][i])
+                self._rebuild()
+                return old_cells
+
+        g_old = int(self.group[i])
+        g_new = self._age_group(age_new) if self.age_col in old_cells else g_old
+        changed = []
+        for m in self.metrics:
+            y_old = self.y[m][i]
+            y_new = self._parse(self.cells[m][i]) if m in old_cells else y_old
+            if g_new == g_old and (y_new == y_old or (np.isnan(y_new) and np.isnan(y_old))):
+                continue
+            st = self.states[m]
+            if g_old >= 0 and not np.isnan(y_old):
+                st.remove(y_old, g_old)
+            if g_new >= 0 and not np.isnan(y_new):
+                st.add(y_new, g_new)
+            self.y[m][i] = y_new
+            changed.append(m)
+        self.age[i] = age_new
+        self.group[i] = g_new
+        if changed:
+            self._refresh(changed)
+
+        self._assemble()
+        return old_cells
+
+    def set_row(self, i: int, values: dict) -> float:
+        """
+        Ci の行 i の列を values（{列名: 文字列}）で書き換え、新しい max_abs を返す
+        """
+        self._apply(i, values)
+        return self.max_abs
+
+    def score_row(self, i: int, values: dict) -> float:
+        """
+        Ci の行 i の列を values で書き換えた場合の max_abs を返す（状態は書き換え前に戻す）
+        """
+        old_cells = self._apply(i, values)
+        max_abs = self.max_abs
+        if old_cells:
+            self._apply(i, old_cells)
+        return max_abs
+
+    # ---------- 確認用 ----------
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """現在の Ci（文字列の DataFrame）"""
+        return pd.DataFrame({c: self.cells[c] for c in self.columns})
+
+    def table(self) -> pd.DataFrame:
+        """現在の Ci の KW 指標テーブル（KW_IND.compute_kw_table と同じ形）"""
+        out = pd.DataFrame(self.v2[[self._row_of[m] for m in self.metrics]], columns=NUM_COLS)
+        out.insert(0, "metric", self.metrics)
+        return out
+
+    def recompute_max_abs(self) -> float:
+        """現在の Ci から KW_IND_diff.eval_diff_max_abs で再計算した max_abs（差分更新の確認用）"""
+        return KW_IND_diff.eval_diff_max_abs(None, self.to_dataframe(), kw_table1=self.kw_table1,
+                                             **self.options)
+
+
+def random_row_edit(scorer: KWDiffRowScorer, rng: np.random.Generator) -> tuple[int, dict]:
+    """
+    確認用の書き換え: ランダムな1行の AGE と metric のうち1〜2列を、同じ列の別の行の値
+    （まれに空欄・今までに無い値）に置き換える
+    """
+    i = int(rng.integers(scorer.n_rows))
+    cols = [scorer.age_col] + scorer.metrics
+    values = {}
+    for c in rng.choice(cols, size=min(int(rng.integers(1, 3)), len(cols)), replace=False):
+        u = rng.random()
+        if u < 0.05:
+            values[c] = ""
+        elif u < 0.1:
+            values[c] = str(int(rng.integers(0, 300)))
+        else:
+            values[c] = scorer.cells[c][int(rng.integers(scorer.n_rows))]
+    return i, values
+
+
+def check_incremental(Bi_df: pd.DataFrame, Ci_df: pd.DataFrame, n_trials: int = 50, seed: int = 0,
+                      **options) -> pd.DataFrame:
+    """
+    ランダムな1行の書き換えを確定しながら、差分更新の max_abs・KW 指標テーブルと
+    KW_IND_diff / KW_IND.compute_kw_table で計算し直した値を比べる（確認用。差は通常 0）
+
+    Returns:
+    pd.DataFrame: 試行ごとの max_abs, recomputed, abs_err, table_err, update_sec, recompute_sec
+    """
+    scorer = KWDiffRowScorer(Bi_df, Ci_df, **options)
+    o = scorer.options
+    rng = np.random.default_rng(seed)
+    records = []
+    for _ in range(n_trials):
+        i, values = random_row_edit(scorer, rng)
+        t0 = time.perf_counter()
+        max_abs = scorer.set_row(i, values)
+        t1 = time.perf_counter()
+        recomputed = scorer.recompute_max_abs()
+        t2 = time.perf_counter()
+        full = KW_IND.compute_kw_table(scorer.to_dataframe(), o["age_col"], o["metrics"], o["custom_bins"],
+                                       o["min_per_group"], o["p_norm"], o["p_scale"], o["p_cap"])
+        table_err = float(np.abs(scorer.table()[NUM_COLS].to_numpy() - full[NUM_COLS].to_numpy()).max()) \
+            if len(full) else 0.0
+        records.append({
+            "max_abs": max_abs,
+            "recomputed": recomputed,
+            "abs_err": abs(max_abs - recomputed),
+            "table_err": table_err,
+            "update_sec": t1 - t0,
+            "recompute_sec": t2 - t1,
+        })
+    return pd.DataFrame(records)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Ci の1行の書き換えに対する KW_IND_diff の max_abs の差分更新を、"
+                                             "計算し直した値と比べる（確認用）")
+    ap.add_argument("bi_csv", help="Bi のCSV")
+    ap.add_argument("ci_csv", help="Ci のCSV")
+    ap.add_argument("--trials", type=int, default=50, help="書き換える回数（default: 50）")
+    ap.add_argument("--seed", type=int, default=0, help="乱数シード（default: 0）")
+    ap.add_argument("--custom-bins", default="", help="臨床カスタム区切り（KW_IND_diff.py と同じ）")
+    ap.add_argument("--min-per-group", type=int, default=2, help="各群の最小サンプル数（既定: 2）")
+    args = ap.parse_args()
+
+    Bi = pd.read_csv(args.bi_csv, dtype=str, keep_default_na=False)
+    Ci = pd.read_csv(args.ci_csv, dtype=str, keep_default_na=False)
+    res = check_incremental(Bi, Ci, args.trials, args.seed,
+                            custom_bins=args.custom_bins, min_per_group=args.min_per_group)
+    print(f"max |incremental - recomputed| = {res['abs_err'].max():.3g}  "
+          f"max table diff = {res['table_err'].max():.3g}  "
+          f"mean time incremental {res['update_sec'].mean() * 1e3:.2f} ms / "
+          f"recompute {res['recompute_sec'].mean() * 1e3:.1f} ms")
@@ -11,7 +11,7 @@ LR_asthma_diff.py
 - 最後に、表全体（coef, p_value, OR_norm, CI_low_norm, CI_high_norm, VIF_norm）の
   絶対差の最大値を MAX_ABS_DIFF として出力。
 
-依存: numpy, pandas, statsmodels, scikit-learn
+依存: numpy, pandas, statsmodels（--solver irls では不要）, scikit-learn
 """
 
 import argparse
@@ -32,7 +32,7 @@ COLS_ORDER = LR_asthma.COLS_ORDER
 
 def eval_diff_max_abs(df1: pd.DataFrame, df2: pd.DataFrame, 
               target="asthma_flag", test_size=0.2, random_state=42, ensure_terms="ETHNICITY_hispanic",
-              out=None, print_details=False):
+              out=None, print_details=False, lr1=None, solver="statsmodels", warm_start=False):
     """
     DataFrameを2つ受け取って、それらのLRでの差が最大になる変数での差を出力
 
@@ -41,43 +41,27 @@ def eval_diff_max_abs(df1: pd.DataFrame, df2: pd.DataFrame,
     path_to_csv2 (str): CSVファイルその1
     out (str): 各指標の差を保存したい場所を指定。テーブル同士の差が書き込まれる
     print_details (bool): 詳細の結果を表示するかどうか
+    lr1 (tuple): 事前計算済みの df1 の run_lr_table の戻り値（指定時は df1 を使わない）
+    solver (str): ロジスティック回帰の解法（"statsmodels" / "irls"、LR_asthma.run_lr_table 参照）
+    warm_start (bool): df2 の回帰を df1 の係数から始める（eval_diff 参照）
 
     Returns:
     最も大きい差 (float)
     """
 
-    diff = eval_diff(df1, df2, target, test_size, random_state, ensure_terms, out, print_details)
+    diff = eval_diff(df1, df2, target, test_size, random_state, ensure_terms, out, print_details,
+                     lr1=lr1, solver=solver, warm_start=warm_start)
 
     # 最大絶対差（表の全数値列から算出。AUCは含めない）
     max_abs = float(np.nanmax(np.abs(diff[COLS_ORDER[1:]].to_numpy()))) if not diff.empty else 0.0
 
     return max_abs
 
-def eval_diff(df1: pd.DataFrame, df2: pd.DataFrame, 
-              target="asthma_flag", test_size=0.2, random_state=42, ensure_terms="ETHNICITY_hispanic",
-              out=None, print_details=False):
+def diff_tables(t1: pd.DataFrame, terms1: list[str], t2: pd.DataFrame, terms2: list[str]) -> pd.DataFrame:
     """
-    DataFrameを2つ受け取って、それぞれの各変数を目的としたLRを実行して、差を評価
-
-    Paramters:
-    kw_table1 (pd.DataFrame): DataFrameその1
-    kw_table2 (pd.DataFrame): DataFrameその2
-    out (str): 各差を保存したい場所を指定。テーブル同士の差が書き込まれる
-    print_details (bool): 詳細の結果を表示するかどうか
-
-    Returns:
-    その2 - その1 (pd.DataFrame)
+    run_lr_table の表2つの差分表（t2 - t1）。term は和集合で、片側に無い term・NaN は 0。
+    coef の差分は sigmoid で (-1, 1) に写像する。
     """
-    # 片方ずつ LR 実行
-    t1, auc1, terms1 = LR_asthma.run_lr_table(
-        df1, target=target, test_size=test_size,
-        random_state=random_state, ensure_terms=ensure_terms
-    )
-    t2, auc2, terms2 = LR_asthma.run_lr_table(
-        df2, target=target, test_size=test_size,
-        random_state=random_state, ensure_terms=ensure_terms
-    )
-
     # term 和集合で reindex（欠側は0）
     terms_all = sorted(set(terms1).union(set(terms2)))
     t1i = t1.set_index("term").reindex(terms_all).fillna(0.0)
@@ -95,6 +79,72 @@ def eval_diff(df1: pd.DataFrame, df2: pd.DataFrame,
     for c in COLS_ORDER[1:]:
         diff[c] = pd.to_numeric(diff[c], errors="coerce").fillna(0.0)
 
+    return diff
+
+def eval_diff_max_abs_many(df1: pd.DataFrame, dfs2: list,
+                           target="asthma_flag", test_size=0.2, random_state=42,
+                           ensure_terms="ETHNICITY_hispanic", lr1=None, warm_start=False) -> list[float]:
+    """
+    df1（Bi）と複数の df2（同じ Bi から作った Ci の候補など）それぞれとの LR の差の最大値を返す。
+    df2 側のロジスティック回帰は LR_asthma.run_lr_tables でまとめて解く（solver="irls" 相当）。
+
+    Paramters:
+    df1 (pd.DataFrame): DataFrameその1
+    dfs2 (list): DataFrameその2 のリスト
+    lr1 (tuple): 事前計算済みの df1 の run_lr_table の戻り値（指定時は df1 を使わない）
+    warm_start (bool): df2 の回帰を df1 の係数から始める（eval_diff 参照）
+
+    Returns:
+    df2 ごとの最も大きい差 (list[float])
+    """
+    lr_kwargs = dict(target=target, test_size=test_size, random_state=random_state,
+                     ensure_terms=ensure_terms)
+    if lr1 is None:
+        lr1 = LR_asthma.run_lr_table(df1, solver="irls", return_fit=True, **lr_kwargs)
+    t1, _, terms1 = lr1[:3]
+    fit1 = lr1[3] if len(lr1) > 3 else None
+    start = fit1["params"] if warm_start and fit1 is not None else None
+
+    max_abs = []
+    for t2, _, terms2 in LR_asthma.run_lr_tables(dfs2, start_params=start, **lr_kwargs):
+        diff = diff_tables(t1, terms1, t2, terms2)
+        max_abs.append(float(np.nanmax(np.abs(diff[COLS_ORDER[1:]].to_numpy()))) if not diff.empty else 0.0)
+    return max_abs
+
+def eval_diff(df1: pd.DataFrame, df2: pd.DataFrame, 
+              target="asthma_flag", test_size=0.2, random_state=42, ensure_terms="ETHNICITY_hispanic",
+              out=None, print_details=False, lr1=None, solver="statsmodels", warm_start=False):
+    """
+    DataFrameを2つ受け取って、それぞれの各変数を目的としたLRを実行して、差を評価
+
+    Paramters:
+    kw_table1 (pd.DataFrame): DataFrameその1
+    kw_table2 (pd.DataFrame): DataFrameその2
+    out (str): 各差を保存したい場所を指定。テーブル同士の差が書き込まれる
+    print_details (bool): 詳細の結果を表示するかどうか
+    lr1 (tuple): 事前計算済みの df1 の run_lr_table の戻り値（指定時は df1 を使わない）
+    solver (str): ロジスティック回帰の解法（"statsmodels" / "irls"）
+    warm_start (bool): df2 の回帰を df1 の係数（定数項を含む）から始める（solver="irls" のみ）。
+        one-hot の term の増減は run_lr_table 側でそろえる。
+        lr1 に学習結果が無い（run_lr_table(return_fit=True) の戻り値でない）場合は通常どおり解く。
+        IRLS の収束判定は初期値によらないので、結果は丸め誤差の範囲で通常の解と一致する。
+        反復回数は減らないことが多い（README 参照）
+
+    Returns:
+    その2 - その1 (pd.DataFrame)
+    """
+    lr_kwargs = dict(target=target, test_size=test_size, random_state=random_state,
+                     ensure_terms=ensure_terms, solver=solver)
+    # 片方ずつ LR 実行（df1 側は事前計算があれば再利用）
+    if lr1 is None:
+        lr1 = LR_asthma.run_lr_table(df1, return_fit=True, **lr_kwargs)
+    t1, auc1, terms1 = lr1[:3]
+    fit1 = lr1[3] if len(lr1) > 3 else None
+    start = fit1["params"] if warm_start and fit1 is not None else None
+    t2, auc2, terms2, fit2 = LR_asthma.run_lr_table(df2, start_params=start, return_fit=True, **lr_kwargs)
+
+    diff = diff_tables(t1, terms1, t2, terms2)
+
     # 出力
     if print_details:
         with pd.option_context("display.max_columns", None,
@@ -103,6 +153,14 @@ def eval_diff(df1: pd.DataFrame, df2: pd.DataFrame,
             print(f"AUC (file1): {auc1:.6f}")
             print(f"AUC (file2): {auc2:.6f}")
             print(f"AUC_DIFF   : {auc2 - auc1:.6f}")
+            if solver == "irls":
+                if fit1 is not None:
+                    print(f"IRLS iterations (file1): {fit1['n_iter']}")
+                if start is not None:
+                    state = "from file1" if fit2["warm_start"] else "from file1, not converged -> restarted"
+                    print(f"IRLS iterations (file2): {fit2['n_iter']} (warm start {state})")
+                else:
+                    print(f"IRLS iterations (file2): {fit2['n_iter']}")
 
             print("\n=== Logistic regression DIFF (file2 - file1) — const excluded; values are differences ===")
             print(diff.to_string(index=False))
@@ -113,9 +171,27 @@ def eval_diff(df1: pd.DataFrame, df2: pd.DataFrame,
 
     return diff
 
+def check_warm_start(df1: pd.DataFrame, df2: pd.DataFrame,
+                     target="asthma_flag", test_size=0.2, random_state=42, ensure_terms="ETHNICITY_hispanic") -> dict:
+    """
+    df2 の回帰（solver="irls"）を df1 の係数から始めた場合と初期値なしの場合を比べる（確認用）
+
+    Returns:
+    dict: warm_iter, cold_iter（IRLS の反復回数）, warm_converged（df1 の係数から収束したか）,
+          max_abs_diff（2つの LR 表の値の最大絶対差）
+    """
+    lr_kwargs = dict(target=target, test_size=test_size, random_state=random_state,
+                     ensure_terms=ensure_terms, solver="irls")
+    fit1 = LR_asthma.run_lr_table(df1, return_fit=True, **lr_kwargs)[3]
+    t_w, _, _, fit_w = LR_asthma.run_lr_table(df2, start_params=fit1["params"], return_fit=True, **lr_kwargs)
+    t_c, _, _, fit_c = LR_asthma.run_lr_table(df2, return_fit=True, **lr_kwargs)
+    diff = np.abs(t_w[COLS_ORDER[1:]].to_numpy(dtype=float) - t_c[COLS_ORDER[1:]].to_numpy(dtype=float))
+    return {"warm_iter": fit_w["n_iter"], "cold_iter": fit_c["n_iter"], "warm_converged": fit_w["warm_start"],
+            "max_abs_diff": float(np.nanmax(diff, initial=0.0))}
+
 def eval(path_to_csv1:str, path_to_csv2:str,
          target="asthma_flag", test_size=0.2, random_state=42, ensure_terms="ETHNICITY_hispanic",
-         out=None, print_details=False):
+         out=None, print_details=False, solver="statsmodels", warm_start=False):
     """
     CSVファイルへのパスを2つ受け取って、それらのLRでの差が最大になる変数での差を出力
 
@@ -132,23 +208,59 @@ def eval(path_to_csv1:str, path_to_csv2:str,
     df1 = pd.read_csv(path_to_csv1, dtype=str, keep_default_na=False)
     df2 = pd.read_csv(path_to_csv2, dtype=str, keep_default_na=False)
 
-    max_abs = eval_diff_max_abs(df1, df2, target, test_size, random_state, ensure_terms, out, print_details)
+    max_abs = eval_diff_max_abs(df1, df2, target, test_size, random_state, ensure_terms, out, print_details,
+                                solver=solver, warm_start=warm_start)
 
     return max_abs
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser(description="LR_asthma 差分: 2つのCSVの 0〜1 指標（coefは実数）を (file2 - file1) で出力。欠側termは0埋め。NaNは0。")
     ap.add_argument("csv1", help="1つ目のCSV（baseline）")
-    ap.add_argument("csv2", help="2つ目のCSV（to compare）")
+    ap.add_argument("csv2", nargs="+",
+                    help="2つ目のCSV（to compare）。複数指定すると回帰をまとめて解き（--solver irls 相当）、"
+                         "それぞれの MAX_ABS_DIFF だけを表示")
     ap.add_argument("--target", default="asthma_flag", help="binary target column (default: asthma_flag)")
     ap.add_argument("--test-size", type=float, default=0.2, help="holdout ratio (default: 0.2)")
     ap.add_argument("--random-state", type=int, default=42, help="random seed (default: 42)")
     ap.add_argument("--ensure-terms", default="ETHNICITY_hispanic",
                     help="常に出力に含めたい term 名（カンマ区切り）")
-    ap.add_argument("-o", "--out", default=None, help="差分表をCSV保存（任意）")
+    ap.add_argument("-o", "--out", default=None, help="差分表をCSV保存（任意。csv2 が1つのときだけ）")
+    ap.add_argument("--solver", choices=LR_asthma.SOLVERS, default=None,
+                    help="ロジスティック回帰の解法（default: statsmodels。公式の数値は statsmodels）。"
+                         "csv2 を複数指定したときは irls だけ")
+    ap.add_argument("--warm-start", action="store_true",
+                    help="csv2 の回帰を csv1 の係数から始める（--solver irls のみ。反復回数を表示）")
+    ap.add_argument("--check-warm-start", action="store_true",
+                    help="csv2 の回帰（IRLS）を csv1 の係数から始めた場合と初期値なしの場合の反復回数・表の差を表示して終了")
     args = ap.parse_args()
+    many = len(args.csv2) > 1
+    if many and args.out is not None:
+        ap.error("-o/--out は csv2 を1つだけ指定したときに使える")
+    if many and args.solver not in (None, "irls"):
+        ap.error(f"csv2 を複数指定したときは --solver irls だけ使える: {args.solver}")
+    solver = args.solver or ("irls" if many else "statsmodels")
+    if args.warm_start and solver != "irls":
+        ap.error("--warm-start は --solver irls でだけ使える")
+
+    if args.check_warm_start:
+        df1 = pd.read_csv(args.csv1, dtype=str, keep_default_na=False)
+        for p in args.csv2:
+            r = check_warm_start(df1, pd.read_csv(p, dtype=str, keep_default_na=False), args.target,
+                                 args.test_size, args.random_state, args.ensure_terms)
+            state = "" if r["warm_converged"] else " (not converged -> restarted)"
+            print(f"IRLS iterations warm {r['warm_iter']}{state} / cold {r['cold_iter']} "
+                  f"(saved {r['cold_iter'] - r['warm_iter']}), max |warm - cold| {r['max_abs_diff']:.3g}  {p}")
+        sys.exit(0)
 
-    max_abs = eval(args.csv1, args.csv2, 
-                   args.target, args.test_size, args.random_state, 
-                   args.ensure_terms, args.out, True)
-    print(f"\nMAX_ABS_DIFF {max_abs:.6g}")
+    if many:
+        df1 = pd.read_csv(args.csv1, dtype=str, keep_default_na=False)
+        dfs2 = [pd.read_csv(p, dtype=str, keep_default_na=False) for p in args.csv2]
+        max_abs = eval_diff_max_abs_many(df1, dfs2, args.target, args.test_size, args.random_state,
+                                         args.ensure_terms, warm_start=args.warm_start)
+        for p, v in zip(args.csv2, max_abs):
+            print(f"MAX_ABS_DIFF {v:.6g} {p}")
+    else:
+        max_abs = eval(args.csv1, args.csv2[0], 
+                       args.target, args.test_size, args.random_state, 
+                       args.ensure_terms, args.out, True, solver=solver, warm_start=args.warm_start)
+        print(f"\nMAX_ABS_DIFF {max_abs:.6g}")
@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+LR_asthma_diff_rows.py
+- Bi を固定し、Ci のいくつかの行（の一部の列）を書き換えた時の LR_asthma_diff の max_abs を、
+  Ci の学習済みの解からの近似更新で求める（局所探索型の匿名化で「この行をこう変えたら？」を
+  大量に試す用途。毎回の GLM の学習をしない）。
+- 保持する状態: Ci の係数 β、学習行列（定数項付き）A とその A^T A、β での X^T W X（H）とその Cholesky 分解、
+  β での勾配 X^T (y - μ)。
+- 書き換えた行の計画行列の行だけを入れ替え、次のどちらかで係数を更新する。
+    newton    : H から書き換えた行の分を差し替えた H' で1回だけ Newton 法の更新 β + H'^{-1} g
+    influence : 元の H のままの更新 β + H^{-1} g（影響関数による1次近似。H' の分解も省く）
+  g は書き換え後のデータでの β における勾配（書き換えた行の分だけ差し替える）。
+- 更新後の係数での書き換え後のデータの勾配（全学習行の行列ベクトル積）を同じ分解に通して係数を1回補正する。
+  標準誤差・Wald 信頼区間・p 値は補正後の係数での X^T W X（全学習行の重みを計算し直す。O(n k^2)）から求める。
+  VIF は A^T A を書き換えた行の分だけ差し替えて求める（共線に近い場合だけ全行で vif_all）。
+- 誤差の見積もり: 補正後の係数での X^T W X による次の Newton 法の補正（適用しない）で
+  表（coef / p_value / OR_norm / CI_*_norm）が変わる量の最大値。Newton 法は2次収束するので実際の誤差とほぼ等しい。
+  見積もりが tol を超えた場合、term の集合・目的変数（学習/検証の分割）が変わる場合は
+  書き換え後の Ci で学習し直した厳密な値を返す。
+- 学習は LR_asthma.fit_logit_irls（solver="irls"）で行う。
+"""
+
+import argparse
+import sys
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scipy.linalg import cho_solve
+from scipy.stats import logistic, norm
+
+import LR_asthma_diff
+
+# モジュールの相対参照制限を強制的に回避
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..', 'analysis'))
+import LR_asthma
+from parsed_table import ParsedTable, as_parsed
+
+
+COLS_ORDER = LR_asthma.COLS_ORDER
+METHODS = ["newton", "influence"]
+
+
+def _wald(params: np.ndarray, cov: np.ndarray) -> dict:
+    """係数と共分散行列から fit_logit_irls と同じ形の p 値・Wald 信頼区間を作る"""
+    bse = np.sqrt(np.maximum(np.diag(cov), 0.0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pvalues = 2 * norm.sf(np.abs(params / bse))
+    return {"params": params, "bse": bse, "cov": cov, "pvalues": pvalues,
+            "conf_low": params - LR_asthma._Z_975 * bse, "conf_high": params + LR_asthma._Z_975 * bse}
+
+
+def _vif_from_gram(G: np.ndarray, n: int) -> np.ndarray | None:
+    """
+    定数項付きの学習行列 A の A^T A（G）から LR_asthma.vif_all と同じ VIF を求める。
+    分散 0 に近い列・共線に近い（相関行列の Cholesky 分解に失敗する、VIF が巨大な）場合は
+    行列全体での vif_all に任せるため None を返す。
+    """
+    s = G[0, 1:]
+    S = G[1:, 1:] - np.outer(s, s) / n
+    ss = np.diag(S)
+    if len(ss) == 0 or not (ss > 1e-12 * np.maximum(np.diag(G)[1:], 1.0)).all():
+        return None
+    d = 1.0 / np.sqrt(ss)
+    try:
+        L = np.linalg.cholesky(S * d[:, None] * d[None, :])
+    except np.linalg.LinAlgError:
+        return None
+    L_inv = np.linalg.solve(L, np.eye(len(L)))
+    vif = (L_inv * L_inv).sum(axis=0)
+    return vif if vif.max() < 1e8 else None
+
+
+def _coef_columns(fit: dict) -> np.ndarray:
+    """表のうち係数から決まる列（coef, p_value, OR_norm, CI_low_norm, CI_high_norm。定数項除く）"""
+    params = fit["params"][1:]
+    return np.column_stack([
+        params,
+        fit["pvalues"][1:],
+        LR_asthma.odds_to_unit(np.exp(params)),
+        LR_asthma.odds_to_unit(np.exp(fit["conf_low"][1:])),
+        LR_asthma.odds_to_unit(np.exp(fit["conf_high"][1:])),
+    ])
+
+
+class LRDiffRowScorer:
+    """
+    Bi を固定し、Ci の行単位の書き換えに対する LR_asthma_diff の max_abs を近似更新で求める。
+
+    - score_rows(rows) : rows（{行番号: {列名: 文字列}}）で書き換えた場合の結果を返す（状態は変えない）
+    - score_row(i, values) : 1行だけの score_rows の max_abs
+    - set_rows(rows)   : 書き換えを確定し、書き換え後の Ci で学習し直して状態を作り直す
+    行番号は Ci の 0 始まりの行位置。
+    """
+
+    def __init__(self, Bi_df: pd.DataFrame | ParsedTable | None, Ci_df: pd.DataFrame | ParsedTable,
+                 lr1: tuple | None = None,
+                 target: str = "asthma_flag", test_size: float = 0.2, random_state: int = 42,
+                 ensure_terms: str = "ETHNICITY_hispanic",
+                 method: str = "newton", tol: float = 1e-4):
+        if method not in METHODS:
+            raise ValueError(f"method は {METHODS} のいずれか: {method}")
+        self.lr_kwargs = dict(target=target, test_size=test_size, random_state=random_state,
+                              ensure_terms=ensure_terms)
+        self.method = method
+        self.tol = tol
+        if lr1 is None:
+            lr1 = LR_asthma.run_lr_table(Bi_df, solver="irls", **self.lr_kwargs)
+        self.lr1 = lr1
+        self.t1, _, self.terms1 = lr1[:3]
+
+        pt = as_parsed(Ci_df)
+        self.columns = list(pt.columns)
+        self.n_rows = pt.n_rows
+        # 列ごとの現在の値（元の文字列）
+        self.cells = {c: np.asarray(pt.raw_levels[c], dtype=object)[pt.raw_codes[c]] for c in self.columns}
+        self._fit(pt)
+
+    # ---------- 学習済みの状態 ----------
+
+    def _fit(self, pt: ParsedTable, start_params: pd.Series | None = None):
+        """pt で学習し直し、近似更新に使う状態を作る（start_params は term 名 → 係数の初期値）"""
+        target = self.lr_kwargs["target"]
+        base_terms, X_tr, _, y_tr, _ = LR_asthma.split_design(
+            pt, target, self.lr_kwargs["test_size"], self.lr_kwargs["random_state"])
+        self.pt = pt
+        self.base_terms = base_terms
+        self.term_pos = {t: k for k, t in enumerate(base_terms)}
+        # 元の列ごとの学習に使う term（ゼロ分散の列を除く）
+        self.col_terms = {c: sorted(t for t, v in LR_asthma.column_features(pt, c).items() if v.min() != v.max())
+                          for c in pt.columns if c != target}
+        self.tr_pos = pt.index.get_indexer(X_tr.index)
+        self.A_tr = LR_asthma.add_const(X_tr.to_numpy(dtype="float64"))
+        self.y_tr = y_tr.to_numpy(dtype="float64")
+
+        fit = LR_asthma.fit_logit(self.A_tr, self.y_tr, self.A_tr[:0], solver="irls",
+                                  start_params=LR_asthma._align_start(start_params, ["const"] + base_terms))
+        self.fit = fit
+        self.beta = fit["params"]
+        self.mu_tr = LR_asthma._logit_mu(self.A_tr @ self.beta)
+        self.w_tr = self.mu_tr * (1 - self.mu_tr)
+        self.G = self.A_tr.T @ self.A_tr
+        self.H = self.A_tr.T @ (self.A_tr * self.w_tr[:, None])
+        self.grad = self.A_tr.T @ (self.y_tr - self.mu_tr)
+        self.H_chol = LR_asthma._chol_inverse(self.H)[0]
+
+        self.table, self.terms = LR_asthma._lr_table(base_terms, X_tr, fit, self.lr_kwargs["ensure_terms"])
+        self.max_abs = self._max_abs(self.table, self.terms)
+
+        # term の集合が変わらない書き換え用に、Bi の表を term の和集合の並びにそろえておく
+        self.terms_all = sorted(set(self.terms1).union(self.terms))
+        self.t1_values = (self.t1.set_index("term").reindex(self.terms_all).fillna(0.0)[COLS_ORDER[1:]]
+                          .to_numpy(dtype="float64"))
+        pos = {t: k for k, t in enumerate(self.terms_all)}
+        self.base_pos = np.array([pos[t] for t in base_terms], dtype=np.intp)
+        self.terms_pos = np.array([pos[t] for t in self.terms], dtype=np.intp)
+
+    def _max_abs(self, table: pd.DataFrame, terms: list[str]) -> float:
+        diff = LR_asthma_diff.diff_tables(self.t1, self.terms1, table, terms)
+        return float(np.nanmax(np.abs(diff[COLS_ORDER[1:]].to_numpy()))) if not diff.empty else 0.0
+
+    def _table_max_abs(self, fit: dict, vif: np.ndarray) -> tuple[pd.DataFrame, float]:
+        """
+        term の集合が変わらない場合の表と max_abs を、LR_asthma._lr_table と
+        LR_asthma_diff.diff_tables と同じ値になるよう NumPy で求める（vif は base_terms の並び）
+        """
+        values = np.zeros_like(self.t1_values)
+        values[self.base_pos, :5] = _coef_columns(fit)
+        values[self.base_pos, 5] = LR_asthma.vif_to_unit(vif)
+        values = np.where(np.isnan(values), 0.0, values)
+
+        diff = values - self.t1_values
+        diff[:, 0] = (logistic.cdf(diff[:, 0]) - 0.5) * 2
+        diff = np.where(np.isnan(diff), 0.0, diff)
+        max_abs = float(np.max(np.abs(diff))) if diff.size else 0.0
+
+        table = pd.DataFrame(values[self.terms_pos], columns=COLS_ORDER[1:])
+        table.insert(0, "term", self.terms)
+        return table, max_abs
+
+    def _modified(self, rows: dict) -> tuple[ParsedTable, list[str]]:
+        """rows で書き換えた列だけを更新した ParsedTable と、値が変わった列のリスト"""
+        by_col: dict[str, dict[int, str]] = {}
+        for i, values in rows.items():
+            if not 0 <= i < self.n_rows:
+                raise IndexError(f"行番号 {i} は範囲外です（0〜{self.n_rows - 1}）")
+            for c, s in values.items():
+                if c not in self.cells:
+                    raise KeyError(f"列 {c} は Ci にありません")
+                s = s if isinstance(s, str) else str(s)
+                if self.cells[c][i] != s:
+                    by_col.setdefault(c, {})[i] = s
+        pt = self.pt.copy()
+        for c, changes in by_col.items():
+            pt.set_values(c, list(changes), list(changes.values()))
+        return pt, list(by_col)
+
+    # ---------- 書き換えの評価 ----------
+
+    def _exact(self, pt: ParsedTable, reason: str) -> dict:
+        table, _, terms = LR_asthma.run_lr_table(
+            pt, solver="irls", start_params=pd.Series(self.beta, index=["const"] + self.base_terms),
+            **self.lr_kwargs)
+        return {"max_abs": self._max_abs(table, terms), "table": table,
+                "exact": True, "reason": reason, "error_estimate": 0.0}
+
+    def score_rows(self, rows: dict, exact: bool = False) -> dict:
+        """
+        Ci の行を rows（{行番号: {列名: 文字列}}）で書き換えた場合の結果を返す（状態は変えない）
+
+        Paramters:
+        rows (dict): {行番号: {列名: 文字列}}
+        exact (bool): 近似せずに学習し直す
+
+        Returns:
+        dict: max_abs, table（LR_asthma の表）, exact（学習し直したか）,
+              reason（学習し直した理由）, error_estimate（近似の誤差の見積もり）
+        """
+        pt, changed = self._modified(rows)
+        if exact:
+            return self._exact(pt, "exact")
+        if self.lr_kwargs["target"] in changed:
+            # 学習用・検証用の分割が変わる
+            return self._exact(pt, "target")
+
+        # 書き換えた列の計画行列の列だけを作り直す（中央値補完の値が変わった行も含む）
+        new_cols = {}
+        for c in changed:
+            features = LR_asthma.column_features(pt, c)
+            kept = {t: v for t, v in features.items() if v.min() != v.max()}
+            if sorted(kept) != self.col_terms[c]:
+                return self._exact(pt, "terms")
+            for t, v in kept.items():
+                new_cols[1 + self.term_pos[t]] = v[self.tr_pos]
+        cols = np.array(list(new_cols), dtype=np.intp)
+        V = np.column_stack(list(new_cols.values())) if new_cols else np.empty((len(self.A_tr), 0))
+        d = np.flatnonzero((V != self.A_tr[:, cols]).any(axis=1))
+        Xo = self.A_tr[d]
+        Xn = Xo.copy()
+        Xn[:, cols] = V[d]
+
+        beta = self.beta
+        yd = self.y_tr[d]
+        mu_n = LR_asthma._logit_mu(Xn @ beta)
+        g = self.grad + Xn.T @ (yd - mu_n) - Xo.T @ (yd - self.mu_tr[d])
+
+        if self.method == "newton":
+            w_n = mu_n * (1 - mu_n)
+            H = self.H - Xo.T @ (Xo * self.w_tr[d][:, None]) + Xn.T @ (Xn * w_n[:, None])
+            L = LR_asthma._chol_inverse(H)[0]
+        else:
+            L = self.H_chol
+        if L is None:
+            return self._exact(pt, "singular")
+        params = beta + cho_solve((L, True), g)
+
+        def weights(params):
+            # 書き換え後のデータでの params の μ（書き換えた行だけ入れ替える）と勾配
+            eta = self.A_tr @ params
+            eta[d] = Xn @ params
+            mu = LR_asthma._logit_mu(eta)
+            r = self.y_tr - mu
+            r[d] = 0.0
+            return mu, self.A_tr.T @ r + Xn.T @ (yd - mu[d])
+
+        # 更新後の係数での勾配で、同じ分解を使って係数を1回補正する
+        params = params + cho_solve((L, True), weights(params)[1])
+        # 標準誤差は補正後の係数での X^T W X から求める
+        mu, grad = weights(params)
+        w = mu * (1 - mu)
+        w_kept = w.copy()
+        w_kept[d] = 0.0
+        L, cov = LR_asthma._chol_inverse(self.A_tr.T @ (self.A_tr * w_kept[:, None]) + Xn.T @ (Xn * w[d][:, None]))
+        if L is None:
+            return self._exact(pt, "singular")
+        fit = _wald(params, cov)
+
+        # 誤差の見積もり: 次の Newton 法の補正（適用しない）で表が変わる量
+        fit_next = _wald(params + cho_solve((L, True), grad), cov)
+        with np.errstate(invalid="ignore"):
+            err = float(np.nanmax(np.abs(_coef_columns(fit_next) - _coef_columns(fit)), initial=0.0))
+        if not np.isfinite(err) or err > self.tol:
+            res = self._exact(pt, "tolerance")
+            res["error_estimate"] = err
+            return res
+
+        # VIF は A^T A を書き換えた行の分だけ差し替えて求める（共線に近い場合だけ全行で計算し直す）
+        vif = _vif_from_gram(self.G - Xo.T @ Xo + Xn.T @ Xn, len(self.A_tr))
+        if vif is None:
+            A_tr = self.A_tr.copy()
+            A_tr[:, cols] = V
+            vif = LR_asthma.vif_all(A_tr[:, 1:])
+        table, max_abs = self._table_max_abs(fit, vif)
+        return {"max_abs": max_abs, "table": table,
+                "exact": False, "reason": None, "error_estimate": err}
+
+    def score_row(self, i: int, values: dict) -> float:
+        """
+        Ci の行 i の列を values（{列名: 文字列}）で書き換えた場合の max_abs を返す（状態は変えない）
+        """
+        return self.score_rows({i: values})["max_abs"]
+
+    def set_rows(self, rows: dict) -> float:
+        """
+        Ci の行を rows で書き換え、書き換え後の Ci で学習し直して新しい max_abs を返す
+        （近似の誤差を持ち越さないよう、確定時は必ず学習し直す。初期値は現在の係数）
+        """
+        pt, _ = self._modified(rows)
+        for i, values in rows.items():
+            for c, s in values.items():
+                self.cells[c][i] = s if isinstance(s, str) else str(s)
+        start = pd.Series(self.beta, index=["const"] + self.base_terms)
+        self._fit(pt, start_params=start)
+        return self.max_abs
+
+    def set_row(self, i: int, values: dict) -> float:
+        """Ci の行 i の列を values で書き換え、新しい max_abs を返す"""
+        return self.set_rows({i: values})
+
+    # ---------- 確認用 ----------
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """現在の Ci（文字列の DataFrame）"""
+        return pd.DataFrame({c: self.cells[c] for c in self.columns})
+
+    def recompute_max_abs(self) -> float:
+        """現在の Ci から LR_asthma_diff.eval_diff_max_abs で再計算した max_abs（確認用）"""
+        return LR_asthma_diff.eval_diff_max_abs(None, self.to_dataframe(), lr1=self.lr1, solver="irls",
+                                                **self.lr_kwargs)
+
+
+def random_rows(Ci_df: pd.DataFrame, n_rows: int, n_cols: int, rng: np.random.Generator,
+                skip: tuple = ("asthma_flag",)) -> dict:
+    """
+    確認用の書き換え: ランダムな n_rows 行の n_cols 列を、同じ列の別の行の値に置き換える
+    """
+    cols = [c for c in Ci_df.columns if c not in skip]
+    rows = {}
+    for i in rng.choice(len(Ci_df), size=min(n_rows, len(Ci_df)), replace=False):
+        picked = rng.choice(cols, size=min(n_cols, len(cols)), replace=False)
+        rows[int(i)] = {c: Ci_df[c].iat[int(rng.integers(len(Ci_df)))] for c in picked}
+    return rows
+
+
+def check_approx(Bi_df: pd.DataFrame, Ci_df: pd.DataFrame, n_trials: int = 20, n_rows: int = 5,
+                 n_cols: int = 3, method: str = "newton", tol: float = 1e-4, seed: int = 0) -> pd.DataFrame:
+    """
+    ランダムな書き換えについて、近似の max_abs と学習し直した max_abs・所要時間を比べる（確認用）
+
+    Returns:
+    pd.DataFrame: 試行ごとの approx, exact, abs_err, error_estimate, refit, reason, approx_sec, exact_sec
+    """
+    scorer = LRDiffRowScorer(Bi_df, Ci_df, method=method, tol=tol)
+    rng = np.random.default_rng(seed)
+    records = []
+    for _ in range(n_trials):
+        rows = random_rows(Ci_df, n_rows, n_cols, rng)
+        t0 = time.perf_counter()
+        approx = scorer.score_rows(rows)
+        t1 = time.perf_counter()
+        exact = scorer.score_rows(rows, exact=True)
+        t2 = time.perf_counter()
+        records.append({
+            "approx": approx["max_abs"],
+            "exact": exact["max_abs"],
+            "abs_err": abs(approx["max_abs"] - exact["max_abs"]),
+            "error_estimate": approx["error_estimate"],
+            "refit": approx["exact"],
+            "reason": approx["reason"],
+            "approx_sec": t1 - t0,
+            "exact_sec": t2 - t1,
+        })
+    return pd.DataFrame(records)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Ci の行の書き換えに対する LR_asthma_diff の max_abs の近似更新を、"
+                                             "学習し直した値と比べる（確認用）")
+    ap.add_argument("bi_csv", help="Bi のCSV")
+    ap.add_argument("ci_csv", help="Ci のCSV")
+    ap.add_argument("--trials", type=int, default=20, help="試行回数（default: 20）")
+    ap.add_argument("--rows", type=int, default=5, help="1試行で書き換える行数（default: 5）")
+    ap.add_argument("--cols", type=int, default=3, help="1行で書き換える列数（default: 3）")
+    ap.add_argument("--method", choices=METHODS, default="newton", help="近似の方法（default: newton）")
+    ap.add_argument("--tol", type=float, default=1e-4,
+                    help="誤差の見積もりがこれを超えたら学習し直す（default: 1e-4）")
+    ap.add_argument("--seed", type=int, default=0, help="乱数シード（default: 0）")
+    args = ap.parse_args()
+
+    Bi = pd.read_csv(args.bi_csv, dtype=str, keep_default_na=False)
+    Ci = pd.read_csv(args.ci_csv, dtype=str, keep_default_na=False)
+    res = check_approx(Bi, Ci, args.trials, args.rows, args.cols, args.method, args.tol, args.seed)
+    with pd.option_context("display.width", None, "display.float_format", lambda x: f"{x:.3g}"):
+        print(res.to_string(index=False))
+    approx = res.loc[~res["refit"]]
+    print(f"\napprox used: {len(approx)}/{len(res)}  "
+          f"max |approx - exact| = {approx['abs_err'].max() if len(approx) else 0.0:.3g}  "
+          f"mean time approx {res['approx_sec'].mean() * 1e3:.1f} ms / exact {res['exact_sec'].mean() * 1e3:.1f} ms")
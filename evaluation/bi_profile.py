@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+bi_profile.py
+- Bi 側の採点用テーブル（stats_diff の term ベクトル、LR_asthma の LR 表と AUC、KW_IND の KW 表）を
+  事前に計算して保存する。
+- Bi は固定のまま多数の Ci を採点する場合に、eval_all.py --bi-profile で読み込むと
+  Ci 側の計算だけで採点できる。
+- プロファイルは Bi.csv の内容ハッシュ（sha256）と各採点モジュールのパラメータから作るキーで
+  識別し、読み込み時にキーが一致しなければ使わない。
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sys
+
+import pandas as pd
+
+import stats_diff
+import KW_IND_diff
+
+# モジュールの相対参照制限を強制的に回避
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..', 'util'))
+from pws_data_format import BiDataFrame
+from parsed_table import ParsedTable, as_parsed
+
+import LR_asthma
+import KW_IND
+
+PROFILE_VERSION = 4
+
+# eval_all.py が使う採点パラメータ（各モジュールの既定値）
+LR_PARAMS_DEFAULT = {
+    "target": "asthma_flag",
+    "test_size": 0.2,
+    "random_state": 42,
+    "ensure_terms": "ETHNICITY_hispanic",
+    "solver": "statsmodels",  # Bi のロジスティック回帰の解法。Ci 側の解法（--lr-solver）と同じにする
+}
+KW_PARAMS_DEFAULT = {
+    "age_col": KW_IND_diff.TARGET_DEFAULT,
+    "metrics": ",".join(KW_IND_diff.METRICS_DEFAULT),
+    "custom_bins": "",
+    "min_per_group": 2,
+    "p_norm": KW_IND_diff.DEFAULT_P_NORM,
+    "p_scale": KW_IND_diff.DEFAULT_P_SCALE,
+    "p_cap": KW_IND_diff.DEFAULT_P_CAP,
+}
+
+
+def lr_params_for(solver: str) -> dict:
+    """LR_PARAMS_DEFAULT の解法だけを solver にした LR_asthma の採点パラメータ"""
+    if solver not in LR_asthma.SOLVERS:
+        raise ValueError(f"solver は {LR_asthma.SOLVERS} のいずれか: {solver}")
+    return {**LR_PARAMS_DEFAULT, "solver": solver}
+
+
+def check_lr_solver(profile: dict, solver: str):
+    """
+    プロファイルの Bi の LR 表が solver で学習したものか確認する（解法の異なる表同士は比べない）。
+    solver の無い古いプロファイルは statsmodels で学習している。
+    """
+    built = profile.get("lr_params", {}).get("solver", "statsmodels")
+    if built != solver:
+        raise ValueError(f"Biプロファイルの LR 表は solver={built} で学習されています（Ci は solver={solver}）。"
+                         f"同じ解法のプロファイルを使ってください")
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def profile_key(bi_sha256: str, lr_params: dict, kw_params: dict) -> str:
+    """Bi.csv の内容ハッシュと採点パラメータからプロファイルのキーを作る"""
+    payload = json.dumps({
+        "version": PROFILE_VERSION,
+        "bi_sha256": bi_sha256,
+        "lr": lr_params,
+        "kw": kw_params,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def build_bi_profile(Bi_df: pd.DataFrame | ParsedTable, bi_sha256: str,
+                     lr_params: dict = LR_PARAMS_DEFAULT,
+                     kw_params: dict = KW_PARAMS_DEFAULT) -> dict:
+    """
+    Bi 側の3つの採点用テーブルを計算してプロファイル（dict）にまとめる
+
+    Paramters:
+    Bi_df (pd.DataFrame | ParsedTable): Bi（解析済みでも可）
+    bi_sha256 (str): Bi.csv の内容ハッシュ
+    lr_params (dict): LR_asthma の採点パラメータ
+    kw_params (dict): KW_IND の採点パラメータ
+
+    Returns:
+    プロファイル (dict)
+    """
+    pt = as_parsed(Bi_df)
+
+    stats_table = stats_diff.build_term_vector(pt)
+    lr_table = LR_asthma.run_lr_table(
+        pt, target=lr_params["target"], test_size=lr_params["test_size"],
+        random_state=lr_params["random_state"], ensure_terms=lr_params["ensure_terms"],
+        solver=lr_params["solver"], return_fit=True
+    )
+    kw_table = KW_IND.compute_kw_table(
+        pt, kw_params["age_col"], kw_params["metrics"], kw_params["custom_bins"],
+        kw_params["min_per_group"], kw_params["p_norm"], kw_params["p_scale"], kw_params["p_cap"]
+    )
+
+    return {
+        "version": PROFILE_VERSION,
+        "key": profile_key(bi_sha256, lr_params, kw_params),
+        "bi_sha256": bi_sha256,
+        "lr_params": dict(lr_params),
+        "kw_params": dict(kw_params),
+        "stats_table": stats_table,  # stats_diff.TermVector
+        "lr_table": lr_table,  # (LR表, AUC, term リスト, 学習結果)。学習結果は Ci の回帰の初期値に使う
+        "kw_table": kw_table,
+    }
+
+
+def save_bi_profile(profile: dict, path: str):
+    d = os.path.dirname(os.path.abspath(path))
+    os.makedirs(d, exist_ok=True)
+    with open(path, "wb") as f:
+        pickle.dump(profile, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_bi_profile(path: str, path_to_Bi_csv: str,
+                    lr_params: dict = LR_PARAMS_DEFAULT,
+                    kw_params: dict = KW_PARAMS_DEFAULT) -> dict | None:
+    """
+    プロファイルを読み込む。ファイルが無い場合や、Bi.csv の内容・パラメータと
+    キーが一致しない場合は None を返す。
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        profile = pickle.load(f)
+    expected = profile_key(file_sha256(path_to_Bi_csv), lr_params, kw_params)
+    if not isinstance(profile, dict) or profile.get("key") != expected:
+        return None
+    return profile
+
+
+def load_or_build_bi_profile(path: str, path_to_Bi_csv: str,
+                             lr_params: dict = LR_PARAMS_DEFAULT,
+                             kw_params: dict = KW_PARAMS_DEFAULT) -> dict:
+    """
+    キーの一致するプロファイルがあれば読み込み、無ければ Bi.csv のフォーマットを確認した上で
+    作成して保存する。
+    """
+    profile = load_bi_profile(path, path_to_Bi_csv, lr_params, kw_params)
+    if profile is not None:
+        return profile
+
+    # フォーマット違反の Bi からはプロファイルを作らない
+    Bi_df = BiDataFrame.read_csv(path_to_Bi_csv)
+    profile = build_bi_profile(Bi_df, file_sha256(path_to_Bi_csv), lr_params, kw_params)
+    save_bi_profile(profile, path)
+    print(f"Biプロファイルを作成しました: {path}")
+    return profile
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Bi 側の採点用テーブルを事前計算してプロファイルとして保存")
+    ap.add_argument("Bi_csv", help="path to Bi.csv")
+    ap.add_argument("-o", "--out", required=True, help="プロファイルの保存先（例: Bi_profile.pkl）")
+    ap.add_argument("--lr-solver", choices=LR_asthma.SOLVERS, default="statsmodels",
+                    help="LR_asthma のロジスティック回帰の解法（採点時の --lr-solver と同じにする。既定: statsmodels）")
+    args = ap.parse_args()
+
+    profile = load_or_build_bi_profile(args.out, args.Bi_csv, lr_params_for(args.lr_solver))
+    print(f"key: {profile['key']}")
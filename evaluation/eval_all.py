@@ -1,66 +1,263 @@
 import csv
 import argparse
 import sys, os
+import time
 
+import numpy as np
 import pandas as pd
 
 import stats_diff
 import LR_asthma_diff
 import KW_IND_diff
+import bi_profile as bi_profile_mod
 
 # モジュールの相対参照制限を強制的に回避
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(current_dir, '..', 'util'))
 from pws_data_format import BiDataFrame, CiDataFrame, FormatError
+from parsed_table import ParsedTable
 
 def is_csv_file(path):
     return path.lower().endswith(".csv")
 
-def eval_Ci_df_utility(Bi_df:pd.DataFrame, Ci_df:pd.DataFrame,
-                       print_details:bool=False)->float:
-    
-    # 基本統計の誤差を算出
-    stats_diff_max_abs = stats_diff.eval_diff_max_abs(Bi_df, Ci_df, 
-                                                      print_details=print_details)
-    print(f"stats_diff max_abs: {stats_diff_max_abs}")
+# 各採点の utility への重み
+UTILITY_WEIGHTS = {"stats_diff": 40, "LR_asthma_diff": 20, "KW_IND_diff": 20}
+
+# 閾値モードで採点する順序（計算の軽い順）
+THRESHOLD_STAGE_ORDER = ["stats_diff", "KW_IND_diff", "LR_asthma_diff"]
+
+def calc_Ci_utility(stats_diff_max_abs:float, LR_asthma_diff_max_abs:float,
+                    KW_IND_diff_max_abs:float)->float:
+    # 重み付きutility
+    return 40 * (1-stats_diff_max_abs) + 20 * (1-LR_asthma_diff_max_abs) + 20 * (1-KW_IND_diff_max_abs)
+
+def utility_upper_bound(max_abs:dict)->float:
+    """
+    一部の採点だけが済んだ時点で到達しうる utility の上限。
+    未採点の分野は max_abs = 0（満点）とみなす。全分野が済んでいれば calc_Ci_utility と一致する。
+    """
+    return sum(w * (1 - max_abs[name]) if max_abs.get(name) is not None else w
+               for name, w in UTILITY_WEIGHTS.items())
+
+def score_Ci_df(Bi_df:pd.DataFrame | ParsedTable | None, Ci_df:pd.DataFrame | ParsedTable,
+                print_details:bool=False, bi_profile:dict | None=None,
+                verbose:bool=False, target_utility:float | None=None,
+                lr_solver:str="statsmodels")->dict:
+    """
+    3つの採点を実行し、各 max_abs・utility・各段階の所要時間（秒）を dict で返す。
+    bi_profile（bi_profile.py で作成）を渡すと Bi 側の計算を省略する。この場合 Bi_df は None でよい。
+    verbose=True なら従来どおり各段階の結果を表示する。
 
-    # Logistic Regressionでの誤差を算出
-    LR_asthma_diff_max_abs = LR_asthma_diff.eval_diff_max_abs(Bi_df, Ci_df,
-                                                              print_details=print_details)
-    print(f"LR_asthma_diff max_abs: {LR_asthma_diff_max_abs}")
+    target_utility を指定すると閾値モードになる:
+    計算の軽い順（stats_diff → KW_IND_diff → LR_asthma_diff）に採点し、各段階の後で
+    到達しうる utility の上限（未採点の分野を満点とみなした値）が target_utility 以下になった時点で打ち切る。
+    打ち切った分野の max_abs と Ci_utility は None になる。
+    戻り値には常に utility_upper_bound（全分野が済んでいれば Ci_utility と同じ）と
+    skipped_stages（打ち切った分野のリスト）が入る。
 
-    # KW_IND_diff
-    KW_IND_diff_max_abs = KW_IND_diff.eval_diff_max_abs(Bi_df, Ci_df, 
-                                                        print_details=print_details)
-    print(f"KW_IND_diff max_abs: {KW_IND_diff_max_abs}")
+    lr_solver は LR_asthma_diff のロジスティック回帰の解法。公式の数値は既定値（statsmodels）。
+    """
+    timings = {}
+    t0 = time.perf_counter()
+
+    # 文字列の解析（数値化・カテゴリ化）は1回だけ行い、3つの採点で共有する
+    if bi_profile is None and not isinstance(Bi_df, ParsedTable):
+        Bi_df = ParsedTable(Bi_df)
+    if not isinstance(Ci_df, ParsedTable):
+        Ci_df = ParsedTable(Ci_df)
+    t1 = time.perf_counter()
+    timings["parse"] = t1 - t0
+
+    if bi_profile is not None:
+        bi_profile_mod.check_lr_solver(bi_profile, lr_solver)
+    profile = bi_profile or {}
+
+    stages = {
+        # 基本統計の誤差を算出
+        "stats_diff": lambda: stats_diff.eval_diff_max_abs(Bi_df, Ci_df,
+                                                           print_details=print_details,
+                                                           tbl1=profile.get("stats_table")),
+        # Logistic Regressionでの誤差を算出
+        "LR_asthma_diff": lambda: LR_asthma_diff.eval_diff_max_abs(Bi_df, Ci_df,
+                                                                   print_details=print_details,
+                                                                   lr1=profile.get("lr_table"),
+                                                                   solver=lr_solver),
+        # KW_IND_diff
+        "KW_IND_diff": lambda: KW_IND_diff.eval_diff_max_abs(Bi_df, Ci_df,
+                                                             print_details=print_details,
+                                                             kw_table1=profile.get("kw_table")),
+    }
+    order = list(UTILITY_WEIGHTS) if target_utility is None else THRESHOLD_STAGE_ORDER
+
+    max_abs = {}
+    skipped = []
+    bound = utility_upper_bound(max_abs)
+    t_prev = t1
+    for k, name in enumerate(order):
+        max_abs[name] = stages[name]()
+        if verbose:
+            print(f"{name} max_abs: {max_abs[name]}")
+        t_now = time.perf_counter()
+        timings[name] = t_now - t_prev
+        t_prev = t_now
+
+        bound = utility_upper_bound(max_abs)
+        if target_utility is not None and k < len(order) - 1 and bound <= target_utility:
+            # 残りが満点でも target_utility を超えられない
+            skipped = order[k + 1:]
+            break
 
     # 重み付きutility
-    Ci_utility = 40 * (1-stats_diff_max_abs) + 20 * (1-LR_asthma_diff_max_abs) + 20 * (1-KW_IND_diff_max_abs)
-    print(f"Ci utility: {Ci_utility} / 80")
-    
-def eval_Ci_utility(path_to_Bi_csv:str, path_to_Ci_csv:str, 
-                    print_details:bool=False)->float:
+    if skipped:
+        Ci_utility = None
+        if verbose:
+            print(f"Ci utility <= {bound} / 80 (target {target_utility} を超えられないため {', '.join(skipped)} を省略)")
+    else:
+        Ci_utility = calc_Ci_utility(max_abs["stats_diff"], max_abs["LR_asthma_diff"], max_abs["KW_IND_diff"])
+        if verbose:
+            print(f"Ci utility: {Ci_utility} / 80")
+    timings["total"] = t_prev - t0
+
+    return {
+        "stats_diff_max_abs": max_abs.get("stats_diff"),
+        "LR_asthma_diff_max_abs": max_abs.get("LR_asthma_diff"),
+        "KW_IND_diff_max_abs": max_abs.get("KW_IND_diff"),
+        "Ci_utility": Ci_utility,
+        "utility_upper_bound": Ci_utility if Ci_utility is not None else bound,
+        "skipped_stages": skipped,
+        "timings": timings,
+    }
+
+# 部分標本での足切りに使う採点（LR_asthma_diff は部分標本での値が全行の値と大きくずれるため使わない）
+SCREEN_STAGES = ["stats_diff", "KW_IND_diff"]
+
+def _score_sample(Ci_pt:ParsedTable, profile:dict)->dict:
+    return {
+        "stats_diff": stats_diff.eval_diff_max_abs(None, Ci_pt, tbl1=profile["stats_table"]),
+        "KW_IND_diff": KW_IND_diff.eval_diff_max_abs(None, Ci_pt, kw_table1=profile["kw_table"]),
+    }
+
+def screen_Ci_df(Bi_df:pd.DataFrame | ParsedTable | None, Ci_df:pd.DataFrame | ParsedTable,
+                 target_utility:float, sample_rows:int=2000, n_boot:int=20, alpha:float=0.05,
+                 seed:int=0, print_details:bool=False, bi_profile:dict | None=None,
+                 verbose:bool=False, lr_solver:str="statsmodels")->dict:
+    """
+    Ci の行の部分標本で採点を推定し、ブートストラップ信頼区間で足切りする。
+
+    1. Ci から sample_rows 行を非復元抽出し、stats_diff・KW_IND_diff の max_abs を推定
+    2. 標本の max_abs は行数が少ないほど大きく出るため、推定値から標本の前半（sample_rows/2 行）との差
+       |T(m) - T(m/2)| を引く（0 未満は 0）。これと LR_asthma_diff を満点とみなした utility の上限が
+       target_utility を超えるなら、区間を求めても足切りできないので、ブートストラップを省いて全行で採点する
+    3. それ以外は標本から復元抽出した n_boot 個の標本でも採点し、basic bootstrap の (1-alpha) 信頼区間を求め、
+       区間の下端から 2. の差を引いた値で utility の上限を求める
+    4. その上限が target_utility 以下なら全行での採点を省略する。それ以外は全行で採点し直す
+       （score_Ci_df の閾値モードを使う）。
 
-    # 基本統計の誤差を算出
-    stats_diff_max_abs = stats_diff.eval(path_to_Bi_csv, path_to_Ci_csv, 
-                                         print_details=print_details)
-    print(f"stats_diff max_abs: {stats_diff_max_abs}")
+    LR_asthma_diff は数千行の標本では全行の値より大幅に悪く、行数に対して単調でもないため標本では採点しない。
+    このため足切りされるのは stats_diff・KW_IND_diff だけで target_utility を超えられない Ci に限られる。
+    全行の stats_diff・KW_IND_diff が軽い（行数が sample_rows の数倍程度の）場合は、
+    score_Ci_df の閾値モードの方が安く同じ Ci を足切りできる。
 
-    # Logistic Regressionでの誤差を算出
-    LR_asthma_diff_max_abs = LR_asthma_diff.eval(path_to_Bi_csv, path_to_Ci_csv, 
-                                                 print_details=print_details)
-    print(f"LR_asthma_diff max_abs: {LR_asthma_diff_max_abs}")
+    Returns:
+    score_Ci_df と同じ dict に "screening"（標本サイズ、推定値、信頼区間、判定に使った上限、
+    全行で採点したか）を加えたもの。
+    全行での採点を省略した場合、各 max_abs と Ci_utility は None、utility_upper_bound は判定に使った上限。
+    """
+    t0 = time.perf_counter()
+    if bi_profile is None:
+        # Bi 側は1回だけ計算し、標本ごとの採点で使い回す
+        bi_profile = bi_profile_mod.build_bi_profile(Bi_df, bi_sha256="",
+                                                     lr_params=bi_profile_mod.lr_params_for(lr_solver))
+    Ci_pt = Ci_df if isinstance(Ci_df, ParsedTable) else ParsedTable(Ci_df)
+
+    n = Ci_pt.n_rows
+    screening = {"sample_rows": min(sample_rows, n), "n_boot": n_boot, "alpha": alpha,
+                 "estimate": None, "ci": None, "bound": None, "escalated": True}
+
+    if n > sample_rows:
+        rng = np.random.default_rng(seed)
+        idx = rng.choice(n, size=sample_rows, replace=False)
+        sample = Ci_pt.take(np.sort(idx))
+        est = _score_sample(sample, bi_profile)
+        half = _score_sample(Ci_pt.take(np.sort(idx[:sample_rows // 2])), bi_profile)
+        gap = {name: abs(est[name] - half[name]) for name in SCREEN_STAGES}
+        screening["estimate"] = est
+        screening["bound"] = utility_upper_bound({name: max(est[name] - gap[name], 0.0) for name in SCREEN_STAGES})
+        if screening["bound"] > target_utility:
+            # 推定値でも target を超えうる Ci は区間を求めても足切りできない
+            if verbose:
+                print(f"screening: {sample_rows}/{n} 行, Ci utility <= {screening['bound']} / 80 (推定。区間は省略)")
+        else:
+            boots = [_score_sample(sample.take(rng.integers(0, sample_rows, size=sample_rows)), bi_profile)
+                     for _ in range(n_boot)]
+            if len(boots) >= 2:
+                ci = {}
+                lower = {}
+                for name in SCREEN_STAGES:
+                    b = np.array([r[name] for r in boots], dtype=float)
+                    q_lo, q_hi = np.quantile(b, [alpha / 2, 1 - alpha / 2])
+                    ci[name] = (2 * est[name] - q_hi, 2 * est[name] - q_lo)
+                    lower[name] = max(ci[name][0] - gap[name], 0.0)
+                bound = utility_upper_bound(lower)
+                screening["ci"] = ci
+                screening["bound"] = bound
+                screening["escalated"] = bool(bound > target_utility)
+                if verbose:
+                    print(f"screening: {sample_rows}/{n} 行, bootstrap {len(boots)} 回, {int(round((1 - alpha) * 100))}% 区間")
+                    for name in SCREEN_STAGES:
+                        print(f"  {name} max_abs ≈ {est[name]} [{ci[name][0]}, {ci[name][1]}]")
+                    print(f"  Ci utility <= {bound} / 80 (推定)")
+
+    t1 = time.perf_counter()
+    if screening["escalated"]:
+        if verbose and screening["ci"] is not None:
+            print(f"target {target_utility} を超える可能性があるため全行で採点します")
+        result = score_Ci_df(None, Ci_pt, print_details=print_details, bi_profile=bi_profile,
+                             verbose=verbose, target_utility=target_utility,
+                             lr_solver=lr_solver)
+    else:
+        if verbose:
+            print(f"Ci utility の上限が target {target_utility} 以下のため全行での採点を省略します")
+        result = {"stats_diff_max_abs": None, "LR_asthma_diff_max_abs": None,
+                  "KW_IND_diff_max_abs": None, "Ci_utility": None,
+                  "utility_upper_bound": screening["bound"],
+                  "skipped_stages": list(UTILITY_WEIGHTS), "timings": {}}
+    result["timings"]["screening"] = t1 - t0
+    result["screening"] = screening
+    return result
+
+def eval_Ci_df_utility(Bi_df:pd.DataFrame | ParsedTable | None, Ci_df:pd.DataFrame | ParsedTable,
+                       print_details:bool=False, bi_profile:dict | None=None,
+                       target_utility:float | None=None, screen_rows:int | None=None,
+                       n_boot:int=20, lr_solver:str="statsmodels")->float | None:
+    """
+    bi_profile（bi_profile.py で作成）を渡すと Bi 側の計算を省略する。この場合 Bi_df は None でよい。
+    target_utility を指定した場合、それを超えられないと分かった時点で打ち切り None を返す。
+    さらに screen_rows を指定すると、先に screen_rows 行の部分標本で足切りする（screen_Ci_df）。
+    lr_solver は score_Ci_df を参照。
+    """
+    if target_utility is not None and screen_rows:
+        result = screen_Ci_df(Bi_df, Ci_df, target_utility, sample_rows=screen_rows, n_boot=n_boot,
+                              print_details=print_details, bi_profile=bi_profile, verbose=True,
+                              lr_solver=lr_solver)
+    else:
+        result = score_Ci_df(Bi_df, Ci_df, print_details=print_details,
+                             bi_profile=bi_profile, verbose=True, target_utility=target_utility,
+                             lr_solver=lr_solver)
+    return result["Ci_utility"]
     
-    # KW_IND_diff
-    KW_IND_diff_max_abs = KW_IND_diff.eval(path_to_Bi_csv, path_to_Ci_csv, 
-                                           print_details=print_details)
-    print(f"KW_IND_diff max_abs: {KW_IND_diff_max_abs}")
+def eval_Ci_utility(path_to_Bi_csv:str, path_to_Ci_csv:str, 
+                    print_details:bool=False, bi_profile:dict | None=None,
+                    target_utility:float | None=None, screen_rows:int | None=None,
+                    n_boot:int=20, lr_solver:str="statsmodels")->float | None:
 
-    # 重み付きutility
-    Ci_utility = 40 * (1-stats_diff_max_abs) + 20 * (1-LR_asthma_diff_max_abs) + 20 * (1-KW_IND_diff_max_abs)
-    print(f"Ci utility: {Ci_utility} / 80")
+    # フォーマットチェックなしで文字列として読み込み、解析結果を3つの採点で共有
+    Bi_df = stats_diff.read_csv_all_str(path_to_Bi_csv) if bi_profile is None else None
+    Ci_df = stats_diff.read_csv_all_str(path_to_Ci_csv)
 
-    return Ci_utility
+    return eval_Ci_df_utility(Bi_df, Ci_df, print_details=print_details, bi_profile=bi_profile,
+                              target_utility=target_utility, screen_rows=screen_rows, n_boot=n_boot,
+                              lr_solver=lr_solver)
 
 def eval_Di_utility()->float:
     pass
@@ -71,6 +268,11 @@ if __name__ == "__main__":
     ap.add_argument("Ci_csv", help="path to Ci.csv")
     ap.add_argument("-f", "--force", action="store_true", help="[optional]Ciにフォーマット違反があっても強制的に採点を試す")
     ap.add_argument("-d", "--print-details", action="store_true", help="[optional] despley the details", default=False)
+    ap.add_argument("--bi-profile", default=None, help="[optional] Biプロファイル(bi_profile.py)のパス。無ければ作成して保存し、以降はBi側の計算を省略")
+    ap.add_argument("--target-utility", type=float, default=None, help="[optional] このutilityを超えられないと分かった時点で採点を打ち切る（軽い採点から順に実行）")
+    ap.add_argument("--lr-solver", choices=["statsmodels", "irls"], default="statsmodels", help="[optional] LR_asthma_diff のロジスティック回帰の解法（既定: statsmodels）")
+    ap.add_argument("--screen-rows", type=int, default=None, help="[optional] --target-utility と併用。先にこの行数の部分標本で採点し、ブートストラップ区間が target を下回れば全行での採点を省略")
+    ap.add_argument("--n-boot", type=int, default=20, help="[optional] --screen-rows のブートストラップ回数（既定: 20）")
     args = ap.parse_args()
 
     if not os.path.isfile(args.Bi_csv):
@@ -85,8 +287,15 @@ if __name__ == "__main__":
     if not is_csv_file(args.Ci_csv):
         raise TypeError(f"{args.Ci_csv}はCSVファイルではありません")
 
+    bi_profile = None
     try:
-        Bi_df = BiDataFrame.read_csv(args.Bi_csv)
+        if args.bi_profile:
+            # Bi.csvの内容ハッシュが一致するプロファイルはフォーマット確認済みのBiから作られている
+            bi_profile = bi_profile_mod.load_or_build_bi_profile(
+                args.bi_profile, args.Bi_csv, lr_params=bi_profile_mod.lr_params_for(args.lr_solver))
+            Bi_df = None
+        else:
+            Bi_df = BiDataFrame.read_csv(args.Bi_csv)
     except ExceptionGroup as eg:
         print(f"採点できません。Biが異常です。")
         raise eg # エラーを吐いて強制終了
@@ -94,7 +303,9 @@ if __name__ == "__main__":
     try:
         # Ci_csvをCiと解釈できるか試す。軽微なフォーマット違反は修正する
         Ci_df = CiDataFrame.read_csv(args.Ci_csv)
-        eval_Ci_df_utility(Bi_df, Ci_df, print_details=args.print_details)
+        eval_Ci_df_utility(Bi_df, Ci_df, print_details=args.print_details, bi_profile=bi_profile,
+                           target_utility=args.target_utility, screen_rows=args.screen_rows,
+                           n_boot=args.n_boot, lr_solver=args.lr_solver)
     except* FormatError as e: # 修正不能なフォーマット違反があった場合
         print(f"Ciのフォーマットに異常があります:")
         # raiseしてしまうと次のif文が実行されない
@@ -103,7 +314,9 @@ if __name__ == "__main__":
         
         if args.force:
             print("採点を強行します")
-            eval_Ci_utility(args.Bi_csv, args.Ci_csv, print_details=args.print_details)
+            eval_Ci_utility(args.Bi_csv, args.Ci_csv, print_details=args.print_details, bi_profile=bi_profile,
+                            target_utility=args.target_utility, screen_rows=args.screen_rows,
+                            n_boot=args.n_boot, lr_solver=args.lr_solver)
             # ここでエラーが起きてもどうしようもないのでこれ以上は何もしない
     except* Exception as e: # おそらく発生しない処理
         print(f"{args.Ci_csv}を読み込めませんでした:")
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+eval_batch.py
+- eval_all.py のバッチ版。(Bi, Ci) の組を列挙したマニフェスト（CSV / JSONL）を読み込み、
+  まとめて採点する。
+- 同じ Bi は1回だけ読み込み、Bi 側の採点用テーブル（Bi プロファイル）を作ってから、
+  Ci をプロセスプールに分配して採点する。
+- 1組ごとに1行の JSON（JSONL）を、採点が終わった順に出力する。
+    {"index", "Bi", "Ci", "status", "stats_diff_max_abs", "LR_asthma_diff_max_abs",
+     "KW_IND_diff_max_abs", "Ci_utility", "utility_upper_bound", "skipped_stages", "timings", "error"}
+- --target-utility を指定すると eval_all.py と同じ閾値モードで採点し、超えられないと分かった Ci は
+  残りの採点を省略する（Ci_utility は null、utility_upper_bound に上限が入る）。
+
+マニフェスト:
+- CSV  : ヘッダーに Bi, Ci 列（任意で id 列）を持つ
+- JSONL: 1行に {"Bi": ..., "Ci": ...}（任意で "id"）
+- 相対パスはマニフェストのあるディレクトリからのパスとして解釈する
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import eval_all
+import bi_profile as bi_profile_mod
+from eval_all import BiDataFrame, CiDataFrame, FormatError
+
+
+# ==== マニフェスト ====
+
+def read_manifest(path: str) -> list[dict]:
+    base = os.path.dirname(os.path.abspath(path))
+
+    if path.lower().endswith((".jsonl", ".json")):
+        entries = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    entries.append(json.loads(line))
+    else:
+        entries = pd.read_csv(path, dtype=str, keep_default_na=False).to_dict(orient="records")
+
+    out = []
+    for i, e in enumerate(entries):
+        if "Bi" not in e or "Ci" not in e:
+            raise ValueError(f"マニフェスト{i+1}行目に Bi / Ci がありません: {e}")
+        out.append({
+            "index": i,
+            "id": e.get("id", ""),
+            "Bi": os.path.normpath(os.path.join(base, e["Bi"])),
+            "Ci": os.path.normpath(os.path.join(base, e["Ci"])),
+        })
+    return out
+
+
+# ==== Bi 側 ====
+
+def prepare_bi_profiles(bi_paths: list[str], profile_dir: str | None = None,
+                        lr_solver: str = "statsmodels") -> tuple[dict, dict]:
+    """
+    Bi ごとにフォーマットを確認してプロファイルを作る（LR 表は Ci と同じ lr_solver で学習する）。
+    profile_dir を指定した場合はディスク上のプロファイルを再利用・保存する。
+    戻り値は (Bi パス→プロファイル, Bi パス→エラーメッセージ)。
+    """
+    lr_params = bi_profile_mod.lr_params_for(lr_solver)
+    profiles, errors = {}, {}
+    for path in bi_paths:
+        try:
+            if profile_dir:
+                name = os.path.splitext(os.path.basename(path))[0] + "_profile.pkl"
+                profiles[path] = bi_profile_mod.load_or_build_bi_profile(
+                    os.path.join(profile_dir, name), path, lr_params)
+            else:
+                Bi_df = BiDataFrame.read_csv(path)
+                profiles[path] = bi_profile_mod.build_bi_profile(
+                    Bi_df, bi_profile_mod.file_sha256(path), lr_params)
+        except ExceptionGroup as eg:
+            errors[path] = "Biが異常です: " + "; ".join(str(e) for e in eg.exceptions)
+        except Exception as e:
+            errors[path] = f"Biを読み込めませんでした: {e}"
+    return profiles, errors
+
+
+# ==== Ci 側（ワーカー） ====
+
+_PROFILES: dict = {}
+
+def _init_worker(profiles: dict):
+    global _PROFILES
+    _PROFILES = profiles
+
+def score_entry(entry: dict, force: bool = False, target_utility: float | None = None,
+                lr_solver: str = "statsmodels") -> dict:
+    """マニフェストの1組を採点して JSONL 用の dict を返す"""
+    record = {
+        "index": entry["index"], "id": entry["id"], "Bi": entry["Bi"], "Ci": entry["Ci"],
+        "status": "ok",
+        "stats_diff_max_abs": None, "LR_asthma_diff_max_abs": None,
+        "KW_IND_diff_max_abs": None, "Ci_utility": None,
+        "utility_upper_bound": None, "skipped_stages": [],
+        "timings": {}, "error": "",
+    }
+    t0 = time.perf_counter()
+    # 各モジュールの標準出力（フォーマット修正のメッセージ等）は JSONL に混ぜない
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            try:
+                Ci_df = CiDataFrame.read_csv(entry["Ci"])
+            except* FormatError as eg:
+                msg = "; ".join(str(e) for e in eg.exceptions)
+                if not force:
+                    raise ValueError(f"Ciのフォーマットに異常があります: {msg}")
+                record["error"] = f"フォーマット違反を無視して採点: {msg}"
+                Ci_df = pd.read_csv(entry["Ci"], dtype=str, keep_default_na=False)
+            t1 = time.perf_counter()
+            result = eval_all.score_Ci_df(None, Ci_df, bi_profile=_PROFILES[entry["Bi"]],
+                                          target_utility=target_utility,
+                                          lr_solver=lr_solver)
+        except Exception as e:
+            record["status"] = "error"
+            record["error"] = str(e.exceptions[0]) if isinstance(e, ExceptionGroup) else str(e)
+            record["timings"] = {"total": time.perf_counter() - t0}
+            return record
+
+    record.update({k: result[k] for k in
+                   ["stats_diff_max_abs", "LR_asthma_diff_max_abs", "KW_IND_diff_max_abs", "Ci_utility",
+                    "utility_upper_bound", "skipped_stages"]})
+    record["timings"] = {"read": t1 - t0, **result["timings"], "total": time.perf_counter() - t0}
+    return record
+
+
+def _score_entry_in_worker(entry: dict, force: bool, target_utility: float | None,
+                           lr_solver: str) -> dict:
+    return score_entry(entry, force, target_utility, lr_solver)
+
+
+# ==== バッチ実行 ====
+
+def run_batch(entries: list[dict], out, jobs: int = 1, force: bool = False,
+              profile_dir: str | None = None, target_utility: float | None = None,
+              lr_solver: str = "statsmodels") -> list[dict]:
+    """
+    マニフェストの全組を採点し、終わった順に out へ JSONL で書き出す。
+    全レコードを index 順に並べて返す。
+    """
+    bi_paths = list(dict.fromkeys(e["Bi"] for e in entries))
+    profiles, bi_errors = prepare_bi_profiles(bi_paths, profile_dir, lr_solver)
+
+    records = []
+
+    def emit(rec):
+        out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        out.flush()
+        records.append(rec)
+
+    todo = []
+    for e in entries:
+        if e["Bi"] in bi_errors:
+            emit({"index": e["index"], "id": e["id"], "Bi": e["Bi"], "Ci": e["Ci"],
+                  "status": "error", "stats_diff_max_abs": None, "LR_asthma_diff_max_abs": None,
+                  "KW_IND_diff_max_abs": None, "Ci_utility": None,
+                  "utility_upper_bound": None, "skipped_stages": [], "timings": {},
+                  "error": bi_errors[e["Bi"]]})
+        else:
+            todo.append(e)
+
+    if jobs <= 1:
+        _init_worker(profiles)
+        for e in todo:
+            emit(score_entry(e, force, target_utility, lr_solver))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                 initargs=(profiles,)) as ex:
+            futures = [ex.submit(_score_entry_in_worker, e, force, target_utility, lr_solver)
+                       for e in todo]
+            for fut in as_completed(futures):
+                emit(fut.result())
+
+    return sorted(records, key=lambda r: r["index"])
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="マニフェスト（CSV/JSONL）に列挙した (Bi, Ci) をまとめて採点し、JSONL で出力")
+    ap.add_argument("manifest", help="Bi, Ci 列を持つ CSV、または {\"Bi\":..., \"Ci\":...} の JSONL")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                    help="採点に使うプロセス数（既定: CPU数）")
+    ap.add_argument("-o", "--out", default=None, help="JSONL の出力先（既定: 標準出力）")
+    ap.add_argument("-f", "--force", action="store_true", help="[optional]Ciにフォーマット違反があっても強制的に採点を試す")
+    ap.add_argument("--bi-profile-dir", default=None,
+                    help="[optional] Biプロファイルを保存・再利用するディレクトリ")
+    ap.add_argument("--target-utility", type=float, default=None,
+                    help="[optional] このutilityを超えられないと分かったCiは残りの採点を省略する")
+    ap.add_argument("--lr-solver", choices=["statsmodels", "irls"], default="statsmodels",
+                    help="[optional] LR_asthma_diff のロジスティック回帰の解法（既定: statsmodels）")
+    args = ap.parse_args()
+
+    entries = read_manifest(args.manifest)
+
+    t0 = time.perf_counter()
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fp:
+            records = run_batch(entries, fp, args.jobs, args.force, args.bi_profile_dir, args.target_utility,
+                                args.lr_solver)
+    else:
+        records = run_batch(entries, sys.stdout, args.jobs, args.force, args.bi_profile_dir, args.target_utility,
+                            args.lr_solver)
+
+    n_ok = sum(r["status"] == "ok" for r in records)
+    print(f"{n_ok}/{len(records)} 組を採点しました（{time.perf_counter() - t0:.1f} 秒）", file=sys.stderr)
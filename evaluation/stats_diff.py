@@ -21,15 +21,26 @@ stats_diff.py
 - 数値統計の 0-1 化: 同一ファイル内で「列×統計量」ベクトルごとに min-max 正規化。
 - カテゴリ列は各カテゴリ値の「比率（0〜1）」。
 - 相関は Pearson。数値列が2未満の場合はスキップ。
+- 全 term は data/columns_range.json から作る TermRegistry の固定スロットに並べ、
+  差分と最大絶対値はベクトル演算で求める（長形式の表は表示・保存する場合だけ作る）。
 """
 
 import argparse
+import json
 import sys
+import os
+import warnings
 from typing import List, Tuple, Dict
 
 import numpy as np
 import pandas as pd
 
+# モジュールの相対参照制限を強制的に回避
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..', 'analysis'))
+from parsed_table import ParsedTable, as_parsed
+from pairwise_corr import PairwiseCorrAccumulator
+
 
 # ---------- I/O ----------
 
@@ -39,22 +50,79 @@ def read_csv_all_str(path: str) -> pd.DataFrame:
 
 # ---------- 型推定 ----------
 
-def detect_numeric_columns(df: pd.DataFrame, thresh: float = 0.95) -> List[str]:
-    num_cols = []
-    for c in df.columns:
-        s = df[c].astype(str).str.strip()
-        nonblank = s != ""
-        if nonblank.sum() == 0:
-            continue
-        conv = pd.to_numeric(s[nonblank], errors="coerce")
-        if conv.notna().mean() >= thresh:
-            num_cols.append(c)
-    return num_cols
+def is_numeric_column(pt: ParsedTable, c: str, thresh: float = 0.95) -> bool:
+    nonblank = ~pt.blank[c]
+    if nonblank.sum() == 0:
+        return False
+    conv = pt.numeric[c][nonblank]
+    return bool((~np.isnan(conv)).mean() >= thresh)
+
+def detect_numeric_columns(df: pd.DataFrame | ParsedTable, thresh: float = 0.95) -> List[str]:
+    pt = as_parsed(df)
+    return [c for c in pt.columns if is_numeric_column(pt, c, thresh)]
 
 
 # ---------- 数値統計（0-1化） ----------
 
-def numeric_stats_norm01(df: pd.DataFrame, num_cols: List[str]) -> pd.DataFrame:
+# 数値統計の並び（numeric_stats_matrix の行の順序）
+NUM_STATS = ["mean", "std", "q25", "q50", "q75"]
+
+def numeric_matrix(df: pd.DataFrame | ParsedTable, num_cols: List[str]) -> np.ndarray:
+    """
+    数値列を n×p の float64 行列（列優先, 空文字・数値化不可は NaN）にまとめる。
+    列優先にしておくと列ごとの集計が pandas の Series と同じ順序で加算される。
+    """
+    pt = as_parsed(df)
+    X = np.empty((pt.n_rows, len(num_cols)), dtype="float64", order="F")
+    for j, c in enumerate(num_cols):
+        X[:, j] = pt.numeric[c]
+    return X
+
+def numeric_stats_matrix(X: np.ndarray) -> np.ndarray:
+    """
+    n×p 行列の各列について mean/std/q25/q50/q75 を一括で算出し、5×p 行列で返す（NaN は除外）。
+    値は pandas の Series.mean / std / quantile(linear) と一致する。
+    """
+    p = X.shape[1]
+    out = np.full((len(NUM_STATS), p), np.nan)
+    if p == 0:
+        return out
+
+    mask = ~np.isnan(X)
+    cnt = mask.sum(axis=0)
+    filled = np.where(mask, X, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = filled.sum(axis=0) / cnt
+        sqr = np.where(mask, (mean - X) ** 2, 0.0)
+        var = sqr.sum(axis=0) / (cnt - 1)
+    out[0] = np.where(cnt > 0, mean, np.nan)
+    out[1] = np.where(cnt > 1, np.sqrt(np.where(cnt > 1, var, 0.0)), np.nan)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        out[2:5] = np.nanquantile(X, [0.25, 0.50, 0.75], axis=0, method="linear")
+    return out
+
+def minmax_norm_rows(S: np.ndarray) -> np.ndarray:
+    """
+    統計量ごと（行ごと）に列方向の min-max 正規化を行い 0-1 にする。
+    幅が 0 の行は有限値を 0 に、正規化できない値（NaN）は 0 にする。
+    """
+    out = np.full(S.shape, np.nan)
+    for k in range(S.shape[0]):
+        vals = S[k]
+        if not np.isnan(vals).all():
+            vmin = np.nanmin(vals)
+            vmax = np.nanmax(vals)
+            rng = vmax - vmin
+            with np.errstate(invalid="ignore"):
+                if rng == 0:
+                    out[k] = np.where(np.isfinite(vals), 0.0, np.nan)
+                else:
+                    out[k] = (vals - vmin) / rng
+    return np.nan_to_num(out, nan=0.0, posinf=np.inf, neginf=-np.inf)
+
+def numeric_stats_norm01(df: pd.DataFrame | ParsedTable, num_cols: List[str]) -> pd.DataFrame:
     """
     各数値列の mean/std/q25/median/q75 を算出し、
     統計量ごと（mean群, std群, …）に min-max 正規化して 0-1 にする。
@@ -63,60 +131,32 @@ def numeric_stats_norm01(df: pd.DataFrame, num_cols: List[str]) -> pd.DataFrame:
     if not num_cols:
         return pd.DataFrame(columns=["term", "value"])
 
-    # 数値化（空文字→NaN）
-    dfn = df.copy()
-    for c in num_cols:
-        dfn[c] = pd.to_numeric(dfn[c].replace({"": np.nan}), errors="coerce")
-
-    stats = {}
-    # 各統計量を dict[col] に
-    stats["mean"] = {c: float(dfn[c].mean(skipna=True)) for c in num_cols}
-    stats["std"]  = {c: float(dfn[c].std(skipna=True)) for c in num_cols}
-    stats["q25"]  = {c: float(dfn[c].quantile(0.25, interpolation="linear")) for c in num_cols}
-    stats["q50"]  = {c: float(dfn[c].quantile(0.50, interpolation="linear")) for c in num_cols}
-    stats["q75"]  = {c: float(dfn[c].quantile(0.75, interpolation="linear")) for c in num_cols}
+    # 数値化（空文字→NaN）は解析済みの配列を使う
+    X = numeric_matrix(df, num_cols)
+    norm = minmax_norm_rows(numeric_stats_matrix(X))
 
-    rows = []
-    # 統計量ごとに min-max 正規化
-    for stat_name, mapping in stats.items():
-        vals = pd.Series(mapping, dtype=float)
-        # min-max（全NaNへの対処）
-        if vals.notna().any():
-            vmin = float(vals.min())
-            vmax = float(vals.max())
-            rng = vmax - vmin
-            if rng == 0:
-                norm = vals.apply(lambda x: 0.0 if np.isfinite(x) else np.nan)
-            else:
-                norm = (vals - vmin) / rng
-        else:
-            norm = pd.Series({k: np.nan for k in mapping.keys()}, dtype=float)
-
-        for col, v in norm.items():
-            term = f"NUM:{stat_name}:{col}"
-            rows.append((term, 0.0 if pd.isna(v) else float(v)))
-
-    out = pd.DataFrame(rows, columns=["term", "value"])
+    terms = [f"NUM:{stat_name}:{col}" for stat_name in NUM_STATS for col in num_cols]
+    out = pd.DataFrame({"term": terms, "value": norm.ravel()})
     out = out.sort_values("term", kind="mergesort").reset_index(drop=True)
     return out
 
 
 # ---------- カテゴリ統計（比率0-1） ----------
 
-def categorical_ratios(df: pd.DataFrame, cat_cols: List[str]) -> pd.DataFrame:
+def categorical_ratios(df: pd.DataFrame | ParsedTable, cat_cols: List[str]) -> pd.DataFrame:
     """
     各カテゴリ列について、各値の比率（0-1）を計算。
     戻りは長形式: term='CAT:<col>=<val>', value=ratio
     """
     rows = []
-    n = len(df)
+    pt = as_parsed(df)
+    n = pt.n_rows
     if n == 0 or not cat_cols:
         return pd.DataFrame(columns=["term", "value"])
 
     for c in cat_cols:
-        s = df[c].astype(str).str.strip()
-        counts = s.value_counts(dropna=False)
-        for val, cnt in counts.items():
+        levels, counts = pt.value_counts(c)
+        for val, cnt in zip(levels, counts):
             ratio = float(cnt) / float(n)
             term = f"CAT:{c}={val}"
             rows.append((term, ratio))
@@ -128,7 +168,28 @@ def categorical_ratios(df: pd.DataFrame, cat_cols: List[str]) -> pd.DataFrame:
 
 # ---------- 相関（-1〜1） ----------
 
-def pearson_corr_pairs(df: pd.DataFrame, num_cols: List[str]) -> pd.DataFrame:
+def nan_corr_matrix(X: np.ndarray) -> np.ndarray:
+    """
+    n×p 行列の Pearson 相関行列（p×p）を、列ペアごとに両方が有限の行だけで計算する
+    （DataFrame.corr(min_periods=1) と同じ pairwise-complete）。
+    欠損マスク付きの行列積で全ペアを一括計算する（analysis/pairwise_corr.py）。計算できないペアは NaN。
+    """
+    return PairwiseCorrAccumulator.from_chunk(X).corr()
+
+def corr_with_column(X: np.ndarray, j: int) -> np.ndarray:
+    """
+    列 j と全列（j 自身を含む）の pairwise-complete Pearson 相関（長さ p）。
+    nan_corr_matrix の j 列目と同じ式で、1列分の計算だけ行う。
+    """
+    return PairwiseCorrAccumulator.from_chunk(X, X[:, [j]]).corr()[:, 0]
+
+def corr_upper(X: np.ndarray) -> np.ndarray:
+    """相関行列の上三角（i < j, 行優先）を固定位置の1次元配列で返す（NaN は 0）"""
+    p = X.shape[1]
+    iu = np.triu_indices(p, k=1)
+    return np.nan_to_num(nan_corr_matrix(X)[iu], nan=0.0)
+
+def pearson_corr_pairs(df: pd.DataFrame | ParsedTable, num_cols: List[str]) -> pd.DataFrame:
     """
     数値列間の Pearson 相関（上三角）を長形式で返す。
     term='CORR:<c1>|<c2>', value=r (-1..1)
@@ -136,74 +197,205 @@ def pearson_corr_pairs(df: pd.DataFrame, num_cols: List[str]) -> pd.DataFrame:
     if len(num_cols) < 2:
         return pd.DataFrame(columns=["term", "value"])
 
-    dfn = df[num_cols].apply(pd.to_numeric, errors="coerce")
-    corr = dfn.corr(method="pearson", min_periods=1)
-    rows = []
-    cols = list(corr.columns)
-    for i in range(len(cols)):
-        for j in range(i + 1, len(cols)):
-            c1, c2 = cols[i], cols[j]
-            r = corr.loc[c1, c2]
-            v = 0.0 if pd.isna(r) else float(r)
-            term = f"CORR:{c1}|{c2}"
-            rows.append((term, v))
-    out = pd.DataFrame(rows, columns=["term", "value"])
+    vals = corr_upper(numeric_matrix(df, num_cols))
+    iu = np.triu_indices(len(num_cols), k=1)
+    terms = [f"CORR:{num_cols[i]}|{num_cols[j]}" for i, j in zip(*iu)]
+    out = pd.DataFrame({"term": terms, "value": vals})
     out = out.sort_values("term", kind="mergesort").reset_index(drop=True)
     return out
 
 
-# ---------- 1ファイル分の長形式テーブル作成 ----------
+# ---------- term レジストリ（固定スロット） ----------
 
-def build_long_table_for_csv(df: pd.DataFrame) -> pd.DataFrame:
-    # df = read_csv_all_str(csv_path)
-    num_cols = detect_numeric_columns(df, thresh=0.95)
-    cat_cols = [c for c in df.columns if c not in num_cols]
-
-    t_num = numeric_stats_norm01(df, num_cols)
-    t_cat = categorical_ratios(df, cat_cols)
-    t_cor = pearson_corr_pairs(df, num_cols)
-
-    # 同じ「stats.py ライク」な長形式 term/value
-    all_terms = pd.concat([t_num, t_cat, t_cor], axis=0, ignore_index=True)
-    # NaN→0
-    all_terms["value"] = all_terms["value"].fillna(0.0).astype(float)
-    # term 重複が万一あれば平均で集約（通常は発生しない想定）
-    all_terms = all_terms.groupby("term", as_index=False)["value"].mean()
-    all_terms = all_terms.sort_values("term", kind="mergesort").reset_index(drop=True)
-    
-    return all_terms
+COLUMNS_RANGE_JSON = os.path.join(current_dir, '..', 'data', 'columns_range.json')
 
-# ---------- 差分と出力 ----------
-def eval_diff(df1: pd.DataFrame, df2: pd.DataFrame,
-                 out=None, print_details=False) -> pd.DataFrame:
+class TermRegistry:
+    """
+    全 term（NUM / CAT / CORR）に固定の整数スロットを割り当てる。
+    columns_range.json の列仕様から作り、仕様に無い term（未知のカテゴリ値や想定外の列）は
+    初めて現れた時に末尾の予備スロットを割り当てる。
+    同じレジストリで作ったベクトル同士は、差分と max_abs をベクトル演算だけで計算できる。
     """
-    データフレームを2つ受け取って、それらの基本統計の差を返す
-
-    Paramters:
-    path_to_csv1 (str): データフレームその1
-    path_to_csv2 (str): CSVファイルその2
-    out (str): 基本統計の差を保存したい場所を指定。テーブル同士の差が書き込まれる
-    print_details (bool): 詳細の結果を表示するかどうか
 
-    Returns:
-    基本統計の差 (pd.DataFrame)
+    def __init__(self, num_cols: List[str], cat_levels: Dict[str, List[str]]):
+        self.terms: List[str] = []
+        self.index: Dict[str, int] = {}
+        for stat_name in NUM_STATS:
+            for c in num_cols:
+                self._add(f"NUM:{stat_name}:{c}")
+        for c, levels in cat_levels.items():
+            for v in levels:
+                self._add(f"CAT:{c}={v}")
+        for i in range(len(num_cols)):
+            for j in range(i + 1, len(num_cols)):
+                self._add(f"CORR:{num_cols[i]}|{num_cols[j]}")
+        self.n_fixed = len(self.terms)
+        self._num_cache: Dict[Tuple[str, ...], np.ndarray] = {}
+        self._corr_cache: Dict[Tuple[str, ...], np.ndarray] = {}
+
+    @classmethod
+    def from_columns_range(cls, path: str = COLUMNS_RANGE_JSON) -> "TermRegistry":
+        with open(path, encoding="utf-8") as f:
+            specs = json.load(f)["columns"]
+        num_cols = [c for c, sp in specs.items() if sp.get("type") == "number"]
+        cat_levels = {c: [str(v) for v in sp.get("values", [])]
+                      for c, sp in specs.items() if sp.get("type") == "category"}
+        return cls(num_cols, cat_levels)
+
+    def _add(self, term: str) -> int:
+        k = self.index.get(term)
+        if k is None:
+            k = len(self.terms)
+            self.terms.append(term)
+            self.index[term] = k
+        return k
+
+    @property
+    def size(self) -> int:
+        return len(self.terms)
+
+    def slot(self, term: str) -> int:
+        """term のスロット。未登録なら予備スロットを割り当てる"""
+        return self._add(term)
+
+    def num_slots(self, num_cols: List[str]) -> np.ndarray:
+        """数値列の並びに対する NUM term のスロット（5×p、NUM_STATS 順）"""
+        key = tuple(num_cols)
+        if key not in self._num_cache:
+            self._num_cache[key] = np.array(
+                [[self.slot(f"NUM:{stat_name}:{c}") for c in num_cols] for stat_name in NUM_STATS],
+                dtype=np.intp).reshape(len(NUM_STATS), len(num_cols))
+        return self._num_cache[key]
+
+    def corr_slots(self, num_cols: List[str]) -> np.ndarray:
+        """数値列の並びに対する CORR term（上三角, 行優先）のスロット"""
+        key = tuple(num_cols)
+        if key not in self._corr_cache:
+            iu = np.triu_indices(len(num_cols), k=1)
+            self._corr_cache[key] = np.array(
+                [self.slot(f"CORR:{num_cols[i]}|{num_cols[j]}") for i, j in zip(*iu)],
+                dtype=np.intp)
+        return self._corr_cache[key]
+
+_DEFAULT_REGISTRY: TermRegistry | None = None
+
+def get_term_registry() -> TermRegistry:
+    """columns_range.json から作った既定のレジストリ（初回のみ作成）"""
+    global _DEFAULT_REGISTRY
+    if _DEFAULT_REGISTRY is None:
+        _DEFAULT_REGISTRY = TermRegistry.from_columns_range()
+    return _DEFAULT_REGISTRY
+
+
+class TermVector:
+    """
+    1データ分の全 term の値をレジストリのスロット順に並べたベクトル。
+    present はそのデータに実際に現れた term のマスク（長形式テーブルを作る時だけ使う）。
     """
-    tbl1 = build_long_table_for_csv(df1)
-    tbl2 = build_long_table_for_csv(df2)
 
-    # term全体の和集合を作り、無い方は0で埋めて差分（csv2 - csv1）
-    terms_all = sorted(set(tbl1["term"]).union(set(tbl2["term"])))
-    d1 = tbl1.set_index("term")["value"].reindex(terms_all).fillna(0.0)
-    d2 = tbl2.set_index("term")["value"].reindex(terms_all).fillna(0.0)
-    diff = (d2 - d1).astype(float)
+    def __init__(self, registry: TermRegistry, values: np.ndarray, present: np.ndarray):
+        self.registry = registry
+        self.values = values
+        self.present = present
+
+    def padded(self, size: int) -> tuple[np.ndarray, np.ndarray]:
+        """後から追加された予備スロットの分を 0 / False で埋めて返す"""
+        k = size - len(self.values)
+        if k <= 0:
+            return self.values, self.present
+        return (np.concatenate([self.values, np.zeros(k)]),
+                np.concatenate([self.present, np.zeros(k, dtype=bool)]))
+
+    def long_table(self) -> pd.DataFrame:
+        """長形式 term/value（term の辞書順）"""
+        idx = np.flatnonzero(self.present)
+        terms = [self.registry.terms[i] for i in idx]
+        out = pd.DataFrame({"term": terms, "value": self.values[idx].astype(float)})
+        return out.sort_values("term", kind="mergesort").reset_index(drop=True)
+
+
+def build_term_vector(df: pd.DataFrame | ParsedTable,
+                      registry: TermRegistry | None = None) -> TermVector:
+    """1データ分の NUM / CAT / CORR の全 term をレジストリのスロットに書き込む"""
+    if registry is None:
+        registry = get_term_registry()
+    pt = as_parsed(df)
+    num_cols = detect_numeric_columns(pt, thresh=0.95)
+    cat_cols = [c for c in pt.columns if c not in num_cols]
+
+    slots, vals = [], []
+    if num_cols:
+        X = numeric_matrix(pt, num_cols)
+        slots.append(registry.num_slots(num_cols).ravel())
+        vals.append(minmax_norm_rows(numeric_stats_matrix(X)).ravel())
+        if len(num_cols) >= 2:
+            slots.append(registry.corr_slots(num_cols))
+            vals.append(corr_upper(X))
+    if pt.n_rows > 0:
+        for c in cat_cols:
+            levels, counts = pt.value_counts(c)
+            slots.append(np.array([registry.slot(f"CAT:{c}={v}") for v in levels], dtype=np.intp))
+            vals.append(counts / float(pt.n_rows))
+
+    values = np.zeros(registry.size)
+    present = np.zeros(registry.size, dtype=bool)
+    if slots:
+        s = np.concatenate(slots)
+        values[s] = np.nan_to_num(np.concatenate(vals).astype(float), nan=0.0, posinf=np.inf, neginf=-np.inf)
+        present[s] = True
+    return TermVector(registry, values, present)
+
+def term_vector_from_long(tbl: pd.DataFrame, registry: TermRegistry | None = None) -> TermVector:
+    """長形式 term/value テーブルをベクトルに変換する"""
+    if registry is None:
+        registry = get_term_registry()
+    s = np.array([registry.slot(t) for t in tbl["term"]], dtype=np.intp)
+    values = np.zeros(registry.size)
+    present = np.zeros(registry.size, dtype=bool)
+    values[s] = tbl["value"].fillna(0.0).to_numpy(dtype=float)
+    present[s] = True
+    return TermVector(registry, values, present)
 
-    # 表示を2セクションに分ける（Normalized と Correlation）
-    diff_df = diff.reset_index()
-    diff_df.columns = ["term", "value_diff"]
 
-    # NaN→0（念のため）
-    diff_df["value_diff"] = diff_df["value_diff"].fillna(0.0)
+# ---------- 1ファイル分の長形式テーブル作成 ----------
+
+def build_long_table_for_csv(df: pd.DataFrame | ParsedTable) -> pd.DataFrame:
+    # df = read_csv_all_str(csv_path)
+    return build_term_vector(df).long_table()
+
+# ---------- 差分と出力 ----------
 
+def _term_vectors(df1, df2, tbl1) -> tuple[TermVector, TermVector]:
+    if tbl1 is None:
+        tv1 = build_term_vector(df1)
+    elif isinstance(tbl1, TermVector):
+        tv1 = tbl1
+    else:
+        tv1 = term_vector_from_long(tbl1)
+    # df2 は df1 と同じレジストリに載せる
+    tv2 = build_term_vector(df2, registry=tv1.registry)
+    return tv1, tv2
+
+def diff_vector(tv1: TermVector, tv2: TermVector) -> np.ndarray:
+    """同じレジストリ上の2ベクトルの差 (tv2 - tv1)。片側にしか無い term は無い側を 0 とみなす"""
+    size = tv1.registry.size
+    v1, _ = tv1.padded(size)
+    v2, _ = tv2.padded(size)
+    return np.nan_to_num(v2 - v1, nan=0.0)
+
+def diff_long_table(tv1: TermVector, tv2: TermVector, diff: np.ndarray | None = None) -> pd.DataFrame:
+    """どちらかに現れた term だけを辞書順に並べた長形式の差分表 (term, value_diff)"""
+    size = tv1.registry.size
+    _, p1 = tv1.padded(size)
+    _, p2 = tv2.padded(size)
+    if diff is None:
+        diff = diff_vector(tv1, tv2)
+    idx = np.flatnonzero(p1 | p2)
+    terms = [tv1.registry.terms[i] for i in idx]
+    diff_df = pd.DataFrame({"term": terms, "value_diff": diff[idx].astype(float)})
+    return diff_df.sort_values("term", kind="mergesort").reset_index(drop=True)
+
+def _report_diff(diff_df: pd.DataFrame, out=None, print_details=False):
     # セクション分割
     diff_norm = diff_df[diff_df["term"].str.startswith(("NUM:", "CAT:"))].copy()
     diff_corr = diff_df[diff_df["term"].str.startswith("CORR:")].copy()
@@ -227,29 +419,157 @@ def eval_diff(df1: pd.DataFrame, df2: pd.DataFrame,
     if out:
         diff_df.to_csv(out, index=False)
 
+def eval_diff(df1: pd.DataFrame | ParsedTable | None, df2: pd.DataFrame | ParsedTable,
+                 out=None, print_details=False, tbl1: "TermVector | pd.DataFrame | None" = None) -> pd.DataFrame:
+    """
+    データフレームを2つ受け取って、それらの基本統計の差を返す
+
+    Paramters:
+    df1 (pd.DataFrame | ParsedTable): データフレームその1（解析済みでも可）
+    df2 (pd.DataFrame | ParsedTable): データフレームその2（解析済みでも可）
+    out (str): 基本統計の差を保存したい場所を指定。テーブル同士の差が書き込まれる
+    print_details (bool): 詳細の結果を表示するかどうか
+    tbl1 (TermVector | pd.DataFrame): 事前計算済みの df1 の term ベクトルまたは長形式テーブル（指定時は df1 を使わない）
+
+    Returns:
+    基本統計の差 (pd.DataFrame)
+    """
+    tv1, tv2 = _term_vectors(df1, df2, tbl1)
+    diff_df = diff_long_table(tv1, tv2)
+    _report_diff(diff_df, out, print_details)
     return diff_df
 
-def eval_diff_max_abs(df1: pd.DataFrame, df2: pd.DataFrame,
-                 out=None, print_details=False) -> float:
+def eval_diff_max_abs(df1: pd.DataFrame | ParsedTable | None, df2: pd.DataFrame | ParsedTable,
+                 out=None, print_details=False, tbl1: "TermVector | pd.DataFrame | None" = None) -> float:
     """
     データフレームを2つ受け取って、それらの基本統計のうち最も大きい差を返す
 
     Paramters:
-    path_to_csv1 (str): データフレームその1
-    path_to_csv2 (str): CSVファイルその2
+    df1 (pd.DataFrame | ParsedTable): データフレームその1（解析済みでも可）
+    df2 (pd.DataFrame | ParsedTable): データフレームその2（解析済みでも可）
     out (str): 基本統計の差を保存したい場所を指定。テーブル同士の差が書き込まれる
     print_details (bool): 詳細の結果を表示するかどうか
+    tbl1 (TermVector | pd.DataFrame): 事前計算済みの df1 の term ベクトルまたは長形式テーブル（指定時は df1 を使わない）
 
     Returns:
     基本統計の最も大きい差 (float)
     """
-    diff_df = eval_diff(df1, df2, out, print_details)
+    tv1, tv2 = _term_vectors(df1, df2, tbl1)
+    diff = diff_vector(tv1, tv2)
+
+    # 長形式の表は表示・保存する場合だけ作る
+    if print_details or out:
+        _report_diff(diff_long_table(tv1, tv2, diff), out, print_details)
 
     # 最大絶対差
-    max_abs = float(diff_df["value_diff"].abs().max()) if not diff_df.empty else 0.0
+    max_abs = float(np.abs(diff).max()) if diff.size else 0.0
 
     return max_abs
 
+# ---------- 列単位の差分更新 ----------
+
+class StatsDiffScorer:
+    """
+    Bi を固定し、Ci の1列を書き換えた時の stats_diff の max_abs を差分更新で求める。
+
+    update_column(name, new_values) は変更された列に関わる term だけを計算し直す:
+    - 数値列: その列の mean/std/q25/q50/q75、相関行列のその列の行と列、
+      および列をまたぐ統計量ごとの min-max 正規化（p 個の値の再正規化のみ）
+    - カテゴリ列: その列の各値の比率
+    数値/カテゴリの判定が変わった場合だけ全体を計算し直す。
+    結果は eval_diff_max_abs による再計算と丸め誤差の範囲で一致する。
+    """
+
+    def __init__(self, Bi_df: pd.DataFrame | ParsedTable | None, Ci_df: pd.DataFrame | ParsedTable,
+                 tbl1: "TermVector | pd.DataFrame | None" = None):
+        if tbl1 is None:
+            tv1 = build_term_vector(Bi_df)
+        elif isinstance(tbl1, TermVector):
+            tv1 = tbl1
+        else:
+            tv1 = term_vector_from_long(tbl1)
+        self.tv1 = tv1
+        self.registry = tv1.registry
+        # 渡された ParsedTable は書き換えない
+        self.pt = as_parsed(Ci_df).copy()
+        self._rebuild()
+
+    def _rebuild(self):
+        pt = self.pt
+        self.num_cols = detect_numeric_columns(pt, thresh=0.95)
+        self.cat_cols = [c for c in pt.columns if c not in self.num_cols]
+        self._num_pos = {c: j for j, c in enumerate(self.num_cols)}
+
+        self.X = numeric_matrix(pt, self.num_cols)
+        self.raw_stats = numeric_stats_matrix(self.X)
+        self.corr = nan_corr_matrix(self.X) if len(self.num_cols) >= 2 else np.empty((0, 0))
+        self.num_slots = self.registry.num_slots(self.num_cols)
+        self.corr_slots = self.registry.corr_slots(self.num_cols) if len(self.num_cols) >= 2 else np.empty(0, dtype=np.intp)
+        self._iu = np.triu_indices(len(self.num_cols), k=1)
+
+        self.cat_terms: Dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        for c in self.cat_cols:
+            self._update_cat(c)
+        self._assemble()
+
+    def _update_cat(self, c: str):
+        if self.pt.n_rows == 0:
+            self.cat_terms[c] = (np.empty(0, dtype=np.intp), np.empty(0))
+            return
+        levels, counts = self.pt.value_counts(c)
+        slots = np.array([self.registry.slot(f"CAT:{c}={v}") for v in levels], dtype=np.intp)
+        self.cat_terms[c] = (slots, counts / float(self.pt.n_rows))
+
+    def _assemble(self):
+        slots, vals = [self.num_slots.ravel()], [minmax_norm_rows(self.raw_stats).ravel()]
+        if len(self.num_cols) >= 2:
+            slots.append(self.corr_slots)
+            vals.append(np.nan_to_num(self.corr[self._iu], nan=0.0))
+        for c in self.cat_cols:
+            slots.append(self.cat_terms[c][0])
+            vals.append(self.cat_terms[c][1])
+
+        size = self.registry.size
+        values = np.zeros(size)
+        present = np.zeros(size, dtype=bool)
+        s = np.concatenate(slots)
+        values[s] = np.nan_to_num(np.concatenate(vals).astype(float), nan=0.0, posinf=np.inf, neginf=-np.inf)
+        present[s] = True
+        self.tv2 = TermVector(self.registry, values, present)
+        self.diff = diff_vector(self.tv1, self.tv2)
+        self.max_abs = float(np.abs(self.diff).max()) if self.diff.size else 0.0
+
+    def update_column(self, name: str, new_values) -> float:
+        """
+        Ci の列 name を new_values（文字列の並び、行数は同じ）で置き換え、新しい max_abs を返す
+        """
+        was_num = name in self._num_pos
+        self.pt.replace_column(name, new_values)
+        is_num = is_numeric_column(self.pt, name, thresh=0.95)
+
+        if was_num != is_num or name not in self.num_cols + self.cat_cols:
+            # 型判定が変わった（または新しい列）場合は全体を作り直す
+            self._rebuild()
+            return self.max_abs
+
+        if is_num:
+            j = self._num_pos[name]
+            self.X[:, j] = self.pt.numeric[name]
+            self.raw_stats[:, j] = numeric_stats_matrix(self.X[:, [j]])[:, 0]
+            if len(self.num_cols) >= 2:
+                r = corr_with_column(self.X, j)
+                self.corr[j, :] = r
+                self.corr[:, j] = r
+        else:
+            self._update_cat(name)
+
+        self._assemble()
+        return self.max_abs
+
+    def long_table(self) -> pd.DataFrame:
+        """現在の差分の長形式テーブル (term, value_diff)"""
+        return diff_long_table(self.tv1, self.tv2, self.diff)
+
 def eval(path_to_csv1:str, path_to_csv2:str,
          out=None, print_details=False) -> float:
     """
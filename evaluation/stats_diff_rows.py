@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+stats_diff_rows.py
+- Bi を固定し、Ci の1行（の一部の列）を書き換えた時の stats_diff の max_abs を
+  行単位の差分更新で求める（局所探索型の匿名化で「行 i をこう変えたら？」を大量に試す用途）。
+- 保持する状態:
+    数値列   : 列ペアごとの有効行数・和・二乗和・積和（pairwise-complete の相関用。対角は平均・標準偏差用）
+               と、分位点（q25/q50/q75）用の順序統計の木（analysis/fenwick.py）
+    全列     : 前後空白除去後の値ごとの件数（CAT の比率と数値/カテゴリの判定用）
+- 1行の書き換えは 数値列数 p に対して O(p^2 + p log U)（U は列の取りうる値の種類数）で、
+  行数 n には依存しない。
+- 数値列が columns_range.json の小数桁の格子に載っている場合（通常の Ci）は、
+  和・積和を 10^小数桁 倍した整数で持つため、更新を何度繰り返しても誤差が蓄積しない。
+  格子外の値が現れた場合は、列平均でずらした浮動小数点の和に切り替える。
+- 結果は stats_diff.eval_diff_max_abs による再計算と丸め誤差の範囲で一致する
+  （分位点は np.nanquantile(method="linear") と同じ式で計算する）。
+"""
+
+import json
+import sys
+import os
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+import stats_diff
+from stats_diff import TermVector, NUM_STATS
+
+# モジュールの相対参照制限を強制的に回避
+current_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(current_dir, '..', 'analysis'))
+from parsed_table import ParsedTable, as_parsed
+from fenwick import OrderStatTree
+
+# 整数の積和が int64 に収まる範囲（n^2 * M^2 < 2^62）
+_INT_LIMIT = 1 << 62
+
+
+def load_number_specs(path: str = stats_diff.COLUMNS_RANGE_JSON) -> Dict[str, dict]:
+    """columns_range.json の数値列の仕様（min / max / max_decimal_places）"""
+    with open(path, encoding="utf-8") as f:
+        specs = json.load(f)["columns"]
+    return {c: sp for c, sp in specs.items()
+            if sp.get("type") == "number" and "max_decimal_places" in sp}
+
+
+def value_grid(spec: dict) -> np.ndarray:
+    """
+    min〜max を小数桁で刻んだ値の候補。
+    整数 / 10^桁 は文字列 "28.72" を float にした値とビット単位で一致する。
+    """
+    scale = 10 ** int(spec["max_decimal_places"])
+    lo = int(round(spec["min"] * scale))
+    hi = int(round(spec["max"] * scale))
+    return np.arange(lo, hi + 1, dtype=np.int64) / scale
+
+
+class StatsDiffRowScorer:
+    """
+    Bi を固定し、Ci の行単位の書き換えに対する stats_diff の max_abs を差分更新で求める。
+
+    - set_row(i, values)   : 行 i の列を values（{列名: 文字列}）で書き換え、新しい max_abs を返す
+    - score_row(i, values) : 書き換えた場合の max_abs を返す（状態は元に戻す）
+    数値/カテゴリの判定が変わった場合だけ全体を計算し直す。
+    """
+
+    def __init__(self, Bi_df: pd.DataFrame | ParsedTable | None, Ci_df: pd.DataFrame | ParsedTable,
+                 tbl1: "TermVector | pd.DataFrame | None" = None,
+                 columns_range: str = stats_diff.COLUMNS_RANGE_JSON):
+        if tbl1 is None:
+            tv1 = stats_diff.build_term_vector(Bi_df)
+        elif isinstance(tbl1, TermVector):
+            tv1 = tbl1
+        else:
+            tv1 = stats_diff.term_vector_from_long(tbl1)
+        self.tv1 = tv1
+        self.registry = tv1.registry
+        self.specs = load_number_specs(columns_range)
+        self._grids: Dict[str, np.ndarray] = {}
+        self._parse_cache: Dict[str, tuple[float, str]] = {}
+
+        pt = as_parsed(Ci_df)
+        self.columns = list(pt.columns)
+        self.n_rows = pt.n_rows
+
+        # 列ごとの現在の値（元の文字列・数値・空白除去後の文字列）と件数
+        self.cells: Dict[str, np.ndarray] = {}
+        self.num: Dict[str, np.ndarray] = {}
+        self.strip: Dict[str, np.ndarray] = {}
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self.n_nonblank: Dict[str, int] = {}
+        self.n_numeric: Dict[str, int] = {}
+        for c in self.columns:
+            self.cells[c] = np.asarray(pt.raw_levels[c], dtype=object)[pt.raw_codes[c]]
+            self.num[c] = pt.numeric[c].copy()
+            levels = np.asarray(pt.levels[c], dtype=object)
+            self.strip[c] = levels[pt.codes[c]]
+            _, cnt = pt.value_counts(c)
+            self.counts[c] = {v: int(k) for v, k in zip(pt.levels[c], cnt) if k > 0}
+            self.n_nonblank[c] = int((~pt.blank[c]).sum())
+            self.n_numeric[c] = int((~np.isnan(self.num[c])).sum())
+
+        self._rebuild()
+
+    # ---------- 値の解析 ----------
+
+    def _parse(self, s) -> tuple[float, str]:
+        """1セルの文字列を (数値 or NaN, 前後空白除去後の文字列) にする（ParsedTable と同じ規則）"""
+        if not isinstance(s, str):
+            s = str(s)
+        r = self._parse_cache.get(s)
+        if r is None:
+            v = pd.to_numeric(pd.Series([s], dtype=object), errors="coerce").to_numpy(dtype="float64")[0]
+            r = (float(v), s.strip())
+            self._parse_cache[s] = r
+        return r
+
+    def _is_numeric(self, c: str) -> bool:
+        # stats_diff.is_numeric_column と同じ判定（非空のうち 95% 以上が数値化できる）
+        nb = self.n_nonblank[c]
+        return nb > 0 and self.n_numeric[c] / nb >= 0.95
+
+    # ---------- 全体の構築 ----------
+
+    def _grid(self, c: str) -> np.ndarray | None:
+        if c not in self.specs:
+            return None
+        if c not in self._grids:
+            self._grids[c] = value_grid(self.specs[c])
+        return self._grids[c]
+
+    def _rebuild(self):
+        self.num_cols = [c for c in self.columns if self._is_numeric(c)]
+        self.cat_cols = [c for c in self.columns if c not in self.num_cols]
+        self._num_pos = {c: j for j, c in enumerate(self.num_cols)}
+        p = len(self.num_cols)
+
+        X = np.empty((self.n_rows, p), dtype="float64", order="F")
+        for j, c in enumerate(self.num_cols):
+            X[:, j] = self.num[c]
+        W = np.isfinite(X)
+
+        # 整数モード: 全数値列が小数桁の格子に載り、積和が int64 に収まる場合
+        self.int_mode = False
+        if p and all(c in self.specs for c in self.num_cols):
+            self.scale = np.array([10 ** int(self.specs[c]["max_decimal_places"]) for c in self.num_cols],
+                                  dtype=np.int64)
+            self._limit = int(np.sqrt(_INT_LIMIT / max(self.n_rows, 1) ** 2))
+            Zi = np.rint(np.where(W, X, 0.0) * self.scale)
+            finite = X[W]
+            ok = (not np.isinf(X).any()) and np.all(np.abs(Zi) <= self._limit) and \
+                 np.array_equal((Zi / self.scale)[W], finite)
+            if ok:
+                self.int_mode = True
+                Z = Zi.astype(np.int64)
+                Wn = W.astype(np.int64)
+        if not self.int_mode:
+            cnt = W.sum(axis=0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                self.shift = np.where(cnt > 0, np.where(W, X, 0.0).sum(axis=0) / np.maximum(cnt, 1), 0.0)
+            Z = np.where(W, X - self.shift, 0.0)
+            Wn = W.astype("float64")
+
+        # 列ペアごとの有効行数・和・二乗和・積和（対角は列ごとの値）
+        self.N = Wn.T @ Wn
+        self.SX = Z.T @ Wn
+        self.SXX = (Z * Z).T @ Wn
+        self.SXY = Z.T @ Z
+        self.n_pinf = np.isposinf(X).sum(axis=0)
+        self.n_ninf = np.isneginf(X).sum(axis=0)
+
+        self.trees = []
+        for j, c in enumerate(self.num_cols):
+            vals = X[:, j]
+            self.trees.append(OrderStatTree(vals[~np.isnan(vals)], keys=self._grid(c)))
+
+        self.num_slots = self.registry.num_slots(self.num_cols)
+        self.corr_slots = self.registry.corr_slots(self.num_cols) if p >= 2 else np.empty(0, dtype=np.intp)
+        self._iu = np.triu_indices(p, k=1)
+        self.raw_stats = np.full((len(NUM_STATS), p), np.nan)
+        for j in range(p):
+            self.raw_stats[:, j] = self._col_stats(j)
+
+        size = self.registry.size
+        self.values = np.zeros(size)
+        self.present = np.zeros(size, dtype=bool)
+        if self.n_rows > 0:
+            for c in self.cat_cols:
+                for v in self.counts[c]:
+                    self._set_cat(c, v)
+        self._assemble()
+
+    # ---------- 統計量 ----------
+
+    def _z(self, x: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        w = np.isfinite(x)
+        if self.int_mode:
+            z = np.rint(np.where(w, x, 0.0) * self.scale).astype(np.int64)
+            return z, w.astype(np.int64)
+        return np.where(w, x - self.shift, 0.0), w.astype("float64")
+
+    def _col_stats(self, j: int) -> np.ndarray:
+        """数値列 j の mean/std/q25/q50/q75（NUM_STATS 順）"""
+        out = np.full(len(NUM_STATS), np.nan)
+        c = int(self.N[j, j])
+        n_pinf, n_ninf = int(self.n_pinf[j]), int(self.n_ninf[j])
+        n_inf = n_pinf + n_ninf
+        if c + n_inf > 0:
+            if n_pinf and n_ninf:
+                out[0] = np.nan
+            elif n_inf:
+                out[0] = np.inf if n_pinf else -np.inf
+            elif self.int_mode:
+                # 整数の比は正しく丸められる
+                out[0] = int(self.SX[j, j]) / (c * int(self.scale[j]))
+            else:
+                out[0] = self.shift[j] + self.SX[j, j] / c
+        if c > 1 and not n_inf:
+            if self.int_mode:
+                s, q, sc = int(self.SX[j, j]), int(self.SXX[j, j]), int(self.scale[j])
+                var = (c * q - s * s) / (c * (c - 1) * sc * sc)
+            else:
+                s, q = self.SX[j, j], self.SXX[j, j]
+                var = max(q - s * s / c, 0.0) / (c - 1)
+            out[1] = np.sqrt(var)
+        t = self.trees[j]
+        out[2] = t.quantile(0.25)
+        out[3] = t.quantile(0.50)
+        out[4] = t.quantile(0.75)
+        return out
+
+    def _corr_upper(self) -> np.ndarray:
+        N, SX, SXX, SXY = self.N, self.SX, self.SXX, self.SXY
+        with np.errstate(invalid="ignore", divide="ignore"):
+            if self.int_mode:
+                # n 倍した共分散・分散を整数のまま求め、最後に1回だけ浮動小数点にする
+                cov = (N * SXY - SX * SX.T).astype("float64")
+                var_x = (N * SXX - SX * SX).astype("float64")
+                var_y = var_x.T
+            else:
+                cov = SXY - SX * SX.T / N
+                var_x = SXX - SX * SX / N
+                var_y = var_x.T
+                var_x = np.where(var_x <= 1e-12 * SXX, 0.0, var_x)
+                var_y = np.where(var_y <= 1e-12 * SXX.T, 0.0, var_y)
+            divisor = np.sqrt(var_x * var_y)
+            r = np.where((N >= 2) & (divisor > 0), cov / divisor, np.nan)
+        return np.nan_to_num(np.clip(r, -1.0, 1.0)[self._iu], nan=0.0)
+
+    def _set_cat(self, c: str, v: str):
+        k = self.registry.slot(f"CAT:{c}={v}")
+        if k >= len(self.values):
+            # 予備スロットが追加された
+            extra = self.registry.size - len(self.values)
+            self.values = np.concatenate([self.values, np.zeros(extra)])
+            self.present = np.concatenate([self.present, np.zeros(extra, dtype=bool)])
+        cnt = self.counts[c].get(v, 0)
+        self.values[k] = cnt / float(self.n_rows)
+        self.present[k] = cnt > 0
+
+    def _assemble(self):
+        if self.num_cols:
+            norm = stats_diff.minmax_norm_rows(self.raw_stats)
+            self.values[self.num_slots.ravel()] = norm.ravel()
+            self.present[self.num_slots.ravel()] = True
+            if len(self.num_cols) >= 2:
+                self.values[self.corr_slots] = self._corr_upper()
+                self.present[self.corr_slots] = True
+        v1, _ = self.tv1.padded(self.registry.size)
+        diff = np.nan_to_num(self.values - v1, nan=0.0)
+        self.diff = diff
+        self.max_abs = float(np.abs(diff).max()) if diff.size else 0.0
+
+    # ---------- 行の書き換え ----------
+
+    def _apply(self, i: int, values: dict) -> dict:
+        """行 i を書き換え、元に戻すための {列名: 元の文字列} を返す"""
+        old_cells = {}
+        num_changed = []
+        cat_changed = []
+        flipped = False
+        xo = np.array([self.num[c][i] for c in self.num_cols], dtype="float64")
+
+        for c, s in values.items():
+            if c not in self.cells:
+                raise KeyError(f"列 {c} は Ci にありません")
+            s = s if isinstance(s, str) else str(s)
+            old = self.cells[c][i]
+            if old == s:
+                continue
+            old_cells[c] = old
+            v_old, st_old = self.num[c][i], self.strip[c][i]
+            v_new, st_new = self._parse(s)
+
+            cnt = self.counts[c]
+            cnt[st_old] -= 1
+            if cnt[st_old] == 0:
+                del cnt[st_old]
+            cnt[st_new] = cnt.get(st_new, 0) + 1
+            self.n_nonblank[c] += (st_new != "") - (st_old != "")
+            self.n_numeric[c] += (not np.isnan(v_new)) - (not np.isnan(v_old))
+            self.cells[c][i], self.num[c][i], self.strip[c][i] = s, v_new, st_new
+
+            if self._is_numeric(c) != (c in self._num_pos):
+                flipped = True
+            elif c in self._num_pos:
+                num_changed.append(self._num_pos[c])
+                t = self.trees[self._num_pos[c]]
+                if not np.isnan(v_old):
+                    t.remove(v_old)
+                if not np.isnan(v_new):
+                    t.add(v_new)
+            else:
+                cat_changed.append((c, st_old, st_new))
+
+        if flipped:
+            # 数値/カテゴリの判定が変わった場合は全体を作り直す
+            self._rebuild()
+            return old_cells
+
+        if num_changed:
+            xn = np.array([self.num[c][i] for c in self.num_cols], dtype="float64")
+            if self.int_mode and not self._on_grid(xn):
+                self._rebuild()
+                return old_cells
+            zo, wo = self._z(xo)
+            zn, wn = self._z(xn)
+            self.N += np.outer(wn, wn) - np.outer(wo, wo)
+            self.SX += np.outer(zn, wn) - np.outer(zo, wo)
+            self.SXX += np.outer(zn * zn, wn) - np.outer(zo * zo, wo)
+            self.SXY += np.outer(zn, zn) - np.outer(zo, zo)
+            self.n_pinf += np.isposinf(xn).astype(np.int64) - np.isposinf(xo)
+            self.n_ninf += np.isneginf(xn).astype(np.int64) - np.isneginf(xo)
+            for j in num_changed:
+                self.raw_stats[:, j] = self._col_stats(j)
+
+        for c, st_old, st_new in cat_changed:
+            self._set_cat(c, st_old)
+            self._set_cat(c, st_new)
+
+        self._assemble()
+        return old_cells
+
+    def _on_grid(self, x: np.ndarray) -> bool:
+        w = ~np.isnan(x)
+        if np.isinf(x).any():
+            return False
+        z = np.rint(np.where(w, x, 0.0) * self.scale)
+        return bool(np.all(np.abs(z) <= self._limit) and np.array_equal((z / self.scale)[w], x[w]))
+
+    def set_row(self, i: int, values: dict) -> float:
+        """
+        Ci の行 i の列を values（{列名: 文字列}）で書き換え、新しい max_abs を返す
+        """
+        self._apply(i, values)
+        return self.max_abs
+
+    def score_row(self, i: int, values: dict) -> float:
+        """
+        Ci の行 i の列を values で書き換えた場合の max_abs を返す（状態は書き換え前に戻す）
+        """
+        old_cells = self._apply(i, values)
+        max_abs = self.max_abs
+        if old_cells:
+            self._apply(i, old_cells)
+        return max_abs
+
+    # ---------- 確認用 ----------
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """現在の Ci（文字列の DataFrame）"""
+        return pd.DataFrame({c: self.cells[c] for c in self.columns})
+
+    def long_table(self) -> pd.DataFrame:
+        """現在の差分の長形式テーブル (term, value_diff)"""
+        tv2 = TermVector(self.registry, self.values, self.present)
+        return stats_diff.diff_long_table(self.tv1, tv2, self.diff)
+
+    def recompute_max_abs(self) -> float:
+        """現在の Ci から stats_diff.eval_diff_max_abs で再計算した max_abs（差分更新の確認用）"""
+        return stats_diff.eval_diff_max_abs(None, self.to_dataframe(), tbl1=self.tv1)
@@ -22,6 +22,10 @@ def parse_metrics(text: str) -> dict:
         match = re.search(pat, text)
         if match:
             results[key] = float(match.group(1))
+    # 閾値モード・足切りで採点を省略した場合は utility の上限だけが出力される
+    bounds = re.findall(r"Ci utility <= ([0-9.]+) / 80", text)
+    if bounds and "ci_utility" not in results:
+        results["ci_utility_upper_bound"] = float(bounds[-1])
     return results
 
 
@@ -38,6 +42,8 @@ def build_eval_cmd(args: argparse.Namespace) -> list[str]:
         cmd.append("-f")
     if args.print_details:
         cmd.append("-d")
+    if args.target_utility is not None:
+        cmd += ["--target-utility", str(args.target_utility)]
     return cmd
 
 
@@ -72,6 +78,12 @@ def main() -> None:
         action="store_true",
         help="Ci フォーマット異常時も -f で採点",
     )
+    parser.add_argument(
+        "--target-utility",
+        type=float,
+        default=None,
+        help="evaluation/eval_all.py --target-utility を付与（この utility を超えられない Ci は採点を打ち切る）",
+    )
     args = parser.parse_args()
 
     bi_path = Path(args.bi)
@@ -3,12 +3,27 @@ import os
 import json
 from decimal import Decimal, InvalidOperation
 
+import numpy as np
 import pandas as pd
 
 from check_and_fix_csv import to_decimal_maybe, quantize_to_places
 
 # COLUMNS = []
 YMD_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+# float でも Decimal でも同じ値として読める数値の形式（check_col_specs で float による範囲判定に使う）
+NUM_RE = re.compile(r"[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?")
+
+def _num_spec_violation(val, min_val: Decimal, max_val: Decimal):
+    """
+    数値列の値 val が仕様に反する理由（反していなければ None）
+    """
+    try:
+        d = Decimal(val)
+    except InvalidOperation:
+        return "数値変換不可"
+    if d < min_val or d > max_val:
+        return f"{min_val}〜{max_val}の範囲外"
+    return None
 
 def get_col_specs():
     # 現在のモジュールファイルのディレクトリを取得
@@ -114,8 +129,12 @@ class BiDataFrame(pd.DataFrame):
             raise RowNumError(f"期待される行数は{cls.ROW_NUM}, 実際の行数は{row_num}")
         
     @classmethod
-    def check_col_specs(cls, df:pd.DataFrame):
-        target_columns = list(df.columns)
+    def _check_col_specs(cls, df:pd.DataFrame, col_errors):
+        """
+        列ごとの仕様チェック（col_errors(列, 列名, 列の仕様) が返すエラーを列の順に集める）。
+        エラーが見つかった列で打ち切る
+        """
+        target_columns = set(df.columns)
 
         errors = []
 
@@ -124,50 +143,9 @@ class BiDataFrame(pd.DataFrame):
                 # フォーマットをチェックしているデータにあるべき列がない場合はエラー
                 raise ColumnsError(f"列がありません: {col}")
 
-            # 値の前後空白除去
-            raw_vals = df[col].map(lambda x: x.strip() if isinstance(x, str) else x)
             col_type = col_spec.get("type", "")
-
-            if col_type == "number":
-                min_val = Decimal(str(col_spec["min"]))
-                max_val = Decimal(str(col_spec["max"]))
-                for idx, val in raw_vals.items():
-                    if val == "":
-                        continue
-                    try:
-                        d = Decimal(val)
-                    except InvalidOperation:
-                        errors.append(NumSpecError(idx+1, col, val, "数値変換不可"))
-                        continue
-                    if d < min_val or d > max_val:
-                        errors.append(NumSpecError(idx+1, col, val, f"{min_val}〜{max_val}の範囲外"))
-
-            elif col_type == "category":
-                allowed = set(col_spec.get("values", []))
-                for idx, val in raw_vals.items():
-                    if val == "":
-                        continue
-                    if val not in allowed:
-                        errors.append(CatSpecError(idx+1, col, val, f"許可されていない値（{allowed}）"))
-
-            elif col_type == "date":
-                # yyyy-mm-dd 固定
-                min_dt = pd.to_datetime(col_spec["min"], format="%Y-%m-%d", errors="raise")
-                max_dt = pd.to_datetime(col_spec["max"], format="%Y-%m-%d", errors="raise")
-
-                for idx, val in raw_vals.items():
-                    if val == "":
-                        continue
-                    if not YMD_RE.match(val):
-                        errors.append(ColSpecError(idx+1, col, val, "日付形式違反（yyyy-mm-dd）"))
-                        continue
-                    dt = pd.to_datetime(val, format="%Y-%m-%d", errors="coerce")
-                    if pd.isna(dt):
-                        errors.append(ColSpecError(idx+1, col, val, "日付変換不可（yyyy-mm-dd）"))
-                        continue
-                    if dt < min_dt or dt > max_dt:
-                        errors.append(ColSpecError(idx+1, col, val, f"{min_dt.strftime('%Y-%m-%d')}〜{max_dt.strftime('%Y-%m-%d')}の範囲外"))
-
+            if col_type in ("number", "category", "date"):
+                errors.extend(col_errors(df[col], col, col_spec))
             else:
                 # デバッグ用。columns_range.jsonを編集した場合に、表示される可能性あり
                 print(f"警告: 列 '{col}' のタイプ '{col_type}' は未対応。スキップします。")
@@ -175,6 +153,166 @@ class BiDataFrame(pd.DataFrame):
             if errors:
                 raise ExceptionGroup("仕様に反する列が存在します", errors)
 
+    @staticmethod
+    def _col_spec_errors_loop(col_vals:pd.Series, col:str, col_spec:dict) -> list:
+        """
+        1列の仕様チェックを1セルずつ行う（check_col_specs_loop 用）
+        """
+        errors = []
+
+        # 値の前後空白除去
+        raw_vals = col_vals.map(lambda x: x.strip() if isinstance(x, str) else x)
+        col_type = col_spec.get("type", "")
+
+        if col_type == "number":
+            min_val = Decimal(str(col_spec["min"]))
+            max_val = Decimal(str(col_spec["max"]))
+            for idx, val in raw_vals.items():
+                if val == "":
+                    continue
+                reason = _num_spec_violation(val, min_val, max_val)
+                if reason is not None:
+                    errors.append(NumSpecError(idx+1, col, val, reason))
+
+        elif col_type == "category":
+            allowed = set(col_spec.get("values", []))
+            for idx, val in raw_vals.items():
+                if val == "":
+                    continue
+                if val not in allowed:
+                    errors.append(CatSpecError(idx+1, col, val, f"許可されていない値（{allowed}）"))
+
+        elif col_type == "date":
+            # yyyy-mm-dd 固定
+            min_dt = pd.to_datetime(col_spec["min"], format="%Y-%m-%d", errors="raise")
+            max_dt = pd.to_datetime(col_spec["max"], format="%Y-%m-%d", errors="raise")
+
+            for idx, val in raw_vals.items():
+                if val == "":
+                    continue
+                if not YMD_RE.match(val):
+                    errors.append(ColSpecError(idx+1, col, val, "日付形式違反（yyyy-mm-dd）"))
+                    continue
+                dt = pd.to_datetime(val, format="%Y-%m-%d", errors="coerce")
+                if pd.isna(dt):
+                    errors.append(ColSpecError(idx+1, col, val, "日付変換不可（yyyy-mm-dd）"))
+                    continue
+                if dt < min_dt or dt > max_dt:
+                    errors.append(ColSpecError(idx+1, col, val, f"{min_dt.strftime('%Y-%m-%d')}〜{max_dt.strftime('%Y-%m-%d')}の範囲外"))
+
+        return errors
+
+    @staticmethod
+    def _col_spec_errors(col_vals:pd.Series, col:str, col_spec:dict) -> list:
+        """
+        1列の仕様チェックを列単位の演算で行う。エラーとその順序は _col_spec_errors_loop と同じ。
+        列を pd.factorize で異なる値の番号にし、異なる値ごとに1回だけ判定してから行に戻す
+        - 数値：よくある形式（NUM_RE）の値は float にして範囲と比べ、
+          float で min/max と等しくなる値とそれ以外の形式の値だけ Decimal で確認する
+          （float への変換は単調なので、float で範囲の内外が決まる値は Decimal でも同じ結果になる）
+        - カテゴリ：isin
+        - 日付：正規表現の一致を確認し、pd.to_datetime でまとめて変換する
+        文字列以外の値（欠損など）を含む列は _col_spec_errors_loop で調べる
+        """
+        codes, uniques = pd.factorize(col_vals.to_numpy(dtype=object))
+        if (codes < 0).any() or pd.api.types.infer_dtype(uniques, skipna=False) not in ("string", "empty"):
+            return BiDataFrame._col_spec_errors_loop(col_vals, col, col_spec)
+
+        # 値の前後空白除去（異なる値ごと）
+        vals = np.array([v.strip() for v in uniques], dtype=object)
+        nonempty = vals != ""
+        col_type = col_spec.get("type", "")
+
+        # 異なる値の番号 -> (エラーの型, 理由)
+        found = {}
+
+        if col_type == "number":
+            min_val = Decimal(str(col_spec["min"]))
+            max_val = Decimal(str(col_spec["max"]))
+            lo, hi = float(min_val), float(max_val)
+
+            plain = np.array([NUM_RE.fullmatch(v) is not None for v in vals], dtype=bool)
+            x = np.full(len(vals), np.nan)
+            x[plain] = vals[plain].astype(float)
+            for u in np.flatnonzero(plain & ((x < lo) | (x > hi))):
+                found[u] = (NumSpecError, f"{min_val}〜{max_val}の範囲外")
+            # float では判定できない値（境界と等しい値・NUM_RE 以外の形式）は Decimal で確認する
+            for u in np.flatnonzero(nonempty & (~plain | (x == lo) | (x == hi))):
+                reason = _num_spec_violation(vals[u], min_val, max_val)
+                if reason is not None:
+                    found[u] = (NumSpecError, reason)
+
+        elif col_type == "category":
+            allowed = set(col_spec.get("values", []))
+            bad = nonempty & ~pd.Series(vals, dtype=object).isin(allowed).to_numpy(dtype=bool)
+            for u in np.flatnonzero(bad):
+                found[u] = (CatSpecError, f"許可されていない値（{allowed}）")
+
+        elif col_type == "date":
+            # yyyy-mm-dd 固定
+            min_dt = pd.to_datetime(col_spec["min"], format="%Y-%m-%d", errors="raise")
+            max_dt = pd.to_datetime(col_spec["max"], format="%Y-%m-%d", errors="raise")
+
+            ymd = nonempty & np.array([YMD_RE.match(v) is not None for v in vals], dtype=bool)
+            for u in np.flatnonzero(nonempty & ~ymd):
+                found[u] = (ColSpecError, "日付形式違反（yyyy-mm-dd）")
+            pos = np.flatnonzero(ymd)
+            dt = pd.to_datetime(pd.Series(vals[pos], dtype=object), format="%Y-%m-%d", errors="coerce")
+            nat = dt.isna().to_numpy(dtype=bool)
+            outside = ~nat & ((dt < min_dt) | (dt > max_dt)).to_numpy(dtype=bool)
+            for u in pos[nat]:
+                found[u] = (ColSpecError, "日付変換不可（yyyy-mm-dd）")
+            for u in pos[outside]:
+                found[u] = (ColSpecError, f"{min_dt.strftime('%Y-%m-%d')}〜{max_dt.strftime('%Y-%m-%d')}の範囲外")
+
+        if not found:
+            return []
+        bad_codes = np.zeros(len(vals), dtype=bool)
+        bad_codes[list(found)] = True
+        labels = col_vals.index
+        errors = []
+        for i in np.flatnonzero(bad_codes[codes]):
+            err_cls, reason = found[codes[i]]
+            errors.append(err_cls(labels[i:i+1].tolist()[0]+1, col, vals[codes[i]], reason))
+        return errors
+
+    @classmethod
+    def check_col_specs(cls, df:pd.DataFrame):
+        """
+        各列の値が仕様（COL_SPECS）を満たすか確認する（列単位の演算。エラーは check_col_specs_loop と同じ）
+        """
+        cls._check_col_specs(df, cls._col_spec_errors)
+
+    @classmethod
+    def check_col_specs_loop(cls, df:pd.DataFrame):
+        """
+        check_col_specs と同じチェックを1セルずつ行う（確認用）
+        """
+        cls._check_col_specs(df, cls._col_spec_errors_loop)
+
+    @classmethod
+    def compare_col_specs_checks(cls, df:pd.DataFrame) -> bool:
+        """
+        check_col_specs と check_col_specs_loop の結果（送出される例外とその中のエラー）が一致するか確認する。
+        一致しなければ、最初に食い違うエラーを添えて ValueError を送出する（一致すれば True を返す）
+        """
+        def outcome(check):
+            try:
+                check(df)
+            except ExceptionGroup as eg:
+                # 値に NaN を含むことがあるので repr で比べる
+                return [(type(e), repr(e.args)) for e in eg.exceptions]
+            except Exception as e:
+                return [(type(e), repr(e.args))]
+            return []
+        fast, loop = outcome(cls.check_col_specs), outcome(cls.check_col_specs_loop)
+        if fast != loop:
+            i = next((i for i, (a, b) in enumerate(zip(fast, loop)) if a != b), min(len(fast), len(loop)))
+            first = lambda errs: f"{errs[i][0].__name__}{errs[i][1]}" if i < len(errs) else "なし"
+            raise ValueError(f"check_col_specs と check_col_specs_loop のエラーが一致しない"
+                             f"（{len(fast)}件 / {len(loop)}件、{i}番目: {first(fast)} / {first(loop)}）")
+        return True
+
     @classmethod
     def check_format(cls, in_df:pd.DataFrame):
         df = in_df.astype(str)